@@ -2,13 +2,21 @@
 SMS Gateway Avanzado - Recepción y Estados de Mensaje
 """
 import asyncio
-import threading
+import itertools
 import time
 import re
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 from dataclasses import dataclass
 from sms_engine_ultra_simple import SMSEngine
+from at_multiplexer import UnsolicitedResult
+from inbound_index import InboundIndex, message_key
+from store_ingestion import StoreIngester
+from reply_index import ReplyIndex
+from delivery_reports import DeliveryTracker, enable_status_reports, parse_status_report
+
+# Sufijo para que dos envíos en el mismo segundo no compartan message_id
+_message_ids = itertools.count(1)
 
 @dataclass
 class ReceivedSMS:
@@ -36,14 +44,20 @@ class AdvancedSMSEngine(SMSEngine):
     def __init__(self):
         super().__init__()
         self.message_tracker: Dict[str, MessageStatus] = {}
+        self.replies = ReplyIndex()  # Envíos que esperan respuesta, por número
+        self.deliveries = DeliveryTracker()  # Envíos que esperan reporte, por <mr>
         self.received_messages: List[ReceivedSMS] = []
+        self.inbound = InboundIndex()  # Para evitar duplicados
+        self.ingester = StoreIngester(self)  # Guarda en SQLite y borra con AT+CMGD
         self.monitoring_active = False
-        self.monitor_thread: Optional[threading.Thread] = None
+        self._unsubscribe_urc: Optional[Callable[[], None]] = None
+        self._ingest_task: Optional[asyncio.Task] = None
+        self._ingest_pending = False
     
     async def send_sms_with_tracking(self, phone_number: str, message: str, message_id: str = None) -> MessageStatus:
         """Envía SMS con tracking completo"""
         if not message_id:
-            message_id = f"msg_{int(time.time())}"
+            message_id = f"msg_{int(time.time())}_{next(_message_ids)}"
         
         # Crear registro de tracking
         status = MessageStatus(
@@ -61,6 +75,9 @@ class AdvancedSMSEngine(SMSEngine):
         if result.success:
             status.status = "sent"
             status.operator_reference = result.reference_id
+            self.replies.add(phone_number, message_id, status.sent_time.timestamp())
+            if result.reference_id and result.reference_id.isdigit():
+                self.deliveries.register(self.modem.name, result.reference_id, message_id)
             print(f"✅ SMS {message_id} enviado. Ref: {result.reference_id}")
         else:
             status.status = "failed"
@@ -74,14 +91,18 @@ class AdvancedSMSEngine(SMSEngine):
             return
         
         try:
-            # Intentar diferentes configuraciones CNMI
-            cnmi_configs = [
-                "1,1,0,0,0",  # Configuración básica
-                "0,0,0,0,0",  # Sin notificaciones (polling manual)
-                "2,1,0,0,0",  # Almacenar y notificar
-            ]
+            # Con reportes de entrega (ds=1); si no, las configuraciones de siempre
+            if await enable_status_reports(self.modem):
+                cnmi_configs = []
+                print("✅ Reportes de entrega activados")
+            else:
+                cnmi_configs = [
+                    "1,1,0,0,0",  # Configuración básica
+                    "0,0,0,0,0",  # Sin notificaciones (polling manual)
+                    "2,1,0,0,0",  # Almacenar y notificar
+                ]
             
-            cnmi_success = False
+            cnmi_success = not cnmi_configs
             for config in cnmi_configs:
                 try:
                     await self._send_command(f"AT+CNMI={config}")
@@ -96,22 +117,12 @@ class AdvancedSMSEngine(SMSEngine):
             
             print("🔔 Monitoreo de mensajes activado")
             
-            self.monitoring_active = True
-            self.monitor_thread = threading.Thread(
-                target=self._monitor_loop,
-                daemon=True
-            )
-            self.monitor_thread.start()
-            
         except Exception as e:
             print(f"❌ Error iniciando monitoreo: {e}")
-            # Continuar con polling manual
-            self.monitoring_active = True
-            self.monitor_thread = threading.Thread(
-                target=self._monitor_loop,  # Usar el mismo loop
-                daemon=True
-            )
-            self.monitor_thread.start()
+        
+        # Los URC llegan por el multiplexor: nadie más lee el puerto
+        self.monitoring_active = True
+        self._unsubscribe_urc = self.modem.subscribe(self._on_urc)
     
     def _polling_loop(self):
         """Loop de polling manual para verificar mensajes"""
@@ -149,6 +160,12 @@ class AdvancedSMSEngine(SMSEngine):
     def _process_stored_message(self, msg_data):
         """Procesa un mensaje almacenado como si fuera entrante"""
         try:
+            # Evitar duplicados
+            key = message_key(msg_data['sender'], msg_data.get('timestamp'),
+                              msg_data.get('index'), msg_data['message'])
+            if not self.inbound.add(key):
+                return
+            
             received_msg = ReceivedSMS(
                 phone_number=msg_data['sender'],
                 message=msg_data['message'],
@@ -158,46 +175,44 @@ class AdvancedSMSEngine(SMSEngine):
             # Verificar si es respuesta
             self._check_if_response(received_msg)
             
-            # Evitar duplicados
-            msg_signature = f"{received_msg.phone_number}_{received_msg.message}_{received_msg.timestamp.date()}"
-            if not hasattr(self, '_processed_messages'):
-                self._processed_messages = set()
-            
-            if msg_signature not in self._processed_messages:
-                self.received_messages.append(received_msg)
-                self._processed_messages.add(msg_signature)
-                print(f"📥 SMS detectado de {received_msg.phone_number}: {received_msg.message}")
+            self.received_messages.append(received_msg)
+            print(f"📥 SMS detectado de {received_msg.phone_number}: {received_msg.message}")
             
         except Exception as e:
             print(f"❌ Error procesando mensaje almacenado: {e}")
     
-    def _monitor_loop(self):
-        """Loop de monitoreo en hilo separado"""
-        buffer = ""
+    def _on_urc(self, urc: UnsolicitedResult):
+        """Recibe los códigos no solicitados del multiplexor"""
+        if not self.monitoring_active:
+            return
         
-        while self.monitoring_active and self.is_connected:
+        if urc.line.startswith('+CMT:'):
+            # Mensaje SMS entrante (el texto viene en la línea siguiente)
+            self._process_incoming_sms(urc.line, urc.body or "")
+        elif urc.line.startswith('+CMTI:'):
+            # Mensaje guardado en la memoria: leer, guardar y borrar
+            self._ingest_pending = True
+            if self._ingest_task is None or self._ingest_task.done():
+                self._ingest_task = asyncio.get_running_loop().create_task(self._ingest_store())
+        elif urc.line.startswith('+CDS:'):
+            # Reporte de entrega
+            self._process_delivery_report(urc)
+    
+    async def _ingest_store(self):
+        """Procesa lo nuevo de la memoria del módem (una pasada del ingestor)"""
+        # Un +CMTI que llega durante la pasada pide otra
+        while self._ingest_pending:
+            self._ingest_pending = False
             try:
-                if self.serial_connection and self.serial_connection.in_waiting > 0:
-                    data = self.serial_connection.read(self.serial_connection.in_waiting)
-                    buffer += data.decode('utf-8', errors='ignore')
-                    
-                    # Procesar líneas completas
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.strip()
-                        
-                        if line.startswith('+CMT:'):
-                            # Mensaje SMS entrante
-                            self._process_incoming_sms(line, buffer)
-                        elif line.startswith('+CDS:'):
-                            # Reporte de entrega
-                            self._process_delivery_report(line)
-                
-                time.sleep(0.5)
-                
+                for msg in await self.ingester.sweep():
+                    self._process_stored_message({
+                        'index': msg['index'],
+                        'sender': msg['sender'],
+                        'timestamp': msg.get('timestamp'),
+                        'message': msg['content']
+                    })
             except Exception as e:
-                print(f"❌ Error en monitoreo: {e}")
-                time.sleep(2)
+                print(f"❌ Error leyendo la memoria del módem: {e}")
     
     def _process_incoming_sms(self, header_line: str, buffer: str):
         """Procesa SMS entrante"""
@@ -229,41 +244,42 @@ class AdvancedSMSEngine(SMSEngine):
     
     def _check_if_response(self, received_msg: ReceivedSMS):
         """Verifica si el mensaje es respuesta a uno enviado"""
-        # Buscar mensajes enviados al mismo número en las últimas 24 horas
-        for msg_id, status in self.message_tracker.items():
-            if (status.phone_number == received_msg.phone_number and 
-                status.status == "sent" and
-                status.sent_time and
-                (datetime.now() - status.sent_time).total_seconds() < 86400):
-                
-                # Marcar como respuesta recibida
-                status.status = "response_received"
-                status.response_time = received_msg.timestamp
-                status.response_message = received_msg.message
-                received_msg.is_response = True
-                received_msg.related_sent_id = msg_id
-                
-                print(f"💬 Respuesta recibida para mensaje {msg_id}")
-                break
+        # Envío más reciente al mismo número en las últimas 24 horas
+        msg_id = self.replies.match(received_msg.phone_number)
+        status = self.message_tracker.get(msg_id) if msg_id else None
+        if status is None:
+            return
+        
+        # Marcar como respuesta recibida
+        status.status = "response_received"
+        status.response_time = received_msg.timestamp
+        status.response_message = received_msg.message
+        received_msg.is_response = True
+        received_msg.related_sent_id = msg_id
+        
+        print(f"💬 Respuesta recibida para mensaje {msg_id}")
     
-    def _process_delivery_report(self, line: str):
+    def _process_delivery_report(self, urc: UnsolicitedResult):
         """Procesa reporte de entrega"""
         try:
-            # +CDS: <fo>,<mr>,<ra>,<tora>,<scts>,<dt>,<st>
-            print(f"📨 Reporte de entrega: {line}")
+            print(f"📨 Reporte de entrega: {urc.line}")
+            report = parse_status_report(urc)
+            if report is None:
+                return
             
-            # Extraer referencia del mensaje
-            parts = line.replace('+CDS:', '').split(',')
-            if len(parts) >= 2:
-                message_ref = parts[1].strip()
-                
-                # Buscar mensaje por referencia
-                for status in self.message_tracker.values():
-                    if status.operator_reference == message_ref:
-                        status.status = "delivered"
-                        status.delivered_time = datetime.now()
-                        print(f"✅ Mensaje {status.message_id} entregado")
-                        break
+            # Búsqueda directa por (módem, <mr>, época), no por recorrido
+            message_id = self.deliveries.resolve(self.modem.name, report)
+            status = self.message_tracker.get(message_id) if message_id else None
+            if status is None:
+                return
+            
+            if report.state == 'delivered':
+                status.status = "delivered"
+                status.delivered_time = datetime.now()
+                print(f"✅ Mensaje {status.message_id} entregado")
+            elif report.state == 'failed':
+                status.status = "failed"
+                print(f"❌ Mensaje {status.message_id} no entregado (estado {report.status})")
                         
         except Exception as e:
             print(f"❌ Error procesando reporte: {e}")
@@ -285,32 +301,20 @@ class AdvancedSMSEngine(SMSEngine):
     async def check_stored_messages(self) -> List[Dict]:
         """Verifica mensajes almacenados en el gateway"""
         try:
-            response = await self._send_command('AT+CMGL="ALL"')
+            response = await self.modem.execute('AT+CMGL="ALL"', timeout=10)
             messages = []
             
-            # Parsear respuesta de mensajes almacenados
-            lines = response.split('\n')
-            i = 0
-            while i < len(lines):
-                line = lines[i].strip()
-                if line.startswith('+CMGL:'):
-                    # +CMGL: <index>,<stat>,<oa>,<alpha>,<scts>
-                    parts = line.split(',')
-                    if len(parts) >= 3:
-                        index = parts[0].replace('+CMGL:', '').strip()
-                        status = parts[1].strip().strip('"')
-                        sender = parts[2].strip().strip('"')
-                        
-                        # El mensaje está en la siguiente línea
-                        if i + 1 < len(lines):
-                            message_text = lines[i + 1].strip()
-                            messages.append({
-                                'index': index,
-                                'status': status,
-                                'sender': sender,
-                                'message': message_text
-                            })
-                i += 1
+            # +CMGL: <index>,<stat>,<oa>,<alpha>,<scts> (el texto viene en record.body)
+            for record in response.records_named('+CMGL'):
+                params = record.params
+                if len(params) >= 3:
+                    messages.append({
+                        'index': params[0],
+                        'status': params[1],
+                        'sender': params[2],
+                        'timestamp': params[4] if len(params) >= 5 else None,
+                        'message': record.body or ''
+                    })
             
             return messages
             
@@ -321,8 +325,9 @@ class AdvancedSMSEngine(SMSEngine):
     async def stop_monitoring(self):
         """Detiene el monitoreo"""
         self.monitoring_active = False
-        if self.monitor_thread:
-            self.monitor_thread.join(timeout=5)
+        if self._unsubscribe_urc:
+            self._unsubscribe_urc()
+            self._unsubscribe_urc = None
         print("🔔 Monitoreo detenido")
 
 # Instancia global avanzada
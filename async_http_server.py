@@ -0,0 +1,257 @@
+"""
+Servidor HTTP Asíncrono
+HTTP/1.1 mínimo sobre asyncio streams con keep-alive: cada cliente
+conectado cuesta una corrutina en espera, no un hilo del sistema
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADERS = 100
+MAX_BODY = 1024 * 1024
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+}
+
+class HTTPError(Exception):
+    """Petición inválida: se responde con `status` y se cierra la conexión"""
+
+    def __init__(self, status: int, message: str = ''):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+@dataclass
+class HTTPRequest:
+    method: str
+    path: str
+    version: str
+    headers: Dict[str, str]
+    body: bytes = b''
+    query: Dict[str, list] = field(default_factory=dict)
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode('utf-8')) if self.body else {}
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+@dataclass
+class HTTPResponse:
+    status: int = 200
+    body: bytes = b''
+    content_type: str = 'application/json'
+    headers: Dict[str, str] = field(default_factory=dict)
+    stream: Optional[AsyncIterator[bytes]] = None   # Cuerpo sin largo fijo (SSE)
+
+    @classmethod
+    def json(cls, data: Any, status: int = 200) -> 'HTTPResponse':
+        return cls(status=status,
+                   body=json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                   headers=dict(CORS_HEADERS))
+
+    @classmethod
+    def html(cls, text: str) -> 'HTTPResponse':
+        return cls(body=text.encode('utf-8'), content_type='text/html; charset=utf-8')
+
+Handler = Callable[[HTTPRequest], Awaitable[HTTPResponse]]
+
+class AsyncHTTPServer:
+    """Enruta (método, ruta) -> corrutina y mantiene las conexiones abiertas
+
+    Las conexiones inactivas se cierran tras `keep_alive_timeout` segundos
+    sin una nueva petición.
+    """
+
+    def __init__(self, routes: Dict[Tuple[str, str], Handler], host: str = '0.0.0.0',
+                 port: int = 8000, keep_alive_timeout: float = 75.0,
+                 backlog: int = 1024):
+        self.routes = routes
+        self.host = host
+        self.port = port
+        self.keep_alive_timeout = keep_alive_timeout
+        self.backlog = backlog
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.requests_served = 0
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_client, self.host, self.port, backlog=self.backlog
+        )
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._connections):
+            writer.close()
+        tasks = [task for task in self._tasks if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Conexiones
+    # ------------------------------------------------------------------
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections.add(writer)
+        self._tasks.add(task)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._write(writer, HTTPResponse.json({'error': str(e)}, e.status), False)
+                    break
+                if request is None:
+                    break
+
+                response = await self._dispatch(request)
+                if response.stream is not None:
+                    await self._write_stream(writer, response)
+                    self.requests_served += 1
+                    break
+
+                keep_alive = request.keep_alive
+                await self._write(writer, response, keep_alive, request.method == 'HEAD')
+                self.requests_served += 1
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # stop(): el servidor se está cerrando
+        finally:
+            self._connections.discard(writer)
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[HTTPRequest]:
+        """None si el cliente cerró o quedó inactivo demasiado tiempo"""
+
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+        except asyncio.TimeoutError:
+            return None
+        except (asyncio.LimitOverrunError, ValueError):
+            # Línea de petición más larga que el límite del StreamReader
+            raise HTTPError(431)
+        if not line:
+            return None
+
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Línea de petición inválida")
+
+        headers = {}
+        while True:
+            try:
+                header = await reader.readline()
+            except (asyncio.LimitOverrunError, ValueError):
+                raise HTTPError(431)
+            if header in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(431)
+            name, _, value = header.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'transfer-encoding' in headers:
+            raise HTTPError(501, "Transfer-Encoding no soportado")
+
+        body = b''
+        # Sólo dígitos ASCII: int() aceptaría '-1', '+1' o '1_0'
+        value = headers.get('content-length') or '0'
+        if not (value.isascii() and value.isdigit()):
+            raise HTTPError(400, "Content-Length inválido")
+        length = int(value)
+        if length > MAX_BODY:
+            raise HTTPError(413)
+        if length:
+            body = await reader.readexactly(length)
+
+        url = urlparse(target)
+        return HTTPRequest(method=method.upper(), path=url.path, version=version,
+                           headers=headers, body=body, query=parse_qs(url.query))
+
+    async def _dispatch(self, request: HTTPRequest) -> HTTPResponse:
+        if request.method == 'OPTIONS':
+            return HTTPResponse(status=204, headers=dict(CORS_HEADERS))
+
+        method = 'GET' if request.method == 'HEAD' else request.method
+        handler = self.routes.get((method, request.path))
+        if handler is None:
+            message = "Página no encontrada" if method == 'GET' else "Endpoint no encontrado"
+            return HTTPResponse.json({'error': message}, 404)
+
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"❌ Error en {request.method} {request.path}: {e}")
+            return HTTPResponse.json({'error': str(e)}, 500)
+
+    async def _write(self, writer: asyncio.StreamWriter, response: HTTPResponse,
+                     keep_alive: bool, head_only: bool = False):
+        status = HTTPStatus(response.status)
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        headers = {'Connection': 'keep-alive' if keep_alive else 'close'}
+        if response.status not in (204, 304):
+            headers['Content-Type'] = response.content_type
+            headers['Content-Length'] = str(len(response.body))
+        headers.update(response.headers)
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head_only:
+            writer.write(response.body)
+        await writer.drain()
+
+    async def _write_stream(self, writer: asyncio.StreamWriter, response: HTTPResponse):
+        """Cabeceras y luego cada fragmento a medida que llega; la conexión se cierra al final"""
+
+        status = HTTPStatus(response.status)
+        headers = {'Content-Type': response.content_type, 'Connection': 'close'}
+        headers.update(response.headers)
+        head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+        try:
+            async for chunk in response.stream:
+                writer.write(chunk)
+                await writer.drain()
+        finally:
+            if hasattr(response.stream, 'aclose'):
+                await response.stream.aclose()
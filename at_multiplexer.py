@@ -0,0 +1,490 @@
+"""
+Multiplexor de Comandos AT
+Un único actor es dueño del puerto: serializa los comandos en una cola con
+prioridad, asocia cada código final al comando que lo originó y reparte los
+códigos no solicitados (URC) a los suscriptores
+"""
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from serial_transport import AsyncSerialTransport
+from at_parser import (
+    ATResponseParser, FinalResult, IntermediateResult, Prompt, UnsolicitedResult, command_name,
+)
+from metrics import AT_COMMAND_SECONDS, AT_COMMANDS, SMS_FAILED, SMS_IN_FLIGHT, SMS_SENT, Gauge
+from at_trace import CMD, END, RX, TX, URC, TraceRecorder, default_recorder
+
+logger = logging.getLogger(__name__)
+
+# Prioridades (menor = antes)
+PRIORITY_HIGH = 0      # Envíos SMS
+PRIORITY_NORMAL = 5    # Comandos de configuración / consultas
+PRIORITY_LOW = 10      # Sondeos periódicos (estado, CMGL)
+
+# Tras un timeout el código final puede llegar tarde y tomarse como el del
+# comando siguiente: antes de seguir se envía una consulta cuya respuesta
+# trae un registro propio y se descarta todo código final previo a él
+RESYNC_COMMANDS = ('AT+CSCS?', 'AT+CMGF?')
+RESYNC_TIMEOUT = 2.0
+
+# Multiplexores vivos, para informar su cola en /metrics
+_instances: 'weakref.WeakSet[ATCommandMultiplexer]' = weakref.WeakSet()
+
+def _queue_depths() -> Dict[Tuple[str], int]:
+    return {(multiplexer.name,): multiplexer.queue_depth
+            for multiplexer in list(_instances) if multiplexer.is_running}
+
+AT_QUEUE_DEPTH = Gauge('sms_gateway_at_queue_depth', 'Comandos AT esperando en la cola de cada módem',
+                       ('modem',), collect=_queue_depths)
+
+def _rounded(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds, 6)
+
+class ATCommandError(Exception):
+    """Error devuelto por el módem (ERROR, +CMS ERROR, timeout)"""
+
+    def __init__(self, message: str, command: str = '', response: str = '',
+                 error_code: Optional[str] = None):
+        super().__init__(message)
+        self.command = command
+        self.response = response
+        self.error_code = error_code
+
+@dataclass
+class ATResponse:
+    command: str
+    records: List[IntermediateResult]
+    final: FinalResult
+
+    @property
+    def lines(self) -> List[str]:
+        lines = []
+        for record in self.records:
+            lines.append(record.line)
+            if record.body is not None:
+                lines.append(record.body)
+        return lines
+
+    @property
+    def text(self) -> str:
+        """Respuesta completa como texto (compatible con el parseo existente)"""
+        return '\r\n'.join(self.lines + [self.final.line])
+
+    @property
+    def ok(self) -> bool:
+        return self.final.ok
+
+    def records_named(self, name: str) -> List[IntermediateResult]:
+        """Registros con un prefijo dado ('+CMGL', '+CSQ', ...)"""
+        return [record for record in self.records if record.name == name]
+
+@dataclass(order=True)
+class _PendingCommand:
+    priority: int
+    seq: int
+    command: str = field(compare=False)
+    body: Optional[Union[str, bytes]] = field(compare=False, default=None)
+    timeout: float = field(compare=False, default=5.0)
+    prompt_timeout: float = field(compare=False, default=15.0)
+    future: Any = field(compare=False, default=None)
+    queued_at: float = field(compare=False, default=0.0)
+    records: List[IntermediateResult] = field(compare=False, default_factory=list)
+    final: Optional[FinalResult] = field(compare=False, default=None)
+
+    @property
+    def partial_text(self) -> str:
+        lines = [record.line for record in self.records]
+        if self.final is not None:
+            lines.append(self.final.line)
+        return '\r\n'.join(lines)
+
+class ATCommandMultiplexer:
+    """Dueño único del puerto serie de un módem
+
+    Todos los comandos pasan por execute(): se encolan por prioridad y un
+    solo worker los escribe de a uno, sin reset_input_buffer(). Un lector
+    dedicado pasa los bytes por ATResponseParser: los registros del comando
+    en curso se acumulan hasta el código final; los URC (+CMT, +CDS, ...) se
+    entregan a los suscriptores aunque lleguen en medio de otra respuesta.
+    Con `trace` (por defecto, el de AT_TRACE) se graba toda la sesión.
+    """
+
+    def __init__(self, transport: AsyncSerialTransport, name: str = 'modem',
+                 trace: Optional[TraceRecorder] = None):
+        self.transport = transport
+        self.name = name
+        self.trace = trace if trace is not None else default_recorder()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._seq = itertools.count()
+        self._subscribers: List[Callable[[UnsolicitedResult], Any]] = []
+        self._active: Optional[_PendingCommand] = None
+        self._active_done: Optional[asyncio.Event] = None
+        self._prompt_event: Optional[asyncio.Event] = None
+        self._parser = ATResponseParser()
+        self._running = False
+        self._stale: Optional[str] = None    # Comando que venció sin código final
+        self._probe: Optional[_PendingCommand] = None   # Consulta de resincronización sin contestar
+        _instances.add(self)
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """Arranca el lector y el worker en el loop actual"""
+
+        await self.stop()
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._active_done = asyncio.Event()
+        self._prompt_event = asyncio.Event()
+        self._parser.reset()
+        self._stale = None
+        self._probe = None
+        self._running = True
+        self._reader_task = self._loop.create_task(self._reader_loop())
+        self._worker_task = self._loop.create_task(self._worker_loop())
+
+    async def stop(self):
+        """Detiene lector y worker; los comandos pendientes fallan"""
+
+        self._running = False
+        current = None
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+
+        for task in (self._reader_task, self._worker_task):
+            if task and not task.done() and self._loop is current:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending = self._queue.get_nowait()
+                try:
+                    if not pending.future.done():
+                        pending.future.set_exception(ATCommandError("Multiplexor detenido", pending.command))
+                except RuntimeError:
+                    pass  # Su loop ya fue cerrado
+
+        self._reader_task = None
+        self._worker_task = None
+        self._active = None
+
+    @property
+    def is_running(self) -> bool:
+        return (self._running and self._worker_task is not None
+                and not self._worker_task.done())
+
+    async def _ensure_owner(self) -> bool:
+        """True si el loop actual es el dueño; reinicia si el dueño murió"""
+
+        current = asyncio.get_running_loop()
+        if self._loop is current and self.is_running:
+            return True
+        if self._loop is not None and self._loop is not current and self._loop.is_running() and self.is_running:
+            return False
+
+        # El loop dueño ya no corre (p.ej. loop temporal cerrado): tomar posesión
+        await self.start()
+        return True
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    async def execute(self, command: str, timeout: float = 5.0,
+                      priority: int = PRIORITY_NORMAL, body: Optional[Union[str, bytes]] = None,
+                      prompt_timeout: float = 15.0) -> ATResponse:
+        """Encola un comando y espera su código final
+
+        Si se pasa `body`, el comando espera el prompt '>' y luego envía el
+        cuerpo terminado en Ctrl+Z (AT+CMGS / AT+CMGW). Un `body` str se
+        escribe en UTF-8; uno bytes, tal cual (juego "GSM" de AT+CSCS).
+        """
+
+        if await self._ensure_owner():
+            return await self._submit(command, timeout, priority, body, prompt_timeout)
+
+        # Llamado desde otro hilo/loop: delegar en el loop dueño
+        future = asyncio.run_coroutine_threadsafe(
+            self._submit(command, timeout, priority, body, prompt_timeout),
+            self._loop
+        )
+        return await asyncio.wait_for(
+            asyncio.wrap_future(future),
+            timeout + (prompt_timeout if body is not None else 0) + 5
+        )
+
+    async def _submit(self, command, timeout, priority, body, prompt_timeout) -> ATResponse:
+        pending = _PendingCommand(
+            priority=priority,
+            seq=next(self._seq),
+            command=command,
+            body=body,
+            timeout=timeout,
+            prompt_timeout=prompt_timeout,
+            future=self._loop.create_future(),
+            queued_at=time.monotonic()
+        )
+        self._queue.put_nowait(pending)
+        if body is None:
+            return await pending.future
+        
+        # Un comando con cuerpo (AT+CMGS) es un SMS en curso hasta su código final
+        SMS_IN_FLIGHT.inc(self.name)
+        try:
+            return await pending.future
+        finally:
+            SMS_IN_FLIGHT.dec(self.name)
+
+    def subscribe(self, callback: Callable[[UnsolicitedResult], Any]) -> Callable[[], None]:
+        """Registra un suscriptor de URC; devuelve la función para darse de baja"""
+
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # ------------------------------------------------------------------
+    # Worker: escribe de a un comando
+    # ------------------------------------------------------------------
+
+    async def _worker_loop(self):
+        while self._running:
+            pending = await self._queue.get()
+            if pending.future.done():
+                continue
+
+            try:
+                if self._stale is not None and not await self._resync():
+                    self._requeue(pending)
+                    continue
+                response = await self._run(pending)
+                if not pending.future.done():
+                    pending.future.set_result(response)
+            except asyncio.CancelledError:
+                if not pending.future.done():
+                    pending.future.set_exception(ATCommandError("Multiplexor detenido", pending.command))
+                raise
+            except Exception as e:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            finally:
+                self._active = None
+
+    async def _run(self, pending: _PendingCommand) -> ATResponse:
+        self._active = pending
+        self._active_done.clear()
+        self._prompt_event.clear()
+        self._parser.begin(pending.command, expects_prompt=pending.body is not None)
+
+        name = command_name(pending.command)
+        started = time.monotonic()
+        AT_COMMAND_SECONDS.observe(started - pending.queued_at, self.name, name, 'queue')
+        if self.trace is not None:
+            body = pending.body.decode('latin-1') if isinstance(pending.body, bytes) else pending.body
+            self.trace.record(self.name, CMD, pending.command, body=body,
+                              timeout=pending.timeout, prompt_timeout=pending.prompt_timeout)
+        prompt_seconds = None
+
+        if pending.body is None:
+            self._write((pending.command + '\r\n').encode('utf-8'))
+        else:
+            self._write((pending.command + '\r').encode('utf-8'))
+
+            waiters = [
+                self._loop.create_task(self._prompt_event.wait()),
+                self._loop.create_task(self._active_done.wait()),
+            ]
+            done, not_done = await asyncio.wait(
+                waiters,
+                timeout=pending.prompt_timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for waiter in not_done:
+                waiter.cancel()
+
+            if self._active_done.is_set():
+                self._finish(pending, name, 'error', response=time.monotonic() - started)
+                raise self._error_for(pending)
+            if not self._prompt_event.is_set():
+                # Cancelar la entrada pendiente del módem
+                self._write(b'\x1b')
+                self._stale = pending.command
+                self._finish(pending, name, 'no_prompt')
+                raise ATCommandError(
+                    f"Sin prompt. Respuesta: {pending.partial_text}",
+                    pending.command, pending.partial_text
+                )
+
+            prompted = time.monotonic()
+            prompt_seconds = prompted - started
+            AT_COMMAND_SECONDS.observe(prompt_seconds, self.name, name, 'prompt')
+            started = prompted
+            body = pending.body
+            if isinstance(body, str):
+                body = body.encode('utf-8', errors='ignore')
+            self._write(body + b'\x1a')
+
+        try:
+            await asyncio.wait_for(self._active_done.wait(), pending.timeout)
+        except asyncio.TimeoutError:
+            self._stale = pending.command
+            self._finish(pending, name, 'timeout', prompt_seconds)
+            raise ATCommandError(
+                f"Timeout esperando respuesta: {pending.command}\n{pending.partial_text}",
+                pending.command, pending.partial_text
+            )
+
+        # En AT+CMGS es la espera de la confirmación del SMSC
+        response_seconds = time.monotonic() - started
+        AT_COMMAND_SECONDS.observe(response_seconds, self.name, name, 'response')
+        response = ATResponse(command=pending.command, records=pending.records, final=pending.final)
+        if not response.ok:
+            self._finish(pending, name, 'error', prompt_seconds, response_seconds)
+            raise self._error_for(pending)
+        self._finish(pending, name, 'ok', prompt_seconds, response_seconds)
+        return response
+
+    def _requeue(self, pending: _PendingCommand):
+        """Vuelve a la cola un comando que no se escribió porque el módem no se resincronizó
+
+        Conserva su lugar (misma prioridad y orden). Sólo falla si el módem
+        sigue sin contestar cuando ya habría vencido su propio `timeout`.
+        """
+        if time.monotonic() - pending.queued_at < pending.timeout:
+            self._queue.put_nowait(pending)
+            return
+        self._finish(pending, command_name(pending.command), 'timeout')
+        pending.future.set_exception(ATCommandError(
+            f"Timeout: el módem no responde desde el timeout de {self._stale}", pending.command))
+
+    async def _resync(self) -> bool:
+        """Descarta el código final atrasado del comando que venció; False si el módem no contestó"""
+
+        probe = self._probe
+        if probe is None:
+            # Una sola consulta por timeout: si se reintenta se sigue esperando la misma
+            # (una segunda respuesta llegaría tarde y se tomaría como la del comando siguiente)
+            stale = command_name(self._stale)
+            command = next(c for c in RESYNC_COMMANDS if command_name(c) != stale)
+            probe = self._probe = _PendingCommand(priority=PRIORITY_HIGH, seq=next(self._seq), command=command)
+            self._active_done.clear()
+            self._parser.begin(command, marked=True)
+            self._write((command + '\r\n').encode('utf-8'))
+
+        if probe.final is None:
+            self._active = probe
+            try:
+                await asyncio.wait_for(self._active_done.wait(), RESYNC_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Ningún comando se escribe hasta resincronizar: su respuesta podría confundirse
+                logger.warning(f"⚠️ [{self.name}] Sin respuesta al resincronizar tras timeout de {self._stale}")
+                return False
+            finally:
+                self._active = None
+        logger.debug(f"[{self.name}] Resincronizado tras timeout de {self._stale}")
+        self._stale = None
+        self._probe = None
+        return True
+
+    def _write(self, data: bytes):
+        self.transport.write(data)
+        if self.trace is not None:
+            self.trace.record(self.name, TX, data)
+
+    def _finish(self, pending: _PendingCommand, name: str, result: str,
+                prompt: Optional[float] = None, response: Optional[float] = None):
+        """Métricas y traza del resultado de un comando"""
+        code = (pending.final.error_code if pending.final else None) or ''
+        AT_COMMANDS.inc(self.name, name, result, code)
+        if self.trace is not None:
+            self.trace.record(self.name, END, pending.command, result=result, code=code or None,
+                              final=pending.final.line if pending.final else None,
+                              prompt=_rounded(prompt), response=_rounded(response))
+        if pending.body is None:
+            return
+        if result == 'ok':
+            SMS_SENT.inc(self.name)
+        else:
+            # Sin código +CMS: ERROR a secas, timeout o sin prompt
+            SMS_FAILED.inc(self.name, code or (pending.final.line if pending.final else result))
+
+    def _error_for(self, pending: _PendingCommand) -> ATCommandError:
+        text = pending.partial_text
+        return ATCommandError(
+            f"Comando falló: {pending.command}\n{text}",
+            pending.command, text,
+            error_code=pending.final.error_code if pending.final else None
+        )
+
+    # ------------------------------------------------------------------
+    # Lector: separa líneas, respuestas y URC
+    # ------------------------------------------------------------------
+
+    async def _reader_loop(self):
+        while self._running:
+            try:
+                chunk = await self.transport.read(3600)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ [{self.name}] Lector AT detenido: {e}")
+                self._running = False
+                if self._active and not self._active.future.done():
+                    self._active.future.set_exception(ATCommandError(str(e), self._active.command))
+                return
+
+            if chunk:
+                if self.trace is not None:
+                    self.trace.record(self.name, RX, chunk)
+                self._feed(chunk)
+
+    def _feed(self, data: bytes):
+        # Entre reintentos de resincronización la respuesta sigue siendo de la consulta
+        active = self._active if self._active is not None else self._probe
+
+        for event in self._parser.feed(data):
+            if isinstance(event, UnsolicitedResult):
+                self._dispatch(event)
+            elif active is None:
+                logger.debug(f"[{self.name}] Respuesta sin comando activo descartada: {event}")
+            elif isinstance(event, IntermediateResult):
+                active.records.append(event)
+            elif isinstance(event, Prompt):
+                self._prompt_event.set()
+            elif isinstance(event, FinalResult):
+                active.final = event
+                self._active_done.set()
+
+    def _dispatch(self, urc: UnsolicitedResult):
+        if self.trace is not None:
+            self.trace.record(self.name, URC, urc.line, body=urc.body)
+        for callback in list(self._subscribers):
+            try:
+                result = callback(urc)
+                if asyncio.iscoroutine(result):
+                    self._loop.create_task(result)
+            except Exception as e:
+                logger.error(f"❌ [{self.name}] Error en suscriptor URC: {e}")
@@ -0,0 +1,248 @@
+"""
+Parser Incremental de Respuestas AT
+Consume bytes a medida que llegan del módem y emite eventos tipados
+(código final, registros intermedios, prompt '>' y URC) sin volver a
+escanear la respuesta acumulada en cada lectura
+"""
+import csv
+import functools
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+
+FINAL_OK = ('OK',)
+FINAL_ERRORS = ('ERROR', 'NO CARRIER', 'BUSY', 'NO ANSWER', 'NO DIALTONE', 'COMMAND NOT SUPPORT')
+FINAL_ERROR_PREFIXES = ('+CMS ERROR:', '+CME ERROR:')
+
+# Códigos que el módem envía por su cuenta (Huawei agrega los ^XXX)
+URC_PREFIXES = (
+    '+CMT:', '+CMTI:', '+CDS:', '+CDSI:', '+CBM:', '+CREG:', '+CGREG:',
+    'RING', '+CRING:', '^RSSI:', '^BOOT:', '^MODE:', '^SRVST:', '^SIMST:',
+    '^DSFLOWRPT:', '^HCSQ:', '^RFSWITCH:',
+)
+
+# Registros cuyo contenido viene en la(s) línea(s) siguiente(s)
+BODY_RECORDS = ('+CMGL', '+CMGR')
+
+_COMMAND_NAME = re.compile(r'AT[+^$%&]?[A-Za-z]*', re.IGNORECASE)
+
+def is_final_result(line: str) -> bool:
+    return line in FINAL_OK or line in FINAL_ERRORS or line.startswith(FINAL_ERROR_PREFIXES)
+
+def response_prefix(command: str) -> Optional[str]:
+    """'AT+CREG?' -> '+CREG'; None si el comando no tiene respuesta con prefijo"""
+    name = command[2:] if command[:2].upper() == 'AT' else command
+    if not name or name[0] not in '+^':
+        return None
+    for i, ch in enumerate(name[1:], start=1):
+        if not (ch.isalnum() or ch == '_'):
+            return name[:i]
+    return name
+
+@functools.lru_cache(maxsize=256)
+def command_name(command: str) -> str:
+    """Comando sin parámetros (métricas, trazas): 'AT+CMGS="946..."' -> 'AT+CMGS'"""
+    match = _COMMAND_NAME.match(command.strip())
+    return match.group(0).upper() if match else 'other'
+
+def parse_params(text: str) -> List[str]:
+    """'1,"REC READ","+51...",,"24/08/22"' -> ['1', 'REC READ', '+51...', '', '24/08/22']"""
+    if not text:
+        return []
+    return next(csv.reader([text], skipinitialspace=True))
+
+@dataclass
+class FinalResult:
+    line: str
+
+    @property
+    def ok(self) -> bool:
+        return self.line in FINAL_OK
+
+    @property
+    def error_code(self) -> Optional[str]:
+        """Código numérico de +CMS ERROR / +CME ERROR"""
+        if self.line.startswith(FINAL_ERROR_PREFIXES):
+            return self.line.split(':', 1)[1].strip()
+        return None
+
+@dataclass
+class IntermediateResult:
+    line: str
+    name: Optional[str] = None          # '+CMGL', '+CSQ', ... (None para texto plano)
+    params: List[str] = field(default_factory=list)
+    body: Optional[str] = None          # Texto/PDU de +CMGL, +CMGR
+
+@dataclass
+class Prompt:
+    line: str = '>'
+
+@dataclass
+class UnsolicitedResult:
+    line: str
+    body: Optional[str] = None
+
+    @property
+    def prefix(self) -> str:
+        return self.line.split(':', 1)[0] if ':' in self.line else self.line
+
+    @property
+    def params(self) -> List[str]:
+        return parse_params(self.line.split(':', 1)[1].strip()) if ':' in self.line else []
+
+ATEvent = Union[FinalResult, IntermediateResult, Prompt, UnsolicitedResult]
+
+def _split_record(line: str):
+    """'+CSQ: 20,99' -> ('+CSQ', ['20', '99'])"""
+    if line[:1] in '+^' and ':' in line:
+        name, rest = line.split(':', 1)
+        return name, parse_params(rest.strip())
+    return None, []
+
+class ATResponseParser:
+    """Máquina de estados orientada a líneas
+
+    Cada feed() procesa sólo los bytes nuevos. Con begin() se indica el
+    comando en curso para suprimir su eco y distinguir sus registros de los
+    URC; el prompt '>' sólo se reconoce si el comando lo espera.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._command: Optional[str] = None
+        self._prefix: Optional[str] = None
+        self._expects_prompt = False
+        self._awaiting: Optional[str] = None                # Prefijo que debe llegar antes del código final
+        self._record: Optional[IntermediateResult] = None   # Registro esperando cuerpo
+        self._record_has_body = False
+        self._urc: Optional[str] = None                     # URC esperando cuerpo
+        self.discarded_lines = 0
+
+    def begin(self, command: str, expects_prompt: bool = False, marked: bool = False):
+        """Comando que se acaba de escribir al módem
+
+        Con `marked`, los códigos finales que lleguen antes del registro
+        propio del comando ('+CSCS: ...' para AT+CSCS?) se descartan: son de
+        un comando anterior que venció y contestó tarde.
+        """
+        self._command = command
+        self._prefix = response_prefix(command)
+        self._expects_prompt = expects_prompt
+        self._awaiting = self._prefix if marked else None
+        self._record = None
+
+    def reset(self):
+        self._buffer.clear()
+        self._command = None
+        self._prefix = None
+        self._expects_prompt = False
+        self._awaiting = None
+        self._record = None
+        self._urc = None
+
+    @property
+    def active_command(self) -> Optional[str]:
+        return self._command
+
+    def feed(self, data: bytes) -> List[ATEvent]:
+        """Consume bytes y devuelve los eventos completos"""
+
+        events: List[ATEvent] = []
+        buffer = self._buffer
+        buffer += data
+
+        start = 0
+        while True:
+            newline = buffer.find(b'\n', start)
+            if newline < 0:
+                break
+            line = buffer[start:newline].decode('utf-8', errors='ignore').strip()
+            start = newline + 1
+            self._handle_line(line, events)
+
+        if start:
+            del buffer[:start]
+
+        # El prompt '>' no termina en salto de línea
+        if self._expects_prompt and buffer.lstrip()[:1] == b'>':
+            buffer.clear()
+            self._expects_prompt = False
+            events.append(Prompt())
+
+        return events
+
+    def _flush_record(self, events: List[ATEvent]):
+        if self._record is not None:
+            events.append(self._record)
+            self._record = None
+
+    def _handle_line(self, line: str, events: List[ATEvent]):
+        # El cuerpo sigue inmediatamente al encabezado (puede ser vacío,
+        # "OK" o empezar con '+': no se interpreta)
+        if self._urc is not None:
+            header, self._urc = self._urc, None
+            events.append(UnsolicitedResult(line=header, body=line))
+            return
+
+        if self._record is not None and not self._record_has_body:
+            self._record.body = line
+            self._record_has_body = True
+            return
+
+        if not line:
+            return
+
+        if is_final_result(line):
+            if self._awaiting is not None:
+                self._record = None
+                self.discarded_lines += 1
+                return
+            self._flush_record(events)
+            events.append(FinalResult(line=line))
+            self._command = None
+            self._prefix = None
+            self._expects_prompt = False
+            return
+
+        if line.startswith(URC_PREFIXES) and not (self._prefix and line.startswith(self._prefix + ':')):
+            self._flush_record(events)
+            self._start_urc(line, events)
+            return
+
+        if self._command is None:
+            self.discarded_lines += 1
+            return
+
+        if line == self._command or line.endswith('\x1a'):
+            return  # Eco del comando o del cuerpo
+
+        if line[:1] == '>':
+            if self._expects_prompt:
+                self._expects_prompt = False
+                events.append(Prompt())
+            return
+
+        name, params = _split_record(line)
+
+        if name is None and self._record is not None:
+            # Continuación de un texto de varias líneas
+            self._record.body += '\n' + line
+            return
+
+        self._flush_record(events)
+        record = IntermediateResult(line=line, name=name, params=params)
+        if self._awaiting is not None and name == self._awaiting:
+            self._awaiting = None
+
+        if name in BODY_RECORDS:
+            self._record = record
+            self._record_has_body = False
+        else:
+            events.append(record)
+
+    def _start_urc(self, line: str, events: List[ATEvent]):
+        if line.startswith('+CMT:') or (line.startswith('+CDS:') and line[5:].strip().isdigit()):
+            # +CMT siempre trae el texto/PDU; +CDS sólo en modo PDU ('+CDS: <largo>')
+            self._urc = line
+        else:
+            events.append(UnsolicitedResult(line=line))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Reproducción de Trazas AT
+Vuelve a pasar una sesión grabada con AT_TRACE por el multiplexor y el
+parser: cada comando se ejecuta de nuevo y el módem "responde" con los
+bytes grabados, con sus mismos tiempos (o `--speed` veces más rápido).
+Informa qué comandos terminan distinto que en la grabación y compara las
+latencias por comando.
+
+    python at_replay.py at_trace.jsonl --speed 10
+    python at_replay.py at_trace.jsonl --profile     # sólo latencias grabadas
+"""
+import argparse
+import asyncio
+import json
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from at_multiplexer import ATCommandError, ATCommandMultiplexer
+from at_parser import command_name
+from at_trace import CMD, END, RX, LatencyProfile, read_trace
+
+@dataclass
+class Segment:
+    """Un comando grabado y los bytes que llegaron hasta el siguiente"""
+    command: Dict
+    chunks: List[Tuple[float, bytes]] = field(default_factory=list)   # (segundos desde el comando, bytes)
+    end: Optional[Dict] = None
+
+def load_segments(records, modem: Optional[str] = None) -> Dict[str, List[Segment]]:
+    """Agrupa los registros por módem y por comando"""
+    sessions: Dict[str, List[Segment]] = {}
+    current: Dict[str, Segment] = {}
+    for record in records:
+        name = record['m']
+        if modem is not None and name != modem:
+            continue
+        if record['k'] == CMD:
+            segment = current[name] = Segment(record)
+            sessions.setdefault(name, []).append(segment)
+        elif name not in current:
+            continue  # Bytes anteriores al primer comando grabado
+        elif record['k'] == RX:
+            segment = current[name]
+            segment.chunks.append((record['t'] - segment.command['t'], record['d'].encode('latin-1')))
+        elif record['k'] == END:
+            current[name].end = record
+    return sessions
+
+class ReplayTransport:
+    """Transporte que contesta cada comando con los bytes grabados
+
+    `arm(segment)` prepara la respuesta del próximo comando: al escribirlo,
+    cada fragmento se entrega a su tiempo grabado dividido por `speed`.
+    """
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self.written: List[bytes] = []
+        self._armed: Optional[Segment] = None
+        self._timers: List[asyncio.TimerHandle] = []
+        self._pending: List[bytes] = []
+        self._queue: Optional[asyncio.Queue] = None
+
+    def arm(self, segment: Segment):
+        self._armed = segment
+
+    def write(self, data: bytes):
+        self.written.append(data)
+        segment = self._armed
+        if segment is None or not data.startswith(segment.command['d'].encode('utf-8')):
+            return  # Cuerpo del AT+CMGS, ESC o resincronización: la respuesta ya está programada
+        self._armed = None
+        loop = asyncio.get_running_loop()
+        for offset, chunk in segment.chunks:
+            self._pending.append(chunk)
+            self._timers.append(loop.call_later(max(offset, 0) / self.speed, self._deliver, chunk))
+
+    def flush(self):
+        """Entrega ya lo que falta del comando anterior (URC durante la espera entre comandos)"""
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        for chunk in self._pending:
+            self._inbox().put_nowait(chunk)
+        self._pending = []
+
+    def _deliver(self, chunk: bytes):
+        self._pending.remove(chunk)
+        self._inbox().put_nowait(chunk)
+
+    def _inbox(self) -> asyncio.Queue:
+        # Se crea en el loop de la reproducción
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def read(self, timeout: float) -> bytes:
+        try:
+            return await asyncio.wait_for(self._inbox().get(), timeout)
+        except asyncio.TimeoutError:
+            return b''
+
+class _Results:
+    """Recibe los registros `end` del multiplexor en lugar de un TraceRecorder"""
+
+    def __init__(self):
+        self.last: Optional[Dict] = None
+
+    def record(self, modem, kind, data, **extra):
+        if kind == END:
+            self.last = extra
+
+async def replay_session(segments: List[Segment], name: str, speed: float = 1.0) -> Dict:
+    """Reproduce los comandos de un módem; devuelve coincidencias y latencias"""
+
+    transport = ReplayTransport(speed)
+    results = _Results()
+    multiplexer = ATCommandMultiplexer(transport, name=name, trace=results)
+    await multiplexer.start()
+
+    mismatches = []
+    latencies: Dict[str, Dict[str, List[float]]] = {}
+    replayed = 0
+    try:
+        for segment in segments:
+            if segment.end is None:
+                continue  # Grabación cortada en medio del comando
+            command = segment.command
+            results.last = None
+            transport.arm(segment)
+            try:
+                await multiplexer.execute(command['d'], timeout=command['timeout'] / speed,
+                                          body=command.get('body'),
+                                          prompt_timeout=command['prompt_timeout'] / speed)
+            except ATCommandError:
+                pass
+            transport.flush()
+            replayed += 1
+
+            outcome = results.last or {}
+            recorded = segment.end
+            if (outcome.get('result'), outcome.get('code')) != (recorded['result'], recorded.get('code')):
+                mismatches.append({
+                    'command': command['d'],
+                    'recorded': {'result': recorded['result'], 'final': recorded.get('final')},
+                    'replayed': {'result': outcome.get('result'), 'final': outcome.get('final')}
+                })
+            for phase in ('prompt', 'response'):
+                if recorded.get(phase) is not None and outcome.get(phase) is not None:
+                    pair = latencies.setdefault(command_name(command['d']), {}).setdefault(phase, [])
+                    pair.append((recorded[phase], outcome[phase] * speed))
+    finally:
+        await multiplexer.stop()
+
+    return {
+        'modem': name,
+        'commands': replayed,
+        'matched': replayed - len(mismatches),
+        'mismatches': mismatches,
+        'latency': {command: {phase: _compare(pairs) for phase, pairs in phases.items()}
+                    for command, phases in sorted(latencies.items())}
+    }
+
+def _compare(pairs: List[Tuple[float, float]]) -> Dict:
+    recorded = sorted(value for value, _ in pairs)
+    replayed = sorted(value for _, value in pairs)
+    middle = len(pairs) // 2
+    return {
+        'count': len(pairs),
+        'recorded_p50_ms': round(recorded[middle] * 1000, 2),
+        'replayed_p50_ms': round(replayed[middle] * 1000, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce una traza AT_TRACE por el multiplexor y el parser")
+    parser.add_argument('trace', help="Archivo de traza (se leen también sus rotaciones .1, .2, ...)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Factor de aceleración de los tiempos grabados")
+    parser.add_argument('--modem', help="Sólo este módem (puerto)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Sólo resume las latencias grabadas por comando, sin reproducir")
+    parser.add_argument('--json', action='store_true', help="Resultados en JSON")
+    args = parser.parse_args()
+
+    if args.profile:
+        summary = LatencyProfile.from_records(
+            record for record in read_trace(args.trace)
+            if args.modem is None or record['m'] == args.modem).summary()
+        if args.json:
+            print(json.dumps(summary, indent=2))
+            return
+        print(f"{'comando':<12}{'fase':<10}{'n':>6}{'p50 s':>10}{'p99 s':>10}{'máx s':>10}")
+        for command, phases in summary.items():
+            for phase, stats in phases.items():
+                print(f"{command:<12}{phase:<10}{stats['count']:>6}{stats['p50']:>10}"
+                      f"{stats['p99']:>10}{stats['max']:>10}")
+        return
+
+    sessions = load_segments(read_trace(args.trace), args.modem)
+    if not sessions:
+        print("❌ La traza no tiene comandos" + (f" de {args.modem}" if args.modem else ""))
+        sys.exit(1)
+
+    reports = [asyncio.run(replay_session(segments, name, args.speed)) for name, segments in sessions.items()]
+    if args.json:
+        print(json.dumps(reports, indent=2, ensure_ascii=False))
+        return
+
+    for report in reports:
+        print(f"📟 {report['modem']}: {report['matched']}/{report['commands']} comandos con el mismo resultado")
+        for mismatch in report['mismatches'][:10]:
+            print(f"   ⚠️ {mismatch['command']}: grabado {mismatch['recorded']}, reproducido {mismatch['replayed']}")
+        for command, phases in report['latency'].items():
+            for phase, stats in phases.items():
+                print(f"   {command:<12}{phase:<10} n={stats['count']:<5} grabado p50 {stats['recorded_p50_ms']} ms"
+                      f"  reproducido p50 {stats['replayed_p50_ms']} ms")
+    if any(report['mismatches'] for report in reports):
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
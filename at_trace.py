@@ -0,0 +1,224 @@
+"""
+Trazas de Sesión AT
+Graba cada comando, los bytes escritos y leídos, los URC y el resultado
+con sus tiempos en un JSONL rotativo; se activa con AT_TRACE=<archivo>.
+Grabar sólo encola una tupla: un hilo aparte serializa y escribe. Las
+trazas se reproducen con at_replay.py y sus latencias alimentan al módem
+simulado (modem_simulator.py --profile)
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from at_parser import command_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024    # Tamaño de cada archivo antes de rotar
+DEFAULT_BACKUPS = 3                     # Archivos rotados que se conservan (.1 es el más reciente)
+
+# Tipos de registro
+TX = 'tx'       # Bytes escritos al módem
+RX = 'rx'       # Bytes leídos, tal como llegaron (un registro por lectura)
+CMD = 'cmd'     # Comienzo de un comando: texto, cuerpo y esperas máximas
+END = 'end'     # Fin de un comando: resultado, código y segundos de cada fase
+URC = 'urc'     # Código no solicitado ya separado por el parser
+
+class TraceRecorder:
+    """Escritor de trazas AT en JSONL con rotación por tamaño
+
+        trace = TraceRecorder('at_trace.jsonl')
+        trace.record('/dev/ttyUSB0', TX, b'AT+CSQ\\r\\n')
+        trace.close()
+
+    Cada línea es {"t": epoch, "m": módem, "k": tipo, "d": datos, ...}. Los
+    bytes se guardan decodificados como Latin-1 (uno a uno, sin pérdida),
+    así la reproducción entrega exactamente lo que llegó del puerto.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backups: int = DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue: 'queue.SimpleQueue' = queue.SimpleQueue()
+        self._file = None
+        self._size = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='at-trace', daemon=True)
+        self._thread.start()
+
+    def record(self, modem: str, kind: str, data, **extra):
+        """Encola un registro (no bloquea ni toca el disco)"""
+        if self._closed:
+            return
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        self._queue.put((time.time(), modem, kind, data, extra))
+
+    def close(self, timeout: float = 5.0):
+        """Escribe lo encolado y cierra el archivo"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            lines = []
+            # Todo lo que ya esté encolado se escribe de una vez
+            while item is not None:
+                lines.append(self._encode(item))
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write(lines)
+            except OSError as e:
+                self.dropped += len(lines)
+                logger.error(f"❌ No se pudo escribir la traza AT {self.path}: {e}")
+            if item is None:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    @staticmethod
+    def _encode(item) -> str:
+        timestamp, modem, kind, data, extra = item
+        record = {'t': round(timestamp, 6), 'm': modem, 'k': kind, 'd': data}
+        record.update(extra)
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def _write(self, lines: List[str]):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._size = self._file.tell()
+        for line in lines:
+            size = len(line.encode('utf-8'))
+            if self._size and self._size + size > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._size += size
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups > 0:
+            for n in range(self.backups - 1, 0, -1):
+                older = f'{self.path}.{n}'
+                if os.path.exists(older):
+                    os.replace(older, f'{self.path}.{n + 1}')
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = 0
+
+_default: Optional[TraceRecorder] = None
+_default_lock = threading.Lock()
+
+def default_recorder() -> Optional[TraceRecorder]:
+    """Grabador compartido por todos los módems si AT_TRACE está definida
+
+    AT_TRACE_MAX_MB y AT_TRACE_BACKUPS ajustan la rotación.
+    """
+    global _default
+    path = os.environ.get('AT_TRACE')
+    if not path:
+        return None
+    with _default_lock:
+        if _default is None:
+            max_bytes = int(float(os.environ.get('AT_TRACE_MAX_MB', DEFAULT_MAX_BYTES / 1024 / 1024))
+                            * 1024 * 1024)
+            backups = int(os.environ.get('AT_TRACE_BACKUPS', DEFAULT_BACKUPS))
+            _default = TraceRecorder(path, max_bytes, backups)
+            atexit.register(_default.close)
+            logger.info(f"🧾 Traza AT en {path} (rota cada {max_bytes // 1024} KB, {backups} copias)")
+        return _default
+
+def trace_files(path: str) -> List[str]:
+    """El archivo y sus rotaciones, del más antiguo al más nuevo"""
+    rotated = []
+    for name in glob.glob(glob.escape(path) + '.*'):
+        suffix = name[len(path) + 1:]
+        if suffix.isdigit():
+            rotated.append((int(suffix), name))
+    files = [name for _, name in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def read_trace(path: str) -> Iterator[Dict]:
+    """Registros de una traza, incluidas sus rotaciones, en orden"""
+    for name in trace_files(path):
+        with open(name, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Una línea cortada por un corte de energía no invalida el resto
+                    logger.warning(f"⚠️ {name}:{number}: registro inválido, se omite")
+
+class LatencyProfile:
+    """Tiempos reales por comando y fase tomados de los registros `end`
+
+        profile = LatencyProfile.from_trace('at_trace.jsonl')
+        profile.sample('AT+CMGS', 'response')   # segundos de un envío grabado al azar
+
+    Fases: `prompt` (AT+CMGS hasta el '>') y `response` (hasta el código
+    final; en AT+CMGS, la confirmación de la red).
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.samples: Dict[str, Dict[str, List[float]]] = {}
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], seed: Optional[int] = None) -> 'LatencyProfile':
+        profile = cls(seed)
+        for record in records:
+            if record.get('k') != END:
+                continue
+            name = command_name(record['d'])
+            for phase in ('prompt', 'response'):
+                seconds = record.get(phase)
+                if seconds is not None:
+                    profile.samples.setdefault(name, {}).setdefault(phase, []).append(seconds)
+        return profile
+
+    @classmethod
+    def from_trace(cls, path: str, seed: Optional[int] = None) -> 'LatencyProfile':
+        return cls.from_records(read_trace(path), seed)
+
+    def sample(self, command: str, phase: str = 'response') -> Optional[float]:
+        """Un tiempo grabado para ese comando y fase; None si no hay datos"""
+        values = self.samples.get(command_name(command), {}).get(phase)
+        return self._random.choice(values) if values else None
+
+    def summary(self) -> Dict[str, Dict[str, Dict]]:
+        result = {}
+        for name, phases in sorted(self.samples.items()):
+            for phase, values in phases.items():
+                ordered = sorted(values)
+                result.setdefault(name, {})[phase] = {
+                    'count': len(ordered),
+                    'p50': round(ordered[len(ordered) // 2], 4),
+                    'p99': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 4),
+                    'max': round(ordered[-1], 4)
+                }
+        return result
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del parser AT
+Compara el escaneo por substrings sobre una respuesta creciente con el
+parser incremental, alimentando volcados sintéticos de AT+CMGL="ALL"
+"""
+import argparse
+import random
+import time
+
+from at_parser import ATResponseParser, FinalResult, IntermediateResult
+
+def build_cmgl_dump(count: int = 200) -> bytes:
+    """Volcado sintético de `count` mensajes en modo texto"""
+
+    rng = random.Random(42)
+    words = ['motor', 'ok', 'estado', 'bateria', 'alarma', 'encendido', 'apagado',
+             'respuesta', 'recibido', 'temperatura', 'nivel', 'bomba']
+    lines = ['AT+CMGL="ALL"', '']
+    for index in range(count):
+        sender = f"+519{rng.randint(10000000, 99999999)}"
+        stat = 'REC READ' if index % 3 else 'REC UNREAD'
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 25)))
+        lines.append(f'+CMGL: {index},"{stat}","{sender}",,"24/08/22,10:{index % 60:02d}:00-20"')
+        lines.append(text[:160])
+    lines += ['', 'OK', '']
+    return '\r\n'.join(lines).encode('utf-8')
+
+def chunked(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def legacy_scan(chunks) -> int:
+    """Lo que hacían los motores: concatenar y buscar 'OK' en cada lectura"""
+
+    response = ""
+    for chunk in chunks:
+        response += chunk.decode('utf-8', errors='ignore')
+        if 'OK\r\n' in response or 'ERROR' in response:
+            break
+
+    count = 0
+    lines = response.split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if line.startswith('+CMGL:'):
+            if i + 1 < len(lines):
+                parts = line.split(',')
+                if len(parts) >= 3:
+                    count += 1
+            i += 1
+        i += 1
+    return count
+
+def incremental_parse(chunks) -> int:
+    parser = ATResponseParser()
+    parser.begin('AT+CMGL="ALL"')
+    count = 0
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            if isinstance(event, IntermediateResult) and event.name == '+CMGL':
+                count += 1
+            elif isinstance(event, FinalResult):
+                return count
+    return count
+
+def bench(label: str, func, chunks, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func(chunks)
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"   {label:<22} {elapsed * 1000:8.3f} ms/volcado  ({result} mensajes)")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del parser AT con volcados CMGL")
+    parser.add_argument('--messages', type=int, default=200, help="Mensajes por volcado")
+    parser.add_argument('--chunk', type=int, default=32, help="Bytes por lectura del puerto")
+    parser.add_argument('--rounds', type=int, default=50, help="Repeticiones")
+    args = parser.parse_args()
+
+    dump = build_cmgl_dump(args.messages)
+    chunks = chunked(dump, args.chunk)
+
+    print("📊 === BENCHMARK PARSER AT ===")
+    print(f"   Volcado: {args.messages} mensajes, {len(dump)} bytes en lecturas de {args.chunk} bytes\n")
+
+    legacy = bench("Substrings (legado)", legacy_scan, chunks, args.rounds)
+    incremental = bench("Parser incremental", incremental_parse, chunks, args.rounds)
+
+    print(f"\n⚡ Aceleración: {legacy / incremental:.1f}x")
+
+if __name__ == "__main__":
+    main()
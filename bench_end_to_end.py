@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Benchmark de Extremo a Extremo contra el Módem Simulado
+HTTP -> base -> motor -> puerto serie, con cada servidor en su propio
+proceso y modem_simulator.py como módem (sólo Linux: usa un pty). Por
+servidor mide:
+
+    encolado     lo que tarda en responder el POST de envío
+    envío        desde el POST hasta que el AT+CMGS completo llega al módem
+    recepción    desde que el módem recibe un SMS hasta el evento en /api/events
+                 (sólo web_server_multiplatform: main.py y server_simple.py no leen la bandeja)
+    memoria      RSS del servidor durante una carga sostenida (--soak segundos)
+
+    python bench_end_to_end.py --targets web,simple --messages 200 --json
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from at_trace import LatencyProfile
+from modem_simulator import ModemSimulator, SubmittedSMS
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+PHONE = '946467799'
+READY_TIMEOUT = 60
+HTTP_TIMEOUT = 120
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _http_json(method: str, url: str, data: Optional[Dict] = None, timeout: float = HTTP_TIMEOUT):
+    body = json.dumps(data).encode() if data is not None else None
+    request = urllib.request.Request(url, data=body, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read() or b'null')
+
+def _summary(values: List[float]) -> Optional[Dict]:
+    """Percentiles en milisegundos (rango más cercano)"""
+    if not values:
+        return None
+    ordered = sorted(value * 1000 for value in values)
+
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 2)
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 2),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': round(ordered[-1], 2)
+    }
+
+class Arrivals:
+    """Momento en que cada texto llega al módem (o al evento de recepción)"""
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+        self._cond = threading.Condition()
+
+    def mark(self, text: str):
+        with self._cond:
+            self.times.setdefault(text, time.perf_counter())
+            self._cond.notify_all()
+
+    def wait(self, texts: List[str], timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not all(text in self.times for text in texts):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+# ---------------------------------------------------------------------------
+# Servidores
+# ---------------------------------------------------------------------------
+
+class Target:
+    """Un servidor del repo lanzado como proceso contra el módem simulado"""
+
+    name = ''
+    script = ''
+    ready_path = '/status'
+    send_path = '/send-sms'
+    receives = False
+
+    def __init__(self, workdir: str, serial_port: str):
+        self.workdir = workdir
+        self.serial_port = serial_port
+        self.port = _free_port()
+        self.base = f'http://127.0.0.1:{self.port}'
+        self.process: Optional[subprocess.Popen] = None
+        self._log = None
+
+    def environment(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            'SERIAL_PORT': self.serial_port,
+            'HOST': '127.0.0.1',
+            'PORT': str(self.port),
+            'DEBUG': 'false',
+            'LOG_LEVEL': 'WARNING',
+            'DATABASE_URL': f"sqlite:///{os.path.join(self.workdir, 'bench.db')}",
+        })
+        return env
+
+    def start(self):
+        self._log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.process = subprocess.Popen([sys.executable, os.path.join(REPO, self.script)],
+                                        cwd=self.workdir, env=self.environment(),
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.script} terminó al arrancar:\n{self.log_tail()}")
+            try:
+                _http_json('GET', self.base + self.ready_path, timeout=2)
+                self.connect()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"{self.script} no respondió en {READY_TIMEOUT} s:\n{self.log_tail()}")
+
+    def connect(self):
+        pass
+
+    def send(self, text: str):
+        result = _http_json('POST', self.base + self.send_path,
+                            {'phone_number': PHONE, 'message': text})
+        if isinstance(result, dict) and result.get('error'):
+            raise RuntimeError(result['error'])
+
+    def rss_kb(self) -> Optional[int]:
+        try:
+            with open(f'/proc/{self.process.pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except (OSError, AttributeError):
+            return None
+        return None
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log is not None:
+            self._log.close()
+
+    def log_tail(self, lines: int = 15) -> str:
+        try:
+            with open(os.path.join(self.workdir, 'server.log'), 'rb') as log:
+                return b'\n'.join(log.read().splitlines()[-lines:]).decode('utf-8', errors='replace')
+        except OSError:
+            return ''
+
+class WebTarget(Target):
+    name = 'web'
+    script = 'web_server_multiplatform.py'
+    ready_path = '/api/status'
+    send_path = '/api/send'
+    receives = True
+
+    def start(self):
+        # ConfigManager lee gateway_config.json del directorio de trabajo
+        config = {
+            'serial_port': self.serial_port,
+            'auto_detect': False,
+            'inbox': {'database': os.path.join(self.workdir, 'bench.db')},
+            'web_server': {'host': '127.0.0.1', 'port': self.port, 'mode': 'threaded'},
+        }
+        with open(os.path.join(self.workdir, 'gateway_config.json'), 'w') as f:
+            json.dump(config, f)
+        super().start()
+
+    def connect(self):
+        result = _http_json('POST', self.base + '/api/connect', {})
+        if not result.get('success'):
+            raise RuntimeError(f"/api/connect: {result.get('error')}")
+
+    def listen(self, arrivals: Arrivals, stop: threading.Event):
+        """Eventos 'message' de /api/events -> llegada del texto recibido"""
+        response = urllib.request.urlopen(self.base + '/api/events', timeout=HTTP_TIMEOUT)
+        event = None
+        for raw in response:
+            if stop.is_set():
+                break
+            line = raw.decode('utf-8').rstrip('\n')
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:') and event == 'message':
+                arrivals.mark(json.loads(line[5:])['message'])
+        response.close()
+
+class MainTarget(Target):
+    name = 'main'
+    script = 'main.py'
+
+class SimpleTarget(Target):
+    name = 'simple'
+    script = 'server_simple.py'
+
+TARGETS = {target.name: target for target in (WebTarget, MainTarget, SimpleTarget)}
+
+# ---------------------------------------------------------------------------
+# Fases
+# ---------------------------------------------------------------------------
+
+def _send_phase(target: Target, sent: Arrivals, texts: List[str], concurrency: int,
+                timeout: float) -> Dict:
+    started: Dict[str, float] = {}
+    enqueue: List[float] = []
+    errors: List[str] = []
+
+    def one(text: str):
+        started[text] = time.perf_counter()
+        try:
+            target.send(text)
+            enqueue.append(time.perf_counter() - started[text])
+        except Exception as e:
+            errors.append(str(e))
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, texts))
+    sent.wait(texts, timeout)
+
+    arrived = [text for text in texts if text in sent.times]
+    end = max((sent.times[text] for text in arrived), default=begin)
+    return {
+        'messages': len(texts),
+        'delivered_to_modem': len(arrived),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'messages_per_second': round(len(arrived) / (end - begin), 1) if end > begin else None,
+        'enqueue_ms': _summary(enqueue),
+        'send_ms': _summary([sent.times[text] - started[text] for text in arrived])
+    }
+
+def _inbound_phase(modem: ModemSimulator, received: Arrivals, count: int, spacing: float,
+                   timeout: float) -> Dict:
+    delivered: Dict[str, float] = {}
+    texts = [f'entrante {i}' for i in range(count)]
+    for text in texts:
+        delivered[text] = time.perf_counter()
+        modem.deliver('+51' + PHONE, text)
+        time.sleep(spacing)
+    received.wait(texts, timeout)
+    arrived = [text for text in texts if text in received.times]
+    return {
+        'messages': count,
+        'received': len(arrived),
+        'inbound_ms': _summary([received.times[text] - delivered[text] for text in arrived])
+    }
+
+def _soak_phase(target: Target, modem: ModemSimulator, sent: Arrivals, received: Arrivals,
+                seconds: float, rate: float, concurrency: int) -> Dict:
+    samples = [target.rss_kb()]
+    started: Dict[str, float] = {}
+    texts: List[str] = []
+    errors = [0]
+
+    def one(text: str):
+        started[text] = time.perf_counter()
+        try:
+            target.send(text)
+        except Exception:
+            errors[0] += 1
+
+    begin = time.monotonic()
+    next_sample = begin + 1.0
+    with ThreadPoolExecutor(concurrency) as pool:
+        sequence = 0
+        while time.monotonic() - begin < seconds:
+            text = f'soak {sequence}'
+            texts.append(text)
+            pool.submit(one, text)
+            if target.receives and sequence % 4 == 0:
+                modem.deliver('+51' + PHONE, f'soak entrante {sequence}')
+            sequence += 1
+            if time.monotonic() >= next_sample:
+                samples.append(target.rss_kb())
+                next_sample += 1.0
+            time.sleep(1.0 / rate)
+    sent.wait(texts, 30)
+    samples.append(target.rss_kb())
+
+    samples = [sample for sample in samples if sample is not None]
+    arrived = [text for text in texts if text in sent.times]
+    growth = samples[-1] - samples[0] if samples else None
+    return {
+        'seconds': seconds,
+        'messages': len(texts),
+        'delivered_to_modem': len(arrived),
+        'errors': errors[0],
+        'send_ms': _summary([sent.times[text] - started[text] for text in arrived]),
+        'rss_start_kb': samples[0] if samples else None,
+        'rss_peak_kb': max(samples) if samples else None,
+        'rss_end_kb': samples[-1] if samples else None,
+        'rss_growth_kb': growth,
+        'rss_growth_per_1000_messages_kb': (round(growth * 1000 / len(texts), 1)
+                                            if growth is not None and texts else None)
+    }
+
+def run(name: str, args) -> Dict:
+    sent, received = Arrivals(), Arrivals()
+
+    def on_submit(sms: SubmittedSMS):
+        sent.mark(sms.text)
+
+    # Con --profile cada comando tarda lo que tardó en el módem real grabado
+    profile = LatencyProfile.from_trace(args.profile) if args.profile else None
+    modem = ModemSimulator(latency=args.latency, send_latency=args.send_latency,
+                           report_delay=args.report_delay, on_submit=on_submit, profile=profile)
+    workdir = tempfile.mkdtemp(prefix=f'bench_e2e_{name}_')
+    target = TARGETS[name](workdir, modem.start())
+    stop = threading.Event()
+    result = {'target': name, 'script': target.script}
+    try:
+        target.start()
+        if target.receives:
+            threading.Thread(target=target.listen, args=(received, stop), daemon=True).start()
+            time.sleep(0.2)
+
+        texts = [f'bench {i}' for i in range(args.messages)]
+        result['send'] = _send_phase(target, sent, texts, args.concurrency, args.timeout)
+        result['inbound'] = (_inbound_phase(modem, received, args.inbound, 0.05, args.timeout)
+                             if target.receives and args.inbound else None)
+        result['soak'] = (_soak_phase(target, modem, sent, received, args.soak, args.rate,
+                                      args.concurrency) if args.soak > 0 else None)
+        result['modem'] = modem.stats.as_dict()
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        stop.set()
+        target.stop()
+        modem.stop()
+        if args.keep:
+            result['workdir'] = workdir
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def _print_table(results: List[Dict], args):
+    print(f"📊 {args.messages} envíos ({args.concurrency} en paralelo), módem simulado con "
+          f"{args.send_latency * 1000:.0f} ms por AT+CMGS\n")
+
+    def cell(stats: Optional[Dict], key: str) -> str:
+        return f"{stats[key]:.1f}" if stats else '-'
+
+    print(f"{'servidor':<9}{'msg/s':>8}{'encolado p50/p99':>20}{'envío p50/p99':>20}"
+          f"{'recepción p50/p99':>21}{'RSS +KB':>10}")
+    for result in results:
+        if 'error' in result:
+            # La última línea del log es la excepción que lo detuvo
+            print(f"{result['target']:<9}❌ {result['error'].strip().splitlines()[-1]}")
+            continue
+        send, inbound, soak = result['send'], result['inbound'], result['soak']
+        inbound_ms = inbound['inbound_ms'] if inbound else None
+        print(f"{result['target']:<9}{send['messages_per_second'] or 0:>8.1f}"
+              f"{cell(send['enqueue_ms'], 'p50') + ' / ' + cell(send['enqueue_ms'], 'p99'):>20}"
+              f"{cell(send['send_ms'], 'p50') + ' / ' + cell(send['send_ms'], 'p99'):>20}"
+              f"{cell(inbound_ms, 'p50') + ' / ' + cell(inbound_ms, 'p99'):>21}"
+              f"{soak['rss_growth_kb'] if soak else '-':>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--targets', default='web,main,simple',
+                        help=f"Servidores separados por coma ({', '.join(TARGETS)})")
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--inbound', type=int, default=20, help="SMS entrantes (sólo web)")
+    parser.add_argument('--soak', type=float, default=0.0,
+                        help="Segundos de carga sostenida midiendo memoria (0: sin soak)")
+    parser.add_argument('--rate', type=float, default=10.0, help="Envíos por segundo durante el soak")
+    parser.add_argument('--latency', type=float, default=0.002, help="Segundos por comando AT")
+    parser.add_argument('--send-latency', type=float, default=0.01, help="Segundos por AT+CMGS")
+    parser.add_argument('--report-delay', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help="Espera máxima a que los envíos lleguen al módem")
+    parser.add_argument('--profile', help="Traza AT_TRACE de un módem real: el simulador usa sus latencias")
+    parser.add_argument('--keep', action='store_true', help="Conservar el directorio de cada servidor")
+    parser.add_argument('--json', action='store_true', help="Resultados en JSON")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.targets.split(',') if name.strip()]
+    unknown = [name for name in names if name not in TARGETS]
+    if unknown:
+        parser.error(f"Servidor desconocido: {', '.join(unknown)}")
+
+    results = [run(name, args) for name in names]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_table(results, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark del normalizador de mensajes
+Compara el bucle de str.replace de los motores (con la normalización NFKD
+que sms_engine_fixed calculaba y descartaba) con la tabla precalculada,
+sobre un corpus sintético de mensajes en español con emoji
+"""
+import argparse
+import random
+import time
+import unicodedata
+from collections import Counter
+
+from message_normalizer import DEFAULT_REPLACEMENTS, GSM7_CHARSET, MessageNormalizer
+
+LEGACY_REPLACEMENTS = {
+    'ñ': 'n', 'Ñ': 'N',
+    'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
+    'Á': 'A', 'É': 'E', 'Í': 'I', 'Ó': 'O', 'Ú': 'U',
+    '🧪': 'TEST', '📱': '', '💬': '', '✅': 'OK', '❌': 'ERROR'
+}
+
+def build_corpus(count: int = 5000):
+    """Mensajes sintéticos: acentos y ñ en casi todos, emoji en el 40%, puntuación tipográfica en el 15%"""
+
+    rng = random.Random(42)
+    words = ['hola', 'señor', 'pedido', 'está', 'listo', 'mañana', 'gracias', 'información',
+             'dirección', 'teléfono', 'número', 'atención', 'envío', 'código', 'ubicación',
+             'bomba', 'encendido', 'alarma', 'nivel', 'batería', 'Perú', 'Lima', '¿cuándo?',
+             '¡éxito!', 'año', 'niño']
+    typographic = ['“ok”', 'ya…', '—']
+    emoji = ['😀', '👍', '🙏', '✅', '❌', '📱', '💬', '🎉', '❤️', '🚚']
+
+    corpus = []
+    for _ in range(count):
+        length = rng.choice([5, 10, 20, 40])
+        text = ' '.join(rng.choice(words) for _ in range(length))
+        if rng.random() < 0.15:
+            text += ' ' + rng.choice(typographic)
+        if rng.random() < 0.4:
+            text += ' ' + ''.join(rng.choice(emoji) for _ in range(rng.randint(1, 3)))
+        corpus.append(text[0].upper() + text[1:])
+    return corpus
+
+def legacy_multiplatform(message: str) -> str:
+    clean_message = message
+    for original, replacement in LEGACY_REPLACEMENTS.items():
+        clean_message = clean_message.replace(original, replacement)
+    if len(clean_message) > 160:
+        clean_message = clean_message[:157] + "..."
+    return clean_message
+
+def equivalent_replacements(corpus, normalizer: MessageNormalizer):
+    """Diccionario que el bucle de replace necesitaría para dar la misma salida"""
+
+    replacements = dict(DEFAULT_REPLACEMENTS)
+    for char in sorted(set(''.join(corpus))):
+        if char not in GSM7_CHARSET and char not in replacements:
+            replacements[char] = normalizer.normalize(char)
+    return replacements
+
+def legacy_loop(replacements):
+    def clean(message: str) -> str:
+        for original, replacement in replacements.items():
+            message = message.replace(original, replacement)
+        if len(message) > 160:
+            message = message[:157] + "..."
+        return message
+    return clean
+
+def legacy_fixed(message: str) -> str:
+    normalized = unicodedata.normalize('NFKD', message)
+    normalized.encode('ascii', 'ignore').decode('ascii')  # Resultado descartado
+    return legacy_multiplatform(message)
+
+def bench(label: str, func, corpus, rounds: int) -> float:
+    """Mejor ronda (menos sensible a otros procesos que el promedio)"""
+
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for message in corpus:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    elapsed = best / len(corpus)
+    print(f"   {label:<28} {elapsed * 1e6:7.2f} µs/mensaje  ({1 / elapsed:>10,.0f} msg/s)")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del normalizador de mensajes")
+    parser.add_argument('--messages', type=int, default=5000, help="Mensajes del corpus")
+    parser.add_argument('--rounds', type=int, default=5, help="Repeticiones")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages)
+    normalizer = MessageNormalizer()
+
+    print("📊 === BENCHMARK NORMALIZADOR ===")
+    print(f"   Corpus: {len(corpus)} mensajes, {sum(map(len, corpus))} caracteres\n")
+
+    replacements = equivalent_replacements(corpus, normalizer)
+    equivalent = legacy_loop(replacements)
+    mismatches = sum(1 for message in corpus if equivalent(message) != normalizer.normalize(message))
+
+    fixed = bench("Bucle replace + NFKD (fixed)", legacy_fixed, corpus, args.rounds)
+    bench("Bucle replace (multiplat.)", legacy_multiplatform, corpus, args.rounds)
+    same_output = bench(f"Bucle replace ({len(replacements)} claves)", equivalent, corpus, args.rounds)
+    table = bench("Tablas precalculadas", normalizer.normalize, corpus, args.rounds)
+
+    print(f"\n   El bucle original sólo cubre {len(LEGACY_REPLACEMENTS)} caracteres y deja pasar emoji y comillas;")
+    print(f"   con {len(replacements)} claves produce la misma salida que el normalizador "
+          f"({mismatches} diferencias)")
+    print(f"\n⚡ Aceleración: {fixed / table:.1f}x vs fixed, {same_output / table:.1f}x vs bucle equivalente")
+
+    # Cuántos SMS costaría el corpus en modo PDU
+    classes = Counter()
+    segments = Counter()
+    for message in corpus:
+        info = normalizer.analyze(message)
+        classes[info.encoding] += 1
+        segments[info.segments] += 1
+
+    print("\n📨 Codificación en modo PDU: " + ', '.join(f"{name}={count}" for name, count in sorted(classes.items())))
+    print("   Segmentos por mensaje:     " + ', '.join(f"{n}→{count}" for n, count in sorted(segments.items())))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escritura de estados de mensajes en SQLite
+Varios workers llevan mensajes por PENDING -> SENDING -> SENT -> DELIVERED
+(cada transición ocupa al worker `--latency` segundos, como el módem) y se
+mide cuántas transiciones por segundo quedan guardadas y cuántos commits
+cuestan, en tres variantes:
+
+    antes          una conexión y un commit por transición, SQLite por defecto
+    perfil         igual, con el perfil de sqlite_profile.py (WAL, NORMAL, ...)
+    write-behind   perfil + WriteBehind: transiciones agrupadas por transacción
+
+Sólo usa la biblioteca estándar; la tabla es la misma sms_messages.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from message_store import SCHEMA
+from sqlite_profile import apply_profile
+from write_behind import WriteBehind
+
+TRANSITIONS = ['SENDING', 'SENT', 'DELIVERED']
+
+def _prepare(path: str, messages: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    with conn:
+        conn.executemany(
+            "INSERT INTO sms_messages (id, phone_number, message, status) VALUES (?, ?, ?, 'PENDING')",
+            [(i, '946467799', f'mensaje {i}') for i in range(1, messages + 1)]
+        )
+    conn.close()
+
+def _connect(path: str, tuned: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    if tuned:
+        apply_profile(conn)
+    return conn
+
+def _update_once(path: str, tuned: bool, row: Dict) -> None:
+    # Como el update_message_status original: sesión nueva, consulta, cambio y commit
+    conn = _connect(path, tuned)
+    try:
+        with conn:
+            conn.execute("SELECT id, status FROM sms_messages WHERE id = ?", (row['id'],)).fetchone()
+            conn.execute("UPDATE sms_messages SET status = ?, updated_at = ? WHERE id = ?",
+                         (row['status'], row['updated_at'], row['id']))
+    finally:
+        conn.close()
+
+def _write_batch(conn: sqlite3.Connection, lock: threading.Lock, rows: List[Dict]):
+    with lock, conn:
+        conn.executemany("UPDATE sms_messages SET status = :status, updated_at = :updated_at "
+                         "WHERE id = :id", rows)
+
+def run(variant: str, messages: int, workers: int, interval: float, latency: float) -> Dict:
+    directory = tempfile.mkdtemp(prefix='bench_status_')
+    path = os.path.join(directory, 'bench.db')
+    _prepare(path, messages)
+
+    tuned = variant != 'antes'
+    commits = [0]
+    writer = None
+    if variant == 'write-behind':
+        conn = _connect(path, tuned=True)
+        lock = threading.Lock()
+
+        def write(rows):
+            _write_batch(conn, lock, rows)
+            commits[0] += 1
+
+        writer = WriteBehind(write, interval=interval)
+        writer.start()
+
+    def worker(ids):
+        for message_id in ids:
+            for status in TRANSITIONS:
+                time.sleep(latency)
+                row = {'id': message_id, 'status': status, 'updated_at': time.time()}
+                if writer is not None:
+                    writer.submit(row)
+                else:
+                    _update_once(path, tuned, row)
+
+    chunks = [list(range(1 + i, messages + 1, workers)) for i in range(workers)]
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if writer is not None:
+        writer.flush()
+        writer.stop()
+    elapsed = time.perf_counter() - start
+
+    if writer is None:
+        commits[0] = messages * len(TRANSITIONS)
+
+    check = sqlite3.connect(path)
+    delivered = check.execute("SELECT COUNT(*) FROM sms_messages WHERE status = 'DELIVERED'").fetchone()[0]
+    check.close()
+    if writer is not None:
+        conn.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    transitions = messages * len(TRANSITIONS)
+    return {
+        'variant': variant,
+        'messages': messages,
+        'workers': workers,
+        'transitions': transitions,
+        'seconds': round(elapsed, 3),
+        'transitions_per_second': round(transitions / elapsed, 1),
+        'commits': commits[0],
+        'commits_per_second': round(commits[0] / elapsed, 1),
+        'consistent': delivered == messages
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help="Tiempo de módem por transición (segundos)")
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help="Espera de agrupamiento del write-behind (segundos)")
+    parser.add_argument('--json', action='store_true', help="Resultados en JSON")
+    args = parser.parse_args()
+
+    results = [run(variant, args.messages, args.workers, args.interval, args.latency)
+               for variant in ('antes', 'perfil', 'write-behind')]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"📊 {args.messages} mensajes × {len(TRANSITIONS)} transiciones, {args.workers} workers, "
+          f"{args.latency * 1000:.0f} ms por transición\n")
+    print(f"{'variante':<14}{'trans/s':>10}{'commits':>10}{'commits/s':>11}{'tiempo':>9}  ok")
+    for result in results:
+        print(f"{result['variant']:<14}{result['transitions_per_second']:>10.0f}"
+              f"{result['commits']:>10}{result['commits_per_second']:>11.0f}"
+              f"{result['seconds']:>8.2f}s  {'✅' if result['consistent'] else '❌'}")
+
+if __name__ == '__main__':
+    main()
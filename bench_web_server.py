@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga del servidor web
+Mantiene miles de conexiones inactivas (navegadores con el dashboard
+abierto) mientras clientes activos consultan /api/status y /api/messages,
+contra el servidor con hilos y el asíncrono. El motor es simulado: cada
+consulta ocupa el "módem" unos milisegundos, de a una por vez.
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from typing import List
+
+from multiplatform_sms_engine import SMSResult
+import web_server_multiplatform as web
+
+class SimulatedEngine:
+    """Motor con la misma interfaz que MultiplatformSMSEngine, sin puerto serie"""
+
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+        self.is_connected = True
+        self._lock = None
+        self._reference = 0
+
+    async def _modem(self, factor: float = 1.0):
+        # Un solo comando AT a la vez, como el multiplexor real
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await asyncio.sleep(self.latency * factor)
+
+    async def connect(self, custom_port: str = None) -> bool:
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+
+    async def send_sms(self, phone_number: str, message: str) -> SMSResult:
+        await self._modem(20)
+        self._reference = (self._reference + 1) % 256
+        return SMSResult(success=True, reference_id=str(self._reference))
+
+    async def check_stored_messages(self):
+        await self._modem()
+        return []
+
+    async def get_network_info(self):
+        await self._modem(2)
+        return {'operator': 'SIMULADO', 'signal_strength': '20'}
+
+def start_server(mode: str, latency: float):
+    """Levanta el servidor en un hilo y devuelve (puerto, función para detenerlo)"""
+
+    api = web.GatewayAPI(engine=SimulatedEngine(latency))
+
+    if mode == 'threaded':
+        web.SMSGatewayHandler.log_message = lambda *args: None  # Sin una línea por petición
+        httpd = web.create_threaded_server('127.0.0.1', 0, api)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+            web.server_instance.engine_loop.stop()
+
+        return httpd.server_address[1], stop
+
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = web.create_async_server('127.0.0.1', 0, api)
+        loop.run_until_complete(server.start())
+        holder.update(loop=loop, server=server)
+        ready.set()
+        loop.run_forever()
+        loop.run_until_complete(server.stop())
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+
+    def stop():
+        holder['loop'].call_soon_threadsafe(holder['loop'].stop)
+        thread.join(5)
+
+    return holder['server'].port, stop
+
+async def http_get(state: dict, port: int, path: str) -> float:
+    """GET reutilizando la conexión si el servidor la mantiene abierta"""
+
+    start = time.perf_counter()
+    if state.get('writer') is None:
+        state['reader'], state['writer'] = await asyncio.open_connection('127.0.0.1', port)
+    reader, writer = state['reader'], state['writer']
+
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n".encode())
+    await writer.drain()
+
+    status = await reader.readline()
+    if not status.startswith(b'HTTP/'):
+        raise ConnectionError("Respuesta vacía")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()  # HTTP/1.0: hasta que el servidor cierre
+
+    if status.startswith(b'HTTP/1.0') or headers.get('connection', '').lower() == 'close' \
+            or 'content-length' not in headers:
+        writer.close()
+        state['writer'] = None
+
+    return time.perf_counter() - start
+
+async def active_client(port: int, deadline: float, latencies: List[float], errors: list):
+    state = {}
+    paths = ['/api/status', '/api/messages']
+    i = 0
+    while time.perf_counter() < deadline:
+        try:
+            latencies.append(await http_get(state, port, paths[i % 2]))
+        except Exception as e:
+            errors.append(e)
+            state['writer'] = None
+            await asyncio.sleep(0.05)
+        i += 1
+    if state.get('writer') is not None:
+        state['writer'].close()
+
+async def load(port: int, idle: int, clients: int, duration: float):
+    # Conexiones abiertas sin petición en curso
+    idle_writers = []
+    for _ in range(idle):
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            idle_writers.append(writer)
+        except OSError as e:
+            print(f"   ⚠️ Sólo {len(idle_writers)} conexiones inactivas: {e}")
+            break
+    await asyncio.sleep(0.5)
+    threads_with_idle = threading.active_count()
+
+    latencies: List[float] = []
+    errors: list = []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(active_client(port, deadline, latencies, errors) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    for writer in idle_writers:
+        writer.close()
+
+    return latencies, errors, elapsed, threads_with_idle, len(idle_writers)
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def report(mode: str, latencies, errors, elapsed, threads, idle):
+    print(f"\n📊 Servidor {mode}")
+    print(f"   Conexiones inactivas:  {idle}")
+    print(f"   Hilos del proceso:     {threads}")
+    if latencies:
+        ordered = sorted(latencies)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        print(f"   Peticiones:            {len(latencies)} ({len(latencies) / elapsed:,.0f} req/s)")
+        print(f"   Latencia p50 / p99:    {statistics.median(ordered) * 1000:.1f} / {p99 * 1000:.1f} ms")
+    print(f"   Errores:               {len(errors)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor web con módem simulado")
+    parser.add_argument('--mode', choices=['async', 'threaded', 'both'], default='both')
+    parser.add_argument('--idle', type=int, default=1000, help="Conexiones inactivas")
+    parser.add_argument('--clients', type=int, default=20, help="Clientes consultando sin pausa")
+    parser.add_argument('--duration', type=float, default=5.0, help="Segundos de carga")
+    parser.add_argument('--latency', type=float, default=0.0005, help="Segundos por comando AT simulado")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    modes = ['threaded', 'async'] if args.mode == 'both' else [args.mode]
+
+    print("🚀 === PRUEBA DE CARGA SERVIDOR WEB ===")
+    print(f"   {args.idle} conexiones inactivas, {args.clients} clientes activos, {args.duration:.0f} s")
+
+    for mode in modes:
+        port, stop = start_server(mode, args.latency)
+        try:
+            result = asyncio.run(load(port, args.idle, args.clients, args.duration))
+        finally:
+            stop()
+        report(mode, *result)
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,18 @@ Sistema SMS Gateway Completo y Funcional
 Integra el motor corregido con todas las funcionalidades
 """
 import asyncio
+import itertools
 import time
-import threading
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 from dataclasses import dataclass
 from sms_engine_fixed import FixedSMSEngine
+from at_multiplexer import UnsolicitedResult
+from store_ingestion import StoreIngester
+from reply_index import ReplyIndex
+
+# Sufijo para que dos envíos en el mismo segundo no compartan message_id
+_message_ids = itertools.count(1)
 
 @dataclass
 class MessageTracker:
@@ -35,10 +41,13 @@ class CompleteSMSGateway:
     def __init__(self):
         self.engine = FixedSMSEngine()
         self.sent_messages: Dict[str, MessageTracker] = {}
+        self.replies = ReplyIndex()  # Envíos que esperan respuesta, por número
         self.received_messages: List[ReceivedMessage] = []
         self.monitoring_active = False
-        self.monitor_thread: Optional[threading.Thread] = None
-        self._processed_messages = set()  # Para evitar duplicados
+        self.monitor_task: Optional[asyncio.Task] = None
+        self._check_now: Optional[asyncio.Event] = None
+        self._unsubscribe_urc: Optional[Callable[[], None]] = None
+        self.ingester = StoreIngester(self.engine)  # Guarda en SQLite y borra con AT+CMGD
     
     async def connect(self):
         """Conecta al gateway"""
@@ -55,7 +64,7 @@ class CompleteSMSGateway:
         """Envía mensaje con tracking completo"""
         
         if not message_id:
-            message_id = f"msg_{int(time.time())}"
+            message_id = f"msg_{int(time.time())}_{next(_message_ids)}"
         
         # Crear tracker
         tracker = MessageTracker(
@@ -72,6 +81,7 @@ class CompleteSMSGateway:
         if result.success:
             tracker.status = "sent"
             tracker.reference_id = result.reference_id
+            self.replies.add(phone_number, message_id, tracker.sent_time.timestamp())
             print(f"✅ Mensaje {message_id} enviado exitosamente (Ref: {result.reference_id})")
         else:
             tracker.status = "failed"
@@ -97,85 +107,43 @@ class CompleteSMSGateway:
         except:
             print("⚠️ Usando polling manual para recepción")
         
-        # Iniciar hilo de monitoreo
-        self.monitor_thread = threading.Thread(
-            target=self._monitor_loop,
-            daemon=True
-        )
-        self.monitor_thread.start()
+        # Tarea de monitoreo en el mismo loop que el motor: comparte el
+        # multiplexor con los envíos en lugar de pelear por el puerto
+        self._check_now = asyncio.Event()
+        self._unsubscribe_urc = self.engine.subscribe_urc(self._on_urc)
+        self.monitor_task = asyncio.ensure_future(self._monitor_loop())
         
         print("✅ Monitoreo activo")
     
-    def _monitor_loop(self):
-        """Loop de monitoreo en hilo separado"""
+    def _on_urc(self, urc: UnsolicitedResult):
+        """+CMTI/+CMT: revisar la memoria sin esperar al próximo ciclo"""
         
-        last_check = time.time()
+        if urc.line.startswith(('+CMTI:', '+CMT:')) and self._check_now:
+            self._check_now.set()
+    
+    async def _monitor_loop(self):
+        """Loop de monitoreo (cada 10 segundos o al llegar un aviso del módem)"""
         
         while self.monitoring_active:
             try:
-                current_time = time.time()
+                # Leer la memoria del módem: sólo trae lo que no se había guardado
+                stored_messages = await self.ingester.sweep()
                 
-                # Verificar cada 10 segundos
-                if current_time - last_check >= 10:
-                    # Crear loop para operaciones async
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    
-                    try:
-                        # Verificar mensajes almacenados
-                        stored_messages = loop.run_until_complete(self._check_stored_messages())
-                        
-                        # Procesar nuevos mensajes
-                        for msg_data in stored_messages:
-                            self._process_new_message(msg_data)
-                        
-                        last_check = current_time
-                        
-                    finally:
-                        loop.close()
+                # Procesar nuevos mensajes
+                for msg_data in stored_messages:
+                    self._process_new_message(msg_data)
                 
-                time.sleep(2)
+                self._check_now.clear()
+                try:
+                    await asyncio.wait_for(self._check_now.wait(), 10)
+                except asyncio.TimeoutError:
+                    pass
                 
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 print(f"❌ Error en monitoreo: {e}")
-                time.sleep(5)
-    
-    async def _check_stored_messages(self):
-        """Verifica mensajes almacenados"""
-        
-        try:
-            response = await self.engine._send_command('AT+CMGL="ALL"')
-            messages = []
-            
-            lines = response.split('\n')
-            i = 0
-            
-            while i < len(lines):
-                line = lines[i].strip()
-                
-                if line.startswith('+CMGL:'):
-                    if i + 1 < len(lines):
-                        content = lines[i + 1].strip()
-                        
-                        # Extraer información
-                        parts = line.split(',')
-                        if len(parts) >= 3:
-                            sender = parts[2].strip().strip('"')
-                            
-                            messages.append({
-                                'sender': sender,
-                                'content': content,
-                                'raw_line': line
-                            })
-                    
-                    i += 1
-                
-                i += 1
-            
-            return messages
-            
-        except Exception as e:
-            return []
+                await asyncio.sleep(5)
     
     def _process_new_message(self, msg_data):
         """Procesa un mensaje nuevo"""
@@ -184,12 +152,6 @@ class CompleteSMSGateway:
             sender = msg_data['sender']
             content = msg_data['content']
             
-            # Crear identificador único para evitar duplicados
-            msg_signature = f"{sender}_{content}_{datetime.now().date()}"
-            
-            if msg_signature in self._processed_messages:
-                return  # Ya procesado
-            
             # Crear mensaje recibido
             received_msg = ReceivedMessage(
                 phone_number=sender,
@@ -202,7 +164,6 @@ class CompleteSMSGateway:
             
             # Agregar a la lista
             self.received_messages.append(received_msg)
-            self._processed_messages.add(msg_signature)
             
             # Notificar
             emoji = "↩️" if received_msg.is_response else "📨"
@@ -217,33 +178,37 @@ class CompleteSMSGateway:
     def _check_if_response(self, received_msg: ReceivedMessage):
         """Verifica si es respuesta a un mensaje enviado"""
         
-        # Buscar mensajes enviados al mismo número en las últimas 24 horas
-        for msg_id, tracker in self.sent_messages.items():
-            if (tracker.phone_number.replace('+51', '') in received_msg.phone_number or 
-                received_msg.phone_number.replace('+51', '') in tracker.phone_number):
-                
-                # Verificar que sea reciente (últimas 24 horas)
-                time_diff = (datetime.now() - tracker.sent_time).total_seconds()
-                if time_diff < 86400 and tracker.status == "sent":
-                    
-                    # Marcar como respuesta
-                    received_msg.is_response = True
-                    received_msg.related_message_id = msg_id
-                    
-                    # Actualizar tracker
-                    tracker.status = "response_received"
-                    tracker.response_message = received_msg.message
-                    tracker.response_time = received_msg.timestamp
-                    
-                    break
+        # Envío más reciente al mismo número (con o sin +51) en las últimas 24 horas
+        msg_id = self.replies.match(received_msg.phone_number)
+        tracker = self.sent_messages.get(msg_id) if msg_id else None
+        if tracker is None:
+            return
+        
+        # Marcar como respuesta
+        received_msg.is_response = True
+        received_msg.related_message_id = msg_id
+        
+        # Actualizar tracker
+        tracker.status = "response_received"
+        tracker.response_message = received_msg.message
+        tracker.response_time = received_msg.timestamp
     
     async def stop_monitoring(self):
         """Detiene el monitoreo"""
         
         self.monitoring_active = False
         
-        if self.monitor_thread:
-            self.monitor_thread.join(timeout=5)
+        if self._unsubscribe_urc:
+            self._unsubscribe_urc()
+            self._unsubscribe_urc = None
+        
+        if self.monitor_task:
+            self.monitor_task.cancel()
+            try:
+                await self.monitor_task
+            except asyncio.CancelledError:
+                pass
+            self.monitor_task = None
         
         print("🔔 Monitoreo detenido")
     
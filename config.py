@@ -13,6 +13,10 @@ class Settings(BaseSettings):
     
     # Configuración de la base de datos
     DATABASE_URL: str = "sqlite:///./sms_gateway.db"
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"  # FULL: fsync en cada commit
+    SQLITE_BUSY_TIMEOUT: int = 5000  # ms
+    SQLITE_MMAP_SIZE: int = 268435456  # 256 MB
     
     # Configuración del servidor
     HOST: str = "0.0.0.0"
@@ -24,6 +28,9 @@ class Settings(BaseSettings):
     DEFAULT_SMSC: str = "+51997990000"
     MAX_RETRIES: int = 3
     RETRY_DELAY: int = 30  # segundos
+    NETWORK_SAMPLE_INTERVAL: int = 30  # segundos entre consultas COPS/CSQ/CREG
+    DELIVERY_REPORTS: bool = True  # Pedir reporte de entrega (+CDS) por cada SMS
+    STATUS_FLUSH_INTERVAL: float = 0.25  # segundos que se agrupan cambios de estado por transacción
     
     # Configuración de logs
     LOG_LEVEL: str = "INFO"
@@ -1,10 +1,15 @@
 """
 Configuración de la base de datos
 """
-from sqlalchemy import create_engine
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
-from models import Base
+from models import Base, SMSMessage, MessageStatus
 from config import settings
+from sqlite_profile import apply_profile
+from write_behind import WriteBehind
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,6 +20,18 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 )
 
+if "sqlite" in settings.DATABASE_URL:
+    @event.listens_for(engine, "connect")
+    def _configure_sqlite(dbapi_connection, connection_record):
+        """WAL, synchronous, busy_timeout y mmap en cada conexión del pool"""
+        apply_profile(
+            dbapi_connection,
+            journal_mode=settings.SQLITE_JOURNAL_MODE,
+            synchronous=settings.SQLITE_SYNCHRONOUS,
+            busy_timeout=settings.SQLITE_BUSY_TIMEOUT,
+            mmap_size=settings.SQLITE_MMAP_SIZE
+        )
+
 # Crear sessionmaker
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -22,11 +39,24 @@ def create_tables():
     """Crea todas las tablas en la base de datos"""
     try:
         Base.metadata.create_all(bind=engine)
+        _add_missing_columns()
         logger.info("Tablas de base de datos creadas exitosamente")
     except Exception as e:
         logger.error(f"Error creando tablas: {e}")
         raise
 
+def _add_missing_columns():
+    """create_all no modifica tablas existentes: agrega las columnas nuevas (nullable)"""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    logger.info(f"Columna agregada: {table.name}.{column.name}")
+
 def get_db() -> Session:
     """Obtiene una sesión de base de datos"""
     db = SessionLocal()
@@ -38,3 +68,21 @@ def get_db() -> Session:
 def get_db_sync() -> Session:
     """Obtiene una sesión de base de datos síncrona"""
     return SessionLocal()
+
+def write_message_updates(rows: List[Dict]):
+    """Aplica un lote de actualizaciones de SMSMessage en una transacción"""
+    db = SessionLocal()
+    try:
+        db.bulk_update_mappings(SMSMessage, rows)
+        db.commit()
+    finally:
+        db.close()
+
+def message_update(message_id: int, status: MessageStatus, **fields) -> Dict:
+    """Fila para status_writer.submit(): estado, updated_at y campos extra"""
+    return {"id": message_id, "status": status, "updated_at": datetime.now(), **fields}
+
+# Cambios de estado de los mensajes: se agrupan en una transacción cada
+# STATUS_FLUSH_INTERVAL segundos en lugar de un commit por transición
+status_writer = WriteBehind(write_message_updates, interval=settings.STATUS_FLUSH_INTERVAL,
+                            name="sms-status-writer")
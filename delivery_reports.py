@@ -0,0 +1,161 @@
+"""
+Reportes de Entrega (SMS-STATUS-REPORT)
+Pide los reportes al módem y asocia cada +CDS al envío por (módem, <mr>,
+época) en O(1) aunque la referencia de 8 bits ya haya dado la vuelta
+"""
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from at_multiplexer import ATCommandError, ATCommandMultiplexer, UnsolicitedResult
+from sms_pdu import PDUError, decode_pdu
+
+logger = logging.getLogger(__name__)
+
+SUBMIT_WITH_REPORT = 0x31        # Primer octeto de SMS-SUBMIT (17) con TP-SRR (0x20)
+REPORT_CNMI = "AT+CNMI=1,1,0,1,0"   # ds=1: el reporte llega como +CDS
+REPORT_TTL = 48 * 3600           # La validez es de 24 h (CSMP 167): después no llega reporte
+REFERENCE_MODULO = 256           # TP-MR es de 8 bits
+
+async def enable_status_reports(modem: ATCommandMultiplexer, pdu_mode: bool = False,
+                                validity: int = 167) -> bool:
+    """Activa los reportes de entrega; False si el módem no los acepta
+
+    En modo texto TP-SRR va en el primer octeto de AT+CSMP; en modo PDU lo
+    lleva cada PDU (encode_submit(status_report=True)).
+    """
+    try:
+        if not pdu_mode:
+            await modem.execute(f"AT+CSMP={SUBMIT_WITH_REPORT},{validity},0,0")
+        await modem.execute(REPORT_CNMI)
+        return True
+    except ATCommandError as e:
+        logger.warning(f"⚠️ Reportes de entrega no disponibles: {e}")
+        return False
+
+@dataclass
+class DeliveryReport:
+    reference: int
+    status: int                         # TP-ST
+    recipient: Optional[str] = None
+    discharge_time: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        """'delivered', 'pending' (el centro sigue intentando) o 'failed'"""
+        if self.status < 0x20:
+            return 'delivered'
+        if self.status < 0x40:
+            return 'pending'
+        return 'failed'
+
+    @property
+    def final(self) -> bool:
+        return self.state != 'pending'
+
+def parse_status_report(urc: UnsolicitedResult) -> Optional[DeliveryReport]:
+    """+CDS en modo texto o PDU -> DeliveryReport (None si no es un reporte válido)"""
+
+    if urc.prefix != '+CDS':
+        return None
+
+    if urc.body:
+        # +CDS: <largo> seguido del PDU
+        try:
+            sms = decode_pdu(urc.body)
+        except PDUError as e:
+            logger.warning(f"⚠️ Reporte de entrega ilegible: {e}")
+            return None
+        if sms.kind != 'status_report':
+            return None
+        return DeliveryReport(reference=sms.message_reference, status=sms.status,
+                              recipient=sms.number, discharge_time=sms.discharge_time)
+
+    # +CDS: <fo>,<mr>,[<ra>],[<tora>],<scts>,<dt>,<st>
+    params = urc.params
+    if len(params) < 7 or not params[1].isdigit() or not params[-1].isdigit():
+        return None
+    return DeliveryReport(reference=int(params[1]), status=int(params[-1]),
+                          recipient=params[2] or None, discharge_time=params[-2] or None)
+
+class DeliveryTracker:
+    """Envíos que esperan reporte, por (módem, <mr>, época)
+
+        tracker = DeliveryTracker()
+        tracker.register('/dev/ttyUSB0', '42', message_id)
+        tracker.resolve('/dev/ttyUSB0', report)   # -> message_id
+
+    La época de un módem sube cada vez que su <mr> no crece respecto del
+    envío anterior (dio la vuelta en 255 o el módem se reinició). Un
+    reporte con <mr> mayor que el último enviado pertenece a la vuelta
+    anterior, así que un reporte tardío no se asocia al envío nuevo que
+    reutilizó la referencia.
+    """
+
+    def __init__(self, ttl: float = REPORT_TTL, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self._clock = clock
+        self._pending: Dict[Tuple[str, int, int], Tuple[float, Any]] = {}
+        self._cursor: Dict[str, Tuple[int, int]] = {}   # módem -> (último <mr>, época)
+        self._expiry: Deque[Tuple[Tuple[str, int, int], Tuple[float, Any]]] = deque()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def register(self, modem: str, reference: Any, key: Any, sent_at: Optional[float] = None):
+        """Registra un envío aceptado (+CMGS: <mr>); los envíos deben llegar en orden"""
+
+        now = self._clock()
+        self._evict(now)
+
+        reference = int(reference) % REFERENCE_MODULO
+        last, epoch = self._cursor.get(modem, (-1, 0))
+        if reference <= last:
+            epoch += 1
+        self._cursor[modem] = (reference, epoch)
+
+        slot = (modem, reference, epoch)
+        entry = (now if sent_at is None else sent_at, key)
+        self._pending[slot] = entry
+        self._expiry.append((slot, entry))
+
+    def resolve(self, modem: str, report: DeliveryReport) -> Optional[Any]:
+        """Clave del envío al que corresponde el reporte, o None
+
+        Un reporte intermedio (el centro sigue intentando) no lo quita de
+        pendientes; uno final sí.
+        """
+        self._evict(self._clock())
+
+        cursor = self._cursor.get(modem)
+        if cursor is None:
+            return None
+
+        reference = report.reference % REFERENCE_MODULO
+        last, epoch = cursor
+        if reference > last:
+            epoch -= 1
+
+        for candidate in (epoch, epoch - 1):
+            slot = (modem, reference, candidate)
+            entry = self._pending.get(slot)
+            if entry is not None:
+                if report.final:
+                    del self._pending[slot]
+                return entry[1]
+        return None
+
+    def _evict(self, now: float):
+        expiry = self._expiry
+        while expiry and now - expiry[0][1][0] >= self.ttl:
+            slot, entry = expiry.popleft()
+            # Los ya resueltos no están; un slot sólo se reocupa en otra época
+            if self._pending.get(slot) is entry:
+                del self._pending[slot]
+
+    def clear(self):
+        self._pending.clear()
+        self._cursor.clear()
+        self._expiry.clear()
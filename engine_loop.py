@@ -0,0 +1,93 @@
+"""
+Loop del Motor SMS
+Un hilo con un event loop persistente donde viven el motor y su
+multiplexor; los hilos del servidor HTTP le entregan corrutinas en lugar
+de crear y cerrar un loop por petición
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Awaitable, Optional
+
+logger = logging.getLogger(__name__)
+
+class EngineLoopThread:
+    """Event loop de larga vida en un hilo dedicado
+
+        engine_loop = EngineLoopThread()
+        engine_loop.start()
+        result = engine_loop.run(engine.send_sms(numero, texto), timeout=60)
+    """
+
+    def __init__(self, name: str = 'sms-engine-loop'):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    @property
+    def loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        return self._loop
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Arranca el hilo y espera a que el loop esté corriendo"""
+
+        if self.is_running:
+            return
+
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run_forever, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_forever(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        loop.call_soon(self._ready.set)
+
+        try:
+            loop.run_forever()
+        finally:
+            # Cancelar lo que quedó pendiente antes de cerrar
+            pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+            self._loop = None
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """Programa la corrutina en el loop del motor sin esperarla"""
+
+        if not self.is_running:
+            raise RuntimeError("El loop del motor no está corriendo")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Awaitable, timeout: float = 30.0) -> Any:
+        """Ejecuta la corrutina en el loop del motor y espera hasta `timeout` segundos"""
+
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"Tiempo de espera agotado ({timeout:.0f} s)")
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el loop y espera al hilo"""
+
+        if not self.is_running:
+            return
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"⚠️ El hilo {self.name} no terminó a tiempo")
+        self._thread = None
@@ -0,0 +1,139 @@
+"""
+Eventos del Gateway (Server-Sent Events)
+Mensajes recibidos, resultados de envío y cambios de conexión se publican
+una vez y se reparten a cada navegador suscrito, en lugar de que cada
+pestaña consulte /api/messages cada pocos segundos
+"""
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 15.0   # Comentario SSE para detectar clientes caídos
+QUEUE_SIZE = 256            # Eventos pendientes antes de soltar a un cliente lento
+
+SSE_HEADERS = {
+    'Content-Type': 'text/event-stream; charset=utf-8',
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+HEARTBEAT = b': ping\n\n'
+
+@dataclass
+class ServerEvent:
+    id: int
+    type: str
+    data: Any
+
+    def encode(self) -> bytes:
+        payload = json.dumps(self.data, ensure_ascii=False)
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n".encode('utf-8')
+
+class Subscription(ABC):
+    """Cola de eventos de un cliente; `closed` si se quedó atrás y fue soltado"""
+
+    def __init__(self):
+        self.closed = False
+
+    @abstractmethod
+    def push(self, event: ServerEvent) -> bool:
+        """Encola sin bloquear; False si la cola estaba llena (el cliente queda cerrado)"""
+
+class ThreadSubscription(Subscription):
+    """Para el servidor con hilos: el handler bloquea en `get()`"""
+
+    def __init__(self, maxsize: int = QUEUE_SIZE):
+        super().__init__()
+        self._queue: queue.Queue = queue.Queue(maxsize)
+
+    def push(self, event: ServerEvent) -> bool:
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+    def get(self, timeout: float = HEARTBEAT_INTERVAL) -> Optional[ServerEvent]:
+        """Próximo evento, o None si pasó `timeout` sin novedades"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class AsyncSubscription(Subscription):
+    """Para el servidor asyncio: una corrutina en espera por cliente"""
+
+    def __init__(self, maxsize: int = QUEUE_SIZE):
+        super().__init__()
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def push(self, event: ServerEvent) -> bool:
+        if threading.get_ident() != self._thread_id:
+            self._loop.call_soon_threadsafe(self.push, event)
+            return True
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.closed = True
+            return False
+
+    async def get(self, timeout: float = HEARTBEAT_INTERVAL) -> Optional[ServerEvent]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class EventBroadcaster:
+    """Reparte cada evento publicado a todas las suscripciones abiertas
+
+        events = EventBroadcaster()
+        subscription = events.subscribe(ThreadSubscription())
+        events.publish('message', {...})
+        subscription.get()
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, subscription: Subscription) -> Subscription:
+        with self._lock:
+            # Ya dada de baja (p. ej. el handler se rindió antes de que el loop la registrara)
+            if not subscription.closed:
+                self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Quita y cierra la suscripción; suscribirla después ya no la registra"""
+        with self._lock:
+            subscription.closed = True
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, event_type: str, data: Any) -> ServerEvent:
+        with self._lock:
+            event = ServerEvent(next(self._ids), event_type, data)
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            if not subscription.push(event):
+                logger.warning("⚠️ Cliente de eventos demasiado lento, se desconecta")
+                self.unsubscribe(subscription)
+        return event
@@ -0,0 +1,66 @@
+"""
+Historial en Memoria de Capacidad Fija
+Las últimas N entradas quedan en memoria para el dashboard; las que van
+saliendo se entregan en lotes a una función que las guarda en disco, así
+memoria y respuestas quedan acotadas aunque el gateway corra meses
+"""
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+DEFAULT_CAPACITY = 500
+SPILL_BATCH = 50
+
+class HistoryBuffer:
+    """Buffer circular con volcado de lo desplazado
+
+        sent = HistoryBuffer(500, spill=store.save_sent)
+        sent.append(entry)      # la entrada 501 manda la más antigua a spill
+        list(sent)              # las 500 más recientes, en orden
+
+    `spill` recibe listas de `spill_batch` entradas; sin `spill` lo
+    desplazado simplemente se descarta (p. ej. si ya está en la base).
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY,
+                 spill: Optional[Callable[[List[Dict]], Any]] = None,
+                 spill_batch: int = SPILL_BATCH):
+        self.capacity = capacity
+        self.spill = spill
+        self.spill_batch = spill_batch
+        self.total = 0     # Entradas agregadas desde el arranque, no sólo las retenidas
+        self._entries: Deque[Dict] = deque()
+        self._evicted: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._entries)
+
+    def snapshot(self) -> List[Dict]:
+        """Copia de las entradas retenidas, para serializar fuera del hilo que las modifica"""
+        return [dict(entry) for entry in self._entries]
+
+    def append(self, entry: Dict):
+        self._entries.append(entry)
+        self.total += 1
+
+        if len(self._entries) > self.capacity:
+            evicted = self._entries.popleft()
+            if self.spill is not None:
+                self._evicted.append(evicted)
+                if len(self._evicted) >= self.spill_batch:
+                    self.flush()
+
+    def flush(self):
+        """Entrega a `spill` lo desplazado que aún no se entregó"""
+        if self._evicted:
+            batch, self._evicted = self._evicted, []
+            self.spill(batch)
+
+    def drain(self) -> List[Dict]:
+        """Todo lo que no pasó por `spill` (desplazado y retenido); el buffer queda vacío"""
+        entries = self._evicted + list(self._entries)
+        self._evicted = []
+        self._entries.clear()
+        return entries
@@ -0,0 +1,82 @@
+"""
+Índice de Mensajes Entrantes
+Deduplica los mensajes leídos de la memoria del módem por (índice de
+almacenamiento, remitente, timestamp SCTS) en O(1), con expiración por TTL
+para que la memoria no crezca durante meses de operación
+"""
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+DEFAULT_TTL = 30 * 24 * 3600    # Segundos sin volver a ver un mensaje antes de olvidarlo
+DEFAULT_MAX_ENTRIES = 10000
+
+def message_key(sender: str, timestamp: Optional[str] = None, index: Optional[str] = None,
+                content: str = '') -> Tuple:
+    """Clave de un mensaje almacenado
+
+    El índice solo no alcanza (el módem lo reutiliza al borrar) y el texto
+    tampoco (un equipo puede repetir el mismo mensaje); índice + remitente +
+    SCTS identifican una recepción. Sin SCTS se usa un hash del contenido.
+    """
+    if timestamp:
+        return (index, sender, timestamp)
+    return (index, sender, hash(content))
+
+class InboundIndex:
+    """Claves vistas recientemente, en orden de última aparición
+
+        inbound = InboundIndex()
+        if inbound.add(message_key(msg['sender'], msg['timestamp'], msg['index'])):
+            ...  # mensaje nuevo
+
+    Volver a ver un mensaje renueva su TTL, así que lo que sigue guardado en
+    la SIM no expira y reaparece como nuevo; sólo se olvida lo que dejó de
+    listarse (borrado) hace más de `ttl` segundos.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        seen = self._entries.get(key)
+        return seen is not None and self._clock() - seen < self.ttl
+
+    def add(self, key: Hashable) -> bool:
+        """Registra la clave; True si no se había visto (o ya había expirado)"""
+
+        now = self._clock()
+        self._evict(now)
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self._entries[key] = now
+            return False
+
+        self._entries[key] = now
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def discard(self, key: Hashable):
+        """Olvida la clave (p. ej. el módem borró el mensaje y reutilizará su índice)"""
+        self._entries.pop(key, None)
+
+    def _evict(self, now: float):
+        # Las más antiguas están al principio: se corta en la primera vigente
+        entries = self._entries
+        while entries:
+            key, seen = next(iter(entries.items()))
+            if now - seen < self.ttl:
+                break
+            entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
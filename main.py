@@ -1,18 +1,22 @@
 """
 API REST para el SMS Gateway
 """
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
 from config import settings
-from database import get_db, create_tables
+from database import get_db, create_tables, message_update, status_writer
+from outbound_queue import OutboundQueue
 from models import SMSMessage, Device, MessageStatus, MessageType
 from sms_engine import sms_engine
+from network_sampler import CachedJSON, NetworkSampler, etag_matches
+from delivery_reports import REPORT_TTL, DeliveryTracker, parse_status_report
+import metrics
 from pydantic import BaseModel
 
 # Configurar logging
@@ -33,6 +37,7 @@ class SMSResponse(BaseModel):
     reference_id: Optional[str] = None
     created_at: datetime
     sent_at: Optional[datetime] = None
+    delivered_at: Optional[datetime] = None
 
 class DeviceCreate(BaseModel):
     phone_number: str
@@ -63,6 +68,81 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Operador, señal y registro se consultan cada NETWORK_SAMPLE_INTERVAL segundos;
+# los endpoints de estado sirven la última muestra con ETag
+network_sampler = NetworkSampler(sms_engine.get_network_info,
+                                 interval=settings.NETWORK_SAMPLE_INTERVAL,
+                                 is_connected=lambda: sms_engine.is_connected)
+
+def _build_status() -> dict:
+    snapshot = network_sampler.snapshot
+    return {
+        "connected": sms_engine.is_connected,
+        "timestamp": snapshot.changed_at_iso,
+        "network": snapshot.info
+    }
+
+def _build_network_info() -> dict:
+    return NetworkInfo(**network_sampler.snapshot.info).dict()
+
+status_cache = CachedJSON(_build_status)
+network_info_cache = CachedJSON(_build_network_info)
+
+def _cached_response(request: Request, cached) -> Response:
+    """200 con el cuerpo precalculado, o 304 si el cliente ya tiene ese ETag"""
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Reportes de entrega: cada +CDS se asocia al envío por (módem, <mr>, época)
+# y el estado pasa por status_writer como el resto de las transiciones
+delivery_tracker = DeliveryTracker()
+
+def _restore_pending_deliveries(modem_name: str):
+    """Vuelve a esperar los reportes de lo enviado antes de reiniciar la API"""
+    db = SessionLocal()
+    try:
+        pending = db.query(SMSMessage.id, SMSMessage.reference_id, SMSMessage.sent_at).filter(
+            SMSMessage.status == MessageStatus.SENT,
+            SMSMessage.reference_id.isnot(None),
+            SMSMessage.sent_at >= datetime.now() - timedelta(seconds=REPORT_TTL)
+        ).order_by(SMSMessage.sent_at, SMSMessage.id).all()
+    finally:
+        db.close()
+    
+    # En orden de envío, para que las épocas de <mr> coincidan con las originales
+    for message_id, reference_id, sent_at in pending:
+        if reference_id.isdigit():
+            delivery_tracker.register(modem_name, reference_id, message_id, sent_at.timestamp())
+
+def _on_delivery_report(modem_name: str, urc):
+    report = parse_status_report(urc)
+    if report is None:
+        return
+    
+    message_id = delivery_tracker.resolve(modem_name, report)
+    if message_id is None:
+        logger.debug(f"Reporte de entrega sin envío asociado (mr={report.reference})")
+        return
+    
+    if report.state == 'delivered':
+        status_writer.submit(message_update(message_id, MessageStatus.DELIVERED,
+                                            delivered_at=datetime.now()))
+    elif report.state == 'failed':
+        status_writer.submit(message_update(message_id, MessageStatus.FAILED,
+                                            error_message=f"Reporte de entrega: estado {report.status}"))
+
+def _on_sent(message_id: int, result, worker):
+    if settings.DELIVERY_REPORTS and worker.engine.modem is not None:
+        delivery_tracker.register(worker.engine.modem.name, result.reference_id, message_id)
+
+# La API sólo encola (filas PENDING); un worker por módem reclama, envía y
+# reintenta con espera exponencial hasta MAX_RETRIES
+outbound_queue = OutboundQueue(on_sent=_on_sent)
+outbound_queue.add_worker(sms_engine, settings.SERIAL_PORT)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -79,18 +159,32 @@ async def startup_event():
     
     # Crear tablas de base de datos
     create_tables()
+    status_writer.start()
     
     # Conectar al gateway SMS
     if not await sms_engine.connect():
         logger.error("No se pudo conectar al gateway SMS")
     else:
         logger.info("Gateway SMS conectado exitosamente")
+        if settings.DELIVERY_REPORTS:
+            modem_name = sms_engine.modem.name
+            _restore_pending_deliveries(modem_name)
+            sms_engine.subscribe_urc(lambda urc: _on_delivery_report(modem_name, urc))
+    
+    # Muestreo de red en segundo plano para /status y /network-info
+    await network_sampler.start()
+    
+    # Envíos pendientes, incluidos los que quedaron de la ejecución anterior
+    await outbound_queue.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Limpieza al cerrar la aplicación"""
     logger.info("Cerrando SMS Gateway API")
+    await outbound_queue.stop()
+    await network_sampler.stop()
     await sms_engine.disconnect()
+    status_writer.stop()
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
@@ -134,41 +228,29 @@ async def root():
     return html_content
 
 @app.get("/status")
-async def gateway_status():
-    """Estado del gateway SMS"""
-    network_info = await sms_engine.get_network_info()
+async def gateway_status(request: Request):
+    """Estado del gateway SMS (desde la instantánea de red, sin comandos AT)"""
     
-    return {
-        "connected": sms_engine.is_connected,
-        "timestamp": datetime.now(),
-        "network": network_info
-    }
+    connected = sms_engine.is_connected
+    return _cached_response(request, status_cache.get((connected, network_sampler.snapshot.version)))
+
+@app.get("/metrics")
+def get_metrics():
+    """Métricas en formato Prometheus (síncrono: la cola pendiente se cuenta en la base)"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.post("/send-sms", response_model=SMSResponse)
 async def send_sms(
     sms_request: SMSRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
-    """Envía un SMS"""
+    """Encola un SMS; el worker del módem lo envía y actualiza su estado"""
     
-    # Crear registro en base de datos
-    db_message = SMSMessage(
-        phone_number=sms_request.phone_number,
-        message=sms_request.message,
-        message_type=sms_request.message_type,
-        status=MessageStatus.PENDING
-    )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    
-    # Programar envío en background
-    background_tasks.add_task(
-        process_sms_sending,
-        db_message.id,
+    db_message = outbound_queue.enqueue(
+        db,
         sms_request.phone_number,
-        sms_request.message
+        sms_request.message,
+        sms_request.message_type
     )
     
     return SMSResponse(
@@ -179,42 +261,6 @@ async def send_sms(
         created_at=db_message.created_at
     )
 
-async def process_sms_sending(message_id: int, phone_number: str, message: str):
-    """Procesa el envío de SMS en background"""
-    db = SessionLocal()
-    try:
-        # Obtener mensaje de la base de datos
-        db_message = db.query(SMSMessage).filter(SMSMessage.id == message_id).first()
-        if not db_message:
-            return
-        
-        # Actualizar estado a SENDING
-        db_message.status = MessageStatus.SENDING
-        db.commit()
-        
-        # Enviar SMS
-        result = await sms_engine.send_sms(phone_number, message)
-        
-        if result.success:
-            db_message.status = MessageStatus.SENT
-            db_message.reference_id = result.reference_id
-            db_message.sent_at = datetime.now()
-        else:
-            db_message.status = MessageStatus.FAILED
-            db_message.error_message = result.error_message
-            db_message.retries += 1
-        
-        db.commit()
-        
-    except Exception as e:
-        logger.error(f"Error procesando envío de SMS {message_id}: {e}")
-        if db_message:
-            db_message.status = MessageStatus.FAILED
-            db_message.error_message = str(e)
-            db.commit()
-    finally:
-        db.close()
-
 @app.get("/messages", response_model=List[SMSResponse])
 async def get_messages(
     status: Optional[MessageStatus] = None,
@@ -242,7 +288,8 @@ async def get_messages(
             status=msg.status,
             reference_id=msg.reference_id,
             created_at=msg.created_at,
-            sent_at=msg.sent_at
+            sent_at=msg.sent_at,
+            delivered_at=msg.delivered_at
         )
         for msg in messages
     ]
@@ -262,7 +309,8 @@ async def get_message(message_id: int, db: Session = Depends(get_db)):
         status=message.status,
         reference_id=message.reference_id,
         created_at=message.created_at,
-        sent_at=message.sent_at
+        sent_at=message.sent_at,
+        delivered_at=message.delivered_at
     )
 
 @app.post("/devices", response_model=DeviceResponse)
@@ -318,14 +366,13 @@ async def get_devices(active_only: bool = True, db: Session = Depends(get_db)):
     ]
 
 @app.get("/network-info", response_model=NetworkInfo)
-async def get_network_info():
+async def get_network_info(request: Request):
     """Obtiene información de la red móvil"""
     
     if not sms_engine.is_connected:
         raise HTTPException(status_code=503, detail="Gateway no conectado")
     
-    info = await sms_engine.get_network_info()
-    return NetworkInfo(**info)
+    return _cached_response(request, network_info_cache.get(network_sampler.snapshot.version))
 
 # Importar SessionLocal aquí para evitar circular imports
 from database import SessionLocal
@@ -0,0 +1,169 @@
+"""
+Normalizador de Mensajes SMS
+Tablas de traducción precalculadas para los reemplazos conocidos y una
+caché LRU de descomposiciones NFKD para el resto de caracteres fuera del
+alfabeto GSM
+"""
+import codecs
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Optional
+
+from sms_pdu import ESCAPE, GSM7_BASIC, GSM7_CHARSET, segment_info
+
+# Reemplazos que los motores en modo texto aplicaban uno por uno
+DEFAULT_REPLACEMENTS = {
+    'ñ': 'n', 'Ñ': 'N',
+    'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
+    'Á': 'A', 'É': 'E', 'Í': 'I', 'Ó': 'O', 'Ú': 'U',
+    '🧪': 'TEST', '📱': '', '💬': '', '✅': 'OK', '❌': 'ERROR',
+    # Puntuación tipográfica (teclados de móvil, textos copiados)
+    '“': '"', '”': '"', '‘': "'", '’': "'", '–': '-', '—': '-', '…': '...',
+}
+
+# Con AT+CSCS="GSM" el cuerpo de AT+CMGS no se puede escribir en ASCII:
+# cada byte es un septeto del alfabeto GSM 03.38 ('@' es 0x00, '£' 0x01,
+# 'ñ' 0x7D y 0x7D en ASCII es '}'). La tabla de extensión necesita ESC,
+# que cancela el envío, y 'Ξ' ocupa 0x1A (Ctrl+Z): se aproximan
+TEXT_MODE_SUBSTITUTES = {
+    '€': 'EUR', '[': '(', ']': ')', '{': '(', '}': ')', '\\': '/',
+    '|': '/', '~': '-', '^': '', '\f': '', 'Ξ': 'X',
+}
+
+class _GSMCharsetTable(dict):
+    """Carácter -> septetos GSM (como chr) para str.translate; lo desconocido es '?'"""
+
+    def __init__(self):
+        super().__init__({ord(ch): chr(code) for code, ch in enumerate(GSM7_BASIC)
+                          if code not in (ESCAPE, 0x1A)})
+        self.update({
+            ord(ch): ''.join(chr(GSM7_BASIC.index(sub)) for sub in value)
+            for ch, value in TEXT_MODE_SUBSTITUTES.items()
+        })
+
+    def __missing__(self, code: int) -> str:
+        return '?'
+
+_GSM_CHARSET_TABLE = _GSMCharsetTable()
+
+def to_gsm_charset(text: str) -> bytes:
+    """Bytes del cuerpo de AT+CMGS en modo texto con CSCS="GSM" (texto ya normalizado)"""
+    return text.translate(_GSM_CHARSET_TABLE).encode('latin-1')
+
+@lru_cache(maxsize=2048)
+def _fallback(char: str) -> str:
+    """Aproximación GSM de un carácter: NFKD sin marcas combinantes, o '' si no hay"""
+    decomposed = unicodedata.normalize('NFKD', char)
+    return ''.join(ch for ch in decomposed if ch in GSM7_CHARSET)
+
+@dataclass
+class MessageInfo:
+    text: str                   # Texto normalizado (modo texto)
+    encoding: str               # 'gsm7' | 'ucs2' del texto original (modo PDU)
+    segments: int               # Segmentos del texto original en modo PDU
+    normalized_segments: int    # Segmentos del texto normalizado
+    truncated: bool = False
+
+class _TranslationTable(dict):
+    """Tabla para str.translate que completa sola los caracteres no vistos
+
+    Los caracteres GSM van con entrada identidad: un carácter ausente de la
+    tabla le cuesta a str.translate una excepción interna.
+    """
+
+    def __init__(self, replacements: Dict[str, str], limit: int = 4096):
+        super().__init__({ord(ch): ch for ch in GSM7_CHARSET})
+        self.update({code: chr(code) for code in range(128)})
+        self.update(str.maketrans(replacements))
+        self._limit = len(self) + limit
+
+    def __missing__(self, code: int) -> str:
+        value = _fallback(chr(code))
+        if len(self) < self._limit:
+            self[code] = value
+        return value
+
+class MessageNormalizer:
+    """Limpia mensajes para el modo texto (CSCS="GSM")
+
+    Los mensajes ASCII pasan sin copiarse. El resto (acentos, ñ, ¿¡) se
+    codifica en Latin-1 y se traduce con una tabla de 256 bytes; sólo los
+    tramos fuera de Latin-1 (emoji, comillas tipográficas) llegan al
+    manejador de errores del codec, que usa la tabla de str.translate y la
+    caché NFKD.
+    """
+
+    def __init__(self, replacements: Optional[Dict[str, str]] = None,
+                 max_length: Optional[int] = 160):
+        replacements = DEFAULT_REPLACEMENTS if replacements is None else replacements
+        self.max_length = max_length
+        self._table = _TranslationTable(replacements)
+        self._ascii_passthrough = not any(key.isascii() for key in replacements)
+
+        # Latin-1 con reemplazo de un solo carácter Latin-1 (o vacío) -> bytes.translate
+        byte_table = bytearray(range(256))
+        delete = bytearray()
+        multichar = bytearray()
+        for code in range(256):
+            value = self._table[code]
+            if value == '':
+                delete.append(code)
+            elif len(value) == 1 and ord(value) < 256:
+                byte_table[code] = ord(value)
+            else:
+                multichar.append(code)   # '½' -> '12': requiere la tabla completa
+        self._byte_table = bytes(byte_table)
+        self._byte_delete = bytes(delete)
+        self._multichar = re.compile(b'[' + re.escape(bytes(multichar)) + b']') if multichar else None
+
+        self._error_handler = f"sms-normalizer-{id(self)}"
+        codecs.register_error(self._error_handler, self._replace_run)
+
+    def _replace_run(self, error: UnicodeEncodeError):
+        run = error.object[error.start:error.end]
+        return run.translate(self._table), error.end
+
+    def _clean(self, message: str) -> str:
+        if self._ascii_passthrough and message.isascii():
+            return message
+
+        try:
+            data = message.encode('latin-1', self._error_handler)
+        except UnicodeEncodeError:
+            # Quedan letras GSM fuera de Latin-1 (Δ, Ω, €): tabla completa
+            return message.translate(self._table)
+
+        if self._multichar is not None and self._multichar.search(data):
+            return message.translate(self._table)
+        return data.translate(self._byte_table, self._byte_delete).decode('latin-1')
+
+    def _truncate(self, text: str) -> str:
+        if self.max_length is not None and len(text) > self.max_length:
+            return text[:self.max_length - 3] + "..."
+        return text
+
+    def normalize(self, message: str) -> str:
+        """Texto apto para el modo texto, recortado a `max_length`"""
+        return self._truncate(self._clean(message))
+
+    def analyze(self, message: str) -> MessageInfo:
+        """Normaliza e informa codificación y segmentos (para mostrar costos)"""
+
+        encoding, segments = segment_info(message)
+        clean = self._clean(message)
+        text = self._truncate(clean)
+        return MessageInfo(
+            text=text,
+            encoding=encoding,
+            segments=segments,
+            normalized_segments=segment_info(text)[1],
+            truncated=len(text) != len(clean)
+        )
+
+# Instancia compartida por los motores
+default_normalizer = MessageNormalizer()
+
+def normalize_message(message: str) -> str:
+    return default_normalizer.normalize(message)
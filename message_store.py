@@ -0,0 +1,190 @@
+"""
+Almacenamiento Persistente de Mensajes (SQLite, sin dependencias)
+Tabla `received_messages` compartida con models.ReceivedMessage: lo que se
+lee de la memoria del módem queda guardado antes de borrarlo con AT+CMGD.
+Los envíos que salen del historial en memoria van a `sms_messages`
+(models.SMSMessage), la misma tabla que consulta la API
+"""
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlite_profile import apply_profile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE = 'sms_gateway.db'   # El mismo archivo que DATABASE_URL de la API
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS received_messages (
+    id INTEGER PRIMARY KEY,
+    phone_number VARCHAR(20) NOT NULL,
+    message TEXT NOT NULL,
+    sms_timestamp VARCHAR(32),
+    received_at DATETIME,
+    is_response BOOLEAN DEFAULT 0,
+    related_message_id VARCHAR(50),
+    UNIQUE (phone_number, sms_timestamp, message)
+);
+CREATE INDEX IF NOT EXISTS ix_received_messages_phone_number ON received_messages (phone_number);
+CREATE TABLE IF NOT EXISTS sms_messages (
+    id INTEGER PRIMARY KEY,
+    phone_number VARCHAR(20) NOT NULL,
+    message TEXT NOT NULL,
+    message_type VARCHAR(12),
+    status VARCHAR(9),
+    reference_id VARCHAR(50),
+    method VARCHAR(10),
+    retries INTEGER,
+    max_retries INTEGER,
+    next_attempt_at DATETIME,
+    created_at DATETIME,
+    sent_at DATETIME,
+    delivered_at DATETIME,
+    updated_at DATETIME,
+    error_message TEXT,
+    response_message TEXT,
+    device_info TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_sms_messages_id ON sms_messages (id);
+CREATE INDEX IF NOT EXISTS ix_sms_messages_phone_number ON sms_messages (phone_number);
+CREATE INDEX IF NOT EXISTS ix_sms_messages_status ON sms_messages (status);
+CREATE INDEX IF NOT EXISTS ix_sms_messages_reference_id ON sms_messages (reference_id);
+"""
+
+def _db_time(iso: Optional[str]) -> Optional[str]:
+    # Formato de DateTime de SQLAlchemy en SQLite ('2024-08-22 19:30:15.123456')
+    return datetime.fromisoformat(iso).isoformat(sep=' ') if iso else None
+
+def _sent_status(entry: Dict) -> str:
+    # SQLAlchemy guarda los Enum por nombre: 'SENT', no 'sent'
+    if not entry.get('success'):
+        return 'FAILED'
+    if entry.get('delivery') == 'delivered':
+        return 'DELIVERED'
+    if entry.get('delivery') == 'failed':
+        return 'FAILED'
+    return 'SENT'
+
+def sent_key(entry: Dict) -> tuple:
+    """Fila de sms_messages de una entrada del historial: número + created_at (microsegundos)"""
+    return entry['phone_number'], _db_time(entry.get('timestamp'))
+
+def delivery_update(entry: Dict) -> Dict:
+    """Fila para MessageStore.update_delivery() a partir de una entrada del historial"""
+    return {'id': sent_key(entry), 'status': _sent_status(entry),
+            'delivered_at': _db_time(entry.get('delivered_at'))}
+
+def _sent_row(entry: Dict) -> tuple:
+    """Entrada del historial web -> fila de sms_messages"""
+    status = _sent_status(entry)
+    created = _db_time(entry.get('timestamp'))
+    return (
+        entry['phone_number'], entry['message'], 'COMMAND', status, entry.get('reference_id'),
+        'AT', 0, 3, created, created if entry.get('success') else None,
+        _db_time(entry.get('delivered_at')), created, entry.get('error')
+    )
+
+class MessageStore:
+    """Conexión SQLite única, serializada con un lock (se usa desde el executor)
+
+        store = MessageStore('sms_gateway.db')
+        nuevos = store.save_received(mensajes)   # una transacción
+    """
+
+    def __init__(self, path: str = DEFAULT_DATABASE):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Apertura diferida: crear el objeto no toca el disco
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            apply_profile(self._conn)   # WAL: convive con las conexiones de la API
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def save_received(self, entries: List[Dict]) -> List[Dict]:
+        """Guarda mensajes leídos del módem en una sola transacción
+
+        Devuelve los que no estaban guardados: releer un mensaje que no se
+        llegó a borrar (corte entre el commit y AT+CMGD) no lo duplica.
+        """
+        if not entries:
+            return []
+
+        received_at = datetime.now().isoformat(sep=' ')
+        inserted = []
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for entry in entries:
+                    # '' y no NULL: UNIQUE no compara NULLs entre sí
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO received_messages "
+                        "(phone_number, message, sms_timestamp, received_at) VALUES (?, ?, ?, ?)",
+                        (entry['sender'], entry['content'], entry.get('timestamp') or '', received_at)
+                    )
+                    if cursor.rowcount:
+                        inserted.append(entry)
+        return inserted
+
+    def save_sent(self, entries: List[Dict]):
+        """Guarda envíos del historial web en `sms_messages` (una transacción)"""
+
+        if not entries:
+            return
+
+        with self._lock:
+            # Dentro del lock: un reporte de entrega que llegue mientras tanto ya
+            # está en la entrada, o su update_delivery() se aplica después de este INSERT
+            rows = [_sent_row(entry) for entry in entries]
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO sms_messages (phone_number, message, message_type, status, "
+                    "reference_id, method, retries, max_retries, created_at, sent_at, "
+                    "delivered_at, updated_at, error_message) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+
+    def update_delivery(self, updates: List[Dict]):
+        """Estado de entrega de envíos que ya pasaron a `sms_messages` (una transacción)
+
+        Cada elemento viene de delivery_update(entrada).
+        Es la función de escritura de un WriteBehind.
+        """
+        if not updates:
+            return
+
+        now = datetime.now().isoformat(sep=' ')
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "UPDATE sms_messages SET status = ?, delivered_at = ?, updated_at = ? "
+                    "WHERE phone_number = ? AND created_at = ?",
+                    [(update['status'], update.get('delivered_at'), now) + tuple(update['id'])
+                     for update in updates]
+                )
+
+    def recent_received(self, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT phone_number, message, sms_timestamp, received_at, is_response "
+                "FROM received_messages ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {'phone_number': row[0], 'message': row[1], 'sms_timestamp': row[2],
+             'received_at': row[3], 'is_response': bool(row[4])}
+            for row in reversed(rows)
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
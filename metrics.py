@@ -0,0 +1,269 @@
+"""
+Métricas en Formato Prometheus
+Contadores, gauges e histogramas sin dependencias y baratos de actualizar:
+cada hilo escribe en su propia copia de los valores (sin lock ni
+contención en el camino del envío) y `/metrics` suma las copias al leer
+"""
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Segundos: de un comando AT simple (ms) a un AT+CMGS esperando al SMSC
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _Shards:
+    """Un diccionario de valores por hilo; sólo su hilo lo modifica
+
+    Leer copia cada diccionario (`dict.copy()` es atómico con el GIL). Los
+    valores de los hilos que terminaron se pasan a `retired` para que un
+    servidor con un hilo por petición no acumule copias.
+    """
+
+    def __init__(self, merge: Callable[[Dict, Dict], None]):
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()   # Sólo al crear una copia o al leer
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict = {}
+
+    def mine(self) -> Dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def collect(self) -> Dict:
+        with self._lock:
+            alive = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    self._merge(self._retired, values.copy())
+            self._shards = alive
+            total: Dict = {}
+            self._merge(total, self._retired)
+            for _, values in alive:
+                self._merge(total, values.copy())
+        return total
+
+def _add_values(total: Dict, values: Dict):
+    for key, value in values.items():
+        total[key] = total.get(key, 0) + value
+
+def _add_buckets(total: Dict, values: Dict):
+    for key, cells in values.items():
+        current = total.get(key)
+        if current is None:
+            total[key] = list(cells)
+        else:
+            for i, value in enumerate(cells):
+                current[i] += value
+
+class Registry:
+    """Métricas registradas, en el orden en que se crearon"""
+
+    def __init__(self):
+        self._metrics: List['_Metric'] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: '_Metric'):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics.append(metric)
+
+    def render(self) -> bytes:
+        """Exposición en texto (formato 0.0.4) de todas las métricas"""
+        lines: List[str] = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+REGISTRY = Registry()
+
+class _Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        if registry is not None:
+            registry.register(self)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Líneas de la exposición, sin HELP/TYPE"""
+
+    def _check(self, values: Tuple):
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name}: se esperaban las etiquetas {self.labels}, llegaron {values}")
+
+class Counter(_Metric):
+    """Contador monotónico: `requests.inc('AT+CMGS', 'ok')` (una etiqueta por posición)"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, documentation, labels, registry)
+        self._shards = _Shards(_add_values)
+
+    def inc(self, *labels: str, amount: float = 1):
+        values = self._shards.mine()
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._shards.collect().get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(self._shards.collect().items())]
+
+class Gauge(_Metric):
+    """Valor que sube y baja
+
+    Con `inc` / `dec` cada hilo acumula su diferencia y la lectura las suma.
+    Con `collect` el valor se calcula al leer: una función que devuelve un
+    número, o un diccionario {(etiquetas, ...): número}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY,
+                 collect: Optional[Callable[[], object]] = None):
+        super().__init__(name, documentation, labels, registry)
+        self.collect = collect
+        self._shards = _Shards(_add_values)
+
+    def inc(self, *labels: str, amount: float = 1):
+        values = self._shards.mine()
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def values(self) -> Dict[Tuple, float]:
+        if self.collect is None:
+            return self._shards.collect()
+        result = self.collect()
+        if isinstance(result, dict):
+            return result
+        return {(): result}
+
+    def samples(self) -> List[str]:
+        samples = []
+        for key, value in sorted(self.values().items()):
+            self._check(key)
+            samples.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return samples
+
+class Histogram(_Metric):
+    """Distribución por buckets: `latency.observe(0.42, 'AT+CMGS', 'prompt')`
+
+    Cada observación suma 1 a un solo bucket (búsqueda binaria) más la suma
+    y la cuenta; los acumulados `le` se calculan al leer.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _Shards(_add_buckets)
+
+    def observe(self, value: float, *labels: str):
+        values = self._shards.mine()
+        cells = values.get(labels)
+        if cells is None:
+            # Un contador por bucket, +Inf, suma y cuenta
+            cells = values[labels] = [0] * (len(self.buckets) + 3)
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+    def samples(self) -> List[str]:
+        samples = []
+        for key, cells in sorted(self._shards.collect().items()):
+            for bound, count in self._cumulative(cells):
+                labels = _format_labels(self.labels + ('le',), key + (bound,))
+                samples.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(cells[-2])}")
+            samples.append(f"{self.name}_count{labels} {cells[-1]}")
+        return samples
+
+    def _cumulative(self, cells: List) -> List[Tuple[str, int]]:
+        bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+        total = 0
+        cumulative = []
+        for bound, count in zip(bounds, cells):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _escape_label(value: object) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def render() -> bytes:
+    return REGISTRY.render()
+
+# ---------------------------------------------------------------------------
+# Métricas del gateway (las actualizan el multiplexor AT y la ingesta)
+# ---------------------------------------------------------------------------
+
+AT_COMMAND_SECONDS = Histogram(
+    'sms_gateway_at_command_seconds',
+    'Duración de cada fase de un comando AT: queue (espera en la cola), '
+    'prompt (AT+CMGS hasta el >) y response (hasta el código final; en AT+CMGS, la confirmación)',
+    ('modem', 'command', 'phase'))
+
+AT_COMMANDS = Counter(
+    'sms_gateway_at_commands_total',
+    'Comandos AT terminados por resultado (ok, error, timeout, no_prompt) y código +CMS/+CME',
+    ('modem', 'command', 'result', 'code'))
+
+SMS_SENT = Counter(
+    'sms_gateway_sms_sent_total',
+    'SMS (segmentos) aceptados por el módem con +CMGS',
+    ('modem',))
+
+SMS_FAILED = Counter(
+    'sms_gateway_sms_failed_total',
+    'SMS (segmentos) rechazados, por código +CMS ERROR (o ERROR, timeout, no_prompt)',
+    ('modem', 'code'))
+
+SMS_IN_FLIGHT = Gauge(
+    'sms_gateway_sms_in_flight',
+    'SMS encolados o enviándose en el multiplexor',
+    ('modem',))
+
+INBOUND_MESSAGES = Counter(
+    'sms_gateway_inbound_messages_total',
+    'Mensajes recibidos guardados desde la memoria del módem',
+    ('modem',))
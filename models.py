@@ -1,7 +1,7 @@
 """
 Modelos de base de datos para el SMS Gateway
 """
-from sqlalchemy import Column, Integer, String, DateTime, Text, Enum as SQLEnum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Enum as SQLEnum, Boolean, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from enum import Enum
@@ -36,6 +36,7 @@ class SMSMessage(Base):
     method = Column(String(10), default="AT")  # AT o GAMMU
     retries = Column(Integer, default=0)
     max_retries = Column(Integer, default=3)
+    next_attempt_at = Column(DateTime, nullable=True)  # Próximo reintento (cola de envíos)
     
     # Timestamps
     created_at = Column(DateTime, default=func.now())
@@ -51,6 +52,22 @@ class SMSMessage(Base):
     def __repr__(self):
         return f"<SMSMessage(id={self.id}, phone={self.phone_number}, status={self.status})>"
 
+class ReceivedMessage(Base):
+    """Mensajes leídos de la memoria del módem (message_store.py escribe la misma tabla)"""
+    __tablename__ = "received_messages"
+    __table_args__ = (UniqueConstraint("phone_number", "sms_timestamp", "message"),)
+    
+    id = Column(Integer, primary_key=True)
+    phone_number = Column(String(20), nullable=False, index=True)
+    message = Column(Text, nullable=False)
+    sms_timestamp = Column(String(32), nullable=True)  # SCTS tal como lo entrega el módem
+    received_at = Column(DateTime, default=func.now())
+    is_response = Column(Boolean, default=False)
+    related_message_id = Column(String(50), nullable=True)
+    
+    def __repr__(self):
+        return f"<ReceivedMessage(id={self.id}, phone={self.phone_number})>"
+
 class Device(Base):
     __tablename__ = "devices"
     
@@ -0,0 +1,252 @@
+"""
+Pool de Módems
+Conecta todos los módems detectados (un motor por puerto) y reparte los
+envíos entre los sanos, por menor carga o en ronda. Cada módem tiene su
+propio puerto y su propio multiplexor, así que los envíos en módems
+distintos van en paralelo: sumar un USB suma su capacidad
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from multiplatform_sms_engine import MultiplatformSMSEngine, SMSResult
+from port_probe import probe_ports
+from system_config import SystemConfig
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('least_loaded', 'round_robin')
+FAILURE_THRESHOLD = 3       # Fallos seguidos para apartar un módem
+COOLDOWN = 60.0             # Segundos que un módem apartado no recibe envíos
+INITIAL_SEND_TIME = 5.0     # Estimación de un envío mientras ningún módem midió uno
+SEND_TIME_WEIGHT = 0.2      # Peso de cada medición en el promedio móvil
+
+_IMEI_PATTERN = re.compile(r'^\d{14,17}$')
+
+class PoolMember:
+    """Un módem del pool con su salud y rendimiento"""
+
+    def __init__(self, engine: Any, name: str, clock: Callable[[], float] = time.monotonic):
+        self.engine = engine
+        self.name = name
+        self.imei: Optional[str] = None
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.send_time: Optional[float] = None   # Segundos por envío (promedio móvil)
+        self.last_error: Optional[str] = None
+        self.cooldown_until = 0.0
+        self._clock = clock
+        self._started = clock()
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.engine.is_connected)
+
+    @property
+    def healthy(self) -> bool:
+        return self.connected and self._clock() >= self.cooldown_until
+
+    def expected_wait(self, default: float) -> float:
+        """Segundos hasta terminar lo que tiene encolado más un envío nuevo"""
+        send_time = self.send_time if self.send_time is not None else default
+        return (self.in_flight + 1) * send_time
+
+    def record(self, result: SMSResult, seconds: float):
+        if result.success:
+            self.sent += 1
+            self.consecutive_failures = 0
+            if self.send_time is None:
+                self.send_time = seconds
+            else:
+                self.send_time += SEND_TIME_WEIGHT * (seconds - self.send_time)
+            return
+
+        self.failed += 1
+        self.consecutive_failures += 1
+        self.last_error = result.error_message
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.cooldown_until = self._clock() + COOLDOWN
+            self.consecutive_failures = 0
+            logger.warning(f"⚠️ [{self.name}] {FAILURE_THRESHOLD} fallos seguidos, "
+                           f"fuera del pool por {COOLDOWN:.0f} s: {result.error_message}")
+
+    def get_stats(self) -> Dict:
+        elapsed = max(self._clock() - self._started, 1e-9)
+        return {
+            'port': self.name,
+            'imei': self.imei,
+            'connected': self.connected,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'send_seconds': round(self.send_time, 3) if self.send_time is not None else None,
+            'messages_per_minute': round(self.sent * 60 / elapsed, 1),
+            'last_error': self.last_error
+        }
+
+class ModemPool:
+    """Varios motores detrás de un solo `send_sms`
+
+        pool = ModemPool(primary=engine, policy='least_loaded')
+        await pool.connect()                  # el primario ya conectado + el resto de los puertos
+        member, result = await pool.dispatch('946467799', 'Hola')
+
+    `least_loaded` elige el módem que terminaría antes (envíos en curso ×
+    tiempo medio de envío), así un módem lento o con mala señal recibe
+    menos; `round_robin` los alterna. Un módem con FAILURE_THRESHOLD fallos
+    seguidos queda fuera COOLDOWN segundos. Un envío fallido no se repite
+    en otro módem: el SMS pudo haber salido aunque no llegara el +CMGS.
+    """
+
+    def __init__(self, primary: Optional[Any] = None, policy: str = 'least_loaded',
+                 engine_factory: Callable[[], Any] = MultiplatformSMSEngine):
+        if policy not in POLICIES:
+            raise ValueError(f"Política desconocida: {policy} (opciones: {', '.join(POLICIES)})")
+        self.policy = policy
+        self.engine_factory = engine_factory
+        self.primary = primary
+        self.members: List[PoolMember] = []
+        self._next = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return any(member.connected for member in self.members)
+
+    async def connect(self, ports: Optional[List[str]] = None) -> int:
+        """Conecta en paralelo los puertos (por defecto todos los detectados); devuelve cuántos módems hay"""
+
+        known = {member.name for member in self.members}
+        if self.primary is not None and self.primary.is_connected and self.primary.modem is not None:
+            name = self.primary.modem.name
+            if name not in known:
+                self.members.insert(0, PoolMember(self.primary, name))
+                known.add(name)
+
+        if ports is None:
+            loop = asyncio.get_running_loop()
+            ports = await loop.run_in_executor(None, SystemConfig.find_modem_ports)
+            # Sólo los que contestan AT: las interfaces de diagnóstico se descartan en el sondeo
+            # (los puertos ya conectados no se sondean: el AT se mezclaría con su sesión)
+            results = await loop.run_in_executor(None, probe_ports, [port for port in ports if port not in known])
+            for result in results:
+                if not result.responds:
+                    logger.info(f"🔌 {result.port}: no responde AT ({result.error}), fuera del pool")
+            ports = [result.port for result in results if result.responds]
+        candidates = [port for port in ports if port not in known]
+
+        engines = [self.engine_factory() for _ in candidates]
+        results = await asyncio.gather(*(engine.connect(port) for engine, port in zip(engines, candidates)),
+                                       return_exceptions=True)
+        for engine, port, connected in zip(engines, candidates, results):
+            if connected is True:
+                self.members.append(PoolMember(engine, port))
+            else:
+                logger.info(f"🔌 {port}: no responde como módem, fuera del pool")
+
+        await self._drop_duplicates()
+        logger.info(f"📡 Pool de módems: {', '.join(member.name for member in self.members) or 'vacío'} "
+                    f"({self.policy})")
+        return len(self.members)
+
+    async def disconnect(self):
+        for member in self.members:
+            try:
+                await member.engine.disconnect()
+            except Exception as e:
+                logger.error(f"❌ [{member.name}] Error desconectando: {e}")
+        self.members = []
+
+    def select(self) -> Optional[PoolMember]:
+        """Módem para el próximo envío; si todos están apartados, cualquiera conectado"""
+
+        candidates = [member for member in self.members if member.healthy]
+        if not candidates:
+            candidates = [member for member in self.members if member.connected]
+        if not candidates:
+            return None
+
+        if self.policy == 'round_robin':
+            member = candidates[self._next % len(candidates)]
+            self._next += 1
+            return member
+
+        # Un módem sin mediciones se supone como el promedio: así también recibe envíos
+        measured = [member.send_time for member in candidates if member.send_time is not None]
+        default = sum(measured) / len(measured) if measured else INITIAL_SEND_TIME
+        return min(candidates, key=lambda member: (member.expected_wait(default), member.sent))
+
+    async def dispatch(self, phone_number: str, message: str) -> Tuple[Optional[PoolMember], SMSResult]:
+        """Envía por el módem elegido; devuelve (módem, resultado)"""
+
+        member = self.select()
+        if member is None:
+            return None, SMSResult(success=False, error_message="Gateway no conectado")
+
+        # El puerto envía de a uno: la espera incluye los envíos que ya estaban en cola
+        queued = member.in_flight
+        member.in_flight += 1
+        start_time = time.monotonic()
+        try:
+            result = await member.engine.send_sms(phone_number, message)
+        except Exception as e:
+            result = SMSResult(success=False, error_message=str(e))
+        finally:
+            member.in_flight -= 1
+        member.record(result, (time.monotonic() - start_time) / (queued + 1))
+        return member, result
+
+    async def send_sms(self, phone_number: str, message: str) -> SMSResult:
+        _, result = await self.dispatch(phone_number, message)
+        return result
+
+    def subscribe_urc(self, callback: Callable[[PoolMember, Any], Any]) -> Callable[[], None]:
+        """Suscribe `callback(módem, urc)` a los URC de todos los módems"""
+
+        unsubscribers = []
+        for member in self.members:
+            if member.connected:
+                unsubscribers.append(member.engine.subscribe_urc(
+                    lambda urc, member=member: callback(member, urc)))
+
+        def unsubscribe():
+            for unsubscribe_member in unsubscribers:
+                unsubscribe_member()
+        return unsubscribe
+
+    def get_stats(self) -> Dict:
+        return {
+            'policy': self.policy,
+            'modems': [member.get_stats() for member in self.members],
+            'sent': sum(member.sent for member in self.members),
+            'failed': sum(member.failed for member in self.members)
+        }
+
+    async def _drop_duplicates(self):
+        # Un mismo USB suele exponer varios puertos que responden AT: se queda el primero por IMEI
+        seen = set()
+        for member in list(self.members):
+            member.imei = await _read_imei(member.engine)
+            if member.imei is None:
+                continue
+            if member.imei in seen:
+                logger.info(f"🔁 {member.name}: otra interfaz del mismo módem (IMEI {member.imei})")
+                self.members.remove(member)
+                await member.engine.disconnect()
+            else:
+                seen.add(member.imei)
+
+async def _read_imei(engine: Any) -> Optional[str]:
+    try:
+        response = await engine.modem.execute("AT+CGSN")
+    except Exception:
+        return None
+    for line in response.lines:
+        line = line.strip().replace('+CGSN:', '').strip().strip('"')
+        if _IMEI_PATTERN.match(line):
+            return line
+    return None
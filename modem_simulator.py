@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+Simulador de Módem en un Pseudo-terminal
+Abre un pty de Linux que responde el subconjunto AT que usan los motores
+(CMGF, CSCA, CSMP, CPMS, CNMI, CMGS con prompt, CMGL, CMGR, CMGD, CSQ, COPS,
+CREG, ...) y emite +CMTI / +CMT / +CDS como un E8278, con latencia, tasa de
+error y tamaño de memoria configurables. Sirve para probar y medir los
+caminos de envío y recepción sin hardware:
+
+    python modem_simulator.py --latency 0.02 --send-latency 1.5 --link /tmp/ttySIM0
+    SERIAL_PORT=/tmp/ttySIM0 python main.py
+"""
+import argparse
+import heapq
+import itertools
+import logging
+import os
+import random
+import select
+import signal
+import sys
+import threading
+import time
+import tty
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from at_trace import LatencyProfile
+from sms_pdu import PDUError, decode_gsm_charset, decode_pdu, encode_address, encode_submit
+
+logger = logging.getLogger(__name__)
+
+CTRL_Z = b'\x1a'
+ESC = b'\x1b'
+TIMEZONE_QUARTERS = -20      # UTC-5 (Perú), como lo informa la red
+
+@dataclass
+class StoredSMS:
+    index: int
+    number: str
+    text: str
+    timestamp: str              # 'yy/MM/dd,hh:mm:ss±zz'
+    pdu: str                    # SMS-DELIVER con prefijo SMSC
+    tpdu_length: int
+    unread: bool = True
+
+@dataclass
+class SubmittedSMS:
+    number: str
+    text: str
+    reference: int
+    received_at: float
+    status_report: bool = False
+    part: int = 1
+    total: int = 1
+
+@dataclass
+class SimulatorStats:
+    commands: int = 0
+    sent: int = 0
+    send_errors: int = 0
+    received: int = 0
+    rejected: int = 0           # Entrantes descartados con la memoria llena
+    reports: int = 0
+    deleted: int = 0
+
+    def as_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+def _timestamp(moment: datetime) -> Tuple[str, bytes]:
+    """(texto 'yy/MM/dd,hh:mm:ss-20', SCTS de 7 octetos)"""
+
+    quarters = abs(TIMEZONE_QUARTERS)
+    sign = '-' if TIMEZONE_QUARTERS < 0 else '+'
+    text = moment.strftime('%y/%m/%d,%H:%M:%S') + f"{sign}{quarters:02d}"
+
+    digits = moment.strftime('%y%m%d%H%M%S')
+    octets = bytes(int(digits[i + 1] + digits[i], 16) for i in range(0, 12, 2))
+    tz = ((quarters % 10) << 4) | (quarters // 10) | (0x08 if TIMEZONE_QUARTERS < 0 else 0)
+    return text, octets + bytes([tz])
+
+def _deliver_pdus(number: str, text: str, scts: bytes) -> List[Tuple[str, int, str]]:
+    """SMS-DELIVER por segmento: [(pdu, largo TPDU, texto del segmento)]"""
+
+    pdus = []
+    for submit in encode_submit(number, text):
+        tpdu = bytes.fromhex(submit.hex)[1:]
+        # SUBMIT: FO, MR, DA, PID, DCS, VP (relativo), UDL+UD -> DELIVER: FO, OA, PID, DCS, SCTS, UDL+UD
+        address_end = 4 + (tpdu[2] + 1) // 2
+        pid, dcs = tpdu[address_end], tpdu[address_end + 1]
+        user_data = tpdu[address_end + 3:]
+        deliver = (bytes([0x04 | (tpdu[0] & 0x40)]) + encode_address(number)
+                   + bytes([pid, dcs]) + scts + user_data)
+        pdu = '00' + deliver.hex().upper()
+        pdus.append((pdu, len(deliver), decode_pdu(pdu).text))
+    return pdus
+
+class ModemSimulator:
+    """Módem GSM simulado detrás de un pty
+
+        modem = ModemSimulator(latency=0.01, error_rate=0.05)
+        port = modem.start()               # '/dev/pts/N': se abre como cualquier puerto serie
+        modem.deliver('+51946467799', 'hola')   # SMS entrante (+CMTI o +CMT según AT+CNMI)
+        modem.sent                         # últimos SMS aceptados con AT+CMGS
+        modem.stop()
+
+    `latency` se aplica a cada comando y `send_latency` a cada AT+CMGS (lo
+    que tarda la red en aceptar el mensaje); una fracción `error_rate` de
+    los envíos responde +CMS ERROR: 500. Con reporte pedido (TP-SRR) y
+    AT+CNMI con ds=1, el +CDS llega `report_delay` segundos después. Con
+    `profile` (LatencyProfile de una traza AT_TRACE) cada comando tarda un
+    tiempo grabado en un módem real; los comandos sin datos usan `latency`.
+    """
+
+    def __init__(self, latency: float = 0.0, send_latency: Optional[float] = None,
+                 error_rate: float = 0.0, store_size: int = 23, report_delay: float = 0.5,
+                 echo: bool = True, operator: str = 'CLARO PE', signal: int = 20,
+                 imei: str = '867000000000001', smsc: str = '+51997990000',
+                 seed: Optional[int] = None, link: Optional[str] = None,
+                 on_submit: Optional[Callable[[SubmittedSMS], None]] = None,
+                 history: int = 1000, profile: Optional[LatencyProfile] = None):
+        self.latency = latency
+        self.send_latency = latency if send_latency is None else send_latency
+        self.profile = profile
+        self.error_rate = error_rate
+        self.store_size = store_size
+        self.report_delay = report_delay
+        self.echo = echo
+        self.operator = operator
+        self.signal = signal
+        self.imei = imei
+        self.smsc = smsc
+        self.link = link
+        self.on_submit = on_submit
+        self.stats = SimulatorStats()
+        self.sent: Deque[SubmittedSMS] = deque(maxlen=history)
+        self.port: Optional[str] = None
+
+        # Estado configurable por AT, como en el módem
+        self.text_mode = True
+        self.charset = 'GSM'
+        self.first_octet = 17
+        self.cnmi = [1, 1, 0, 0, 0]
+
+        self._random = random.Random(seed)
+        self._store: Dict[int, StoredSMS] = {}
+        self._reference = 0
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._write_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._timers: List[Tuple[float, int, Callable[[], None]]] = []
+        self._timer_ids = itertools.count()
+        self._buffer = b''
+        self._pending_send: Optional[str] = None    # AT+CMGS esperando cuerpo
+        self._handlers = self._build_handlers()
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def start(self) -> str:
+        """Abre el pty y devuelve la ruta del lado "puerto serie" (o `link`)"""
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        if self.link:
+            if os.path.islink(self.link):
+                os.unlink(self.link)
+            os.symlink(self.port, self.link)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='modem-simulator', daemon=True)
+        self._thread.start()
+        return self.link or self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+
+    # ------------------------------------------------------------------
+    # Red simulada
+    # ------------------------------------------------------------------
+
+    def deliver(self, number: str, text: str, when: Optional[datetime] = None) -> int:
+        """SMS entrante; devuelve cuántos segmentos quedaron en la memoria"""
+
+        timestamp, scts = _timestamp(when or datetime.now())
+        segments = _deliver_pdus(number, text, scts)
+        self.stats.received += 1
+
+        mt = self.cnmi[1]
+        if mt == 2:
+            # Directo a la terminal, sin pasar por la memoria
+            for pdu, length, segment_text in segments:
+                if self.text_mode:
+                    self._write(f'\r\n+CMT: "{number}",,"{timestamp}"\r\n{segment_text}\r\n')
+                else:
+                    self._write(f'\r\n+CMT: ,{length}\r\n{pdu}\r\n')
+            return 0
+
+        stored = 0
+        for pdu, length, segment_text in segments:
+            with self._state_lock:
+                if len(self._store) >= self.store_size:
+                    self.stats.rejected += 1
+                    continue
+                index = next(i for i in itertools.count() if i not in self._store)
+                self._store[index] = StoredSMS(index, number, segment_text, timestamp, pdu, length)
+            stored += 1
+            if mt == 1:
+                self._write(f'\r\n+CMTI: "ME",{index}\r\n')
+        return stored
+
+    @property
+    def stored(self) -> int:
+        return len(self._store)
+
+    # ------------------------------------------------------------------
+    # Hilo del módem: lee del pty, responde y dispara los reportes
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while self._running:
+            timeout = 0.1
+            if self._timers:
+                timeout = max(0.0, min(timeout, self._timers[0][0] - time.monotonic()))
+            try:
+                readable, _, _ = select.select([self._master], [], [], timeout)
+            except (OSError, ValueError):
+                return
+
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError:
+                    return
+                self._feed(data)
+
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, action = heapq.heappop(self._timers)
+                action()
+
+    def _schedule(self, delay: float, action: Callable[[], None]):
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_ids), action))
+
+    def _write(self, text: str):
+        if self._master is None:
+            return
+        with self._write_lock:
+            os.write(self._master, text.encode('utf-8'))
+
+    def _body_text(self, body: bytes) -> str:
+        """Cuerpo de AT+CMGS: en modo texto con CSCS="GSM" cada byte es un septeto"""
+        if self.text_mode and self.charset == 'GSM':
+            return decode_gsm_charset(body)
+        return body.decode('utf-8', errors='replace')
+
+    def _feed(self, data: bytes):
+        self._buffer += data
+        while True:
+            if self._pending_send is not None:
+                # Cuerpo de AT+CMGS hasta Ctrl+Z (enviar) o ESC (cancelar)
+                end = min((i for i in (self._buffer.find(CTRL_Z), self._buffer.find(ESC)) if i >= 0),
+                          default=-1)
+                if end < 0:
+                    return
+                body, terminator = self._buffer[:end], self._buffer[end:end + 1]
+                self._buffer = self._buffer[end + 1:]
+                text = self._body_text(body)
+                if self.echo:
+                    self._write(text + terminator.decode())
+                command, self._pending_send = self._pending_send, None
+                if terminator == CTRL_Z:
+                    self._submit(command, text.strip())
+                else:
+                    self._write('\r\nOK\r\n')
+                continue
+
+            end = self._buffer.find(b'\r')
+            if end < 0:
+                return
+            line = self._buffer[:end].decode('utf-8', errors='replace').strip()
+            self._buffer = self._buffer[end + 1:].lstrip(b'\n')
+            if not line:
+                continue
+            if self.echo:
+                self._write(line + '\r')
+            self._command(line)
+
+    # ------------------------------------------------------------------
+    # Comandos AT
+    # ------------------------------------------------------------------
+
+    def _command(self, line: str):
+        self.stats.commands += 1
+        # En AT+CMGS lo que tarda el prompt; la confirmación se demora en _submit
+        latency = self._recorded(line, 'prompt' if line.upper().startswith('AT+CMGS=') else 'response')
+        latency = self.latency if latency is None else latency
+        if latency:
+            time.sleep(latency)
+
+        upper = line.upper()
+        if not upper.startswith('AT'):
+            self._write('\r\nERROR\r\n')
+            return
+
+        name, _, argument = line[2:].partition('=')
+        name = name.upper()
+        query = name.endswith('?')
+        name = name.rstrip('?')
+
+        if name == '+CMGS' and argument:
+            self._pending_send = argument
+            self._write('\r\n> ')
+            return
+
+        handler = self._handlers.get(name)
+        if handler is None:
+            self._write('\r\nERROR\r\n')
+            return
+        try:
+            lines = handler(argument.strip(), query)
+        except (ValueError, IndexError):
+            self._write('\r\nERROR\r\n')
+            return
+        if isinstance(lines, str) and lines.startswith('+CMS ERROR'):
+            self._write(f'\r\n{lines}\r\n')
+            return
+        body = ''.join(f'\r\n{item}' for item in (lines or []))
+        self._write(f'{body}\r\n\r\nOK\r\n' if body else '\r\nOK\r\n')
+
+    def _build_handlers(self) -> Dict[str, Callable[[str, bool], Optional[List[str]]]]:
+        return {
+            '': lambda argument, query: None,
+            'E0': self._echo_off,
+            'E1': self._echo_on,
+            'I': lambda argument, query: ['Manufacturer: huawei', 'Model: E8278', 'Revision: SIMULADOR'],
+            '+CGMI': lambda argument, query: ['huawei'],
+            '+CGMM': lambda argument, query: ['E8278'],
+            '+CGMR': lambda argument, query: ['SIMULADOR'],
+            '+CGSN': lambda argument, query: [self.imei],
+            '+CIMI': lambda argument, query: ['716100000000001'],
+            '+CCID': lambda argument, query: ['+CCID: 8951100000000000001'],
+            '+CNUM': lambda argument, query: ['+CNUM: "","997507384",129'],
+            '+CPIN': lambda argument, query: ['+CPIN: READY'],
+            '+CSQ': lambda argument, query: [f'+CSQ: {self.signal},99'],
+            '+COPS': self._cops,
+            '+CREG': lambda argument, query: ['+CREG: 0,1'] if query else None,
+            '+CGREG': lambda argument, query: ['+CGREG: 0,1'] if query else None,
+            '+CMEE': lambda argument, query: None,
+            '+CMGF': self._cmgf,
+            '+CSCS': self._cscs,
+            '+CSCA': self._csca,
+            '+CSMP': self._csmp,
+            '+CSMS': lambda argument, query: ['+CSMS: 0,1,1,1'],
+            '+CMMS': lambda argument, query: ['+CMMS: 0'] if query else None,
+            '+CPMS': self._cpms,
+            '+CNMI': self._cnmi,
+            '+CMGL': self._cmgl,
+            '+CMGR': self._cmgr,
+            '+CMGD': self._cmgd,
+        }
+
+    def _echo_off(self, argument, query):
+        self.echo = False
+
+    def _echo_on(self, argument, query):
+        self.echo = True
+
+    def _cops(self, argument, query):
+        return [f'+COPS: 0,0,"{self.operator}",2'] if query else None
+
+    def _cmgf(self, argument, query):
+        if query:
+            return [f'+CMGF: {1 if self.text_mode else 0}']
+        if argument not in ('0', '1'):
+            raise ValueError(argument)
+        self.text_mode = argument == '1'
+
+    def _cscs(self, argument, query):
+        if query:
+            return [f'+CSCS: "{self.charset}"']
+        self.charset = argument.strip('"')
+
+    def _csca(self, argument, query):
+        if query:
+            return [f'+CSCA: "{self.smsc}",145']
+        self.smsc = argument.split(',')[0].strip('"')
+
+    def _csmp(self, argument, query):
+        if query:
+            return [f'+CSMP: {self.first_octet},167,0,0']
+        self.first_octet = int(argument.split(',')[0])
+
+    def _cpms(self, argument, query):
+        used, total = len(self._store), self.store_size
+        if query:
+            return [f'+CPMS: "ME",{used},{total},"ME",{used},{total},"ME",{used},{total}']
+        return [f'+CPMS: {used},{total},{used},{total},{used},{total}']
+
+    def _cnmi(self, argument, query):
+        if query:
+            return ['+CNMI: ' + ','.join(str(value) for value in self.cnmi)]
+        values = [int(value) if value else 0 for value in argument.split(',')]
+        self.cnmi = (values + [0] * 5)[:5]
+
+    def _listing(self, sms: StoredSMS) -> List[str]:
+        if self.text_mode:
+            status = 'REC UNREAD' if sms.unread else 'REC READ'
+            return [f'+CMGL: {sms.index},"{status}","{sms.number}",,"{sms.timestamp}"', sms.text]
+        return [f'+CMGL: {sms.index},{0 if sms.unread else 1},,{sms.tpdu_length}', sms.pdu]
+
+    def _cmgl(self, argument, query):
+        selector = argument.strip('"').upper() or ('REC UNREAD' if self.text_mode else '0')
+        wanted = {'REC UNREAD': True, '0': True, 'REC READ': False, '1': False}.get(selector)
+        lines = []
+        with self._state_lock:
+            for index in sorted(self._store):
+                sms = self._store[index]
+                if wanted is None or sms.unread == wanted:
+                    lines += self._listing(sms)
+                    sms.unread = False
+        return lines
+
+    def _cmgr(self, argument, query):
+        with self._state_lock:
+            sms = self._store.get(int(argument))
+            if sms is None:
+                return '+CMS ERROR: 321'
+            header, body = self._listing(sms)
+            sms.unread = False
+        header = header.replace('+CMGL: ', '+CMGR: ', 1).split(',', 1)[1]
+        return ['+CMGR: ' + header, body]
+
+    def _cmgd(self, argument, query):
+        parts = argument.split(',')
+        flag = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+        with self._state_lock:
+            if flag == 4:
+                self.stats.deleted += len(self._store)
+                self._store.clear()
+                return None
+            if self._store.pop(int(parts[0]), None) is None:
+                return '+CMS ERROR: 321'
+            self.stats.deleted += 1
+
+    # ------------------------------------------------------------------
+    # Envío
+    # ------------------------------------------------------------------
+
+    def _submit(self, argument: str, body: str):
+        latency = self._recorded('AT+CMGS', 'response')
+        latency = self.send_latency if latency is None else latency
+        if latency:
+            time.sleep(latency)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.stats.send_errors += 1
+            self._write('\r\n+CMS ERROR: 500\r\n')
+            return
+
+        if self.text_mode:
+            number = argument.split(',')[0].strip('"')
+            text, srr, part, total = body, bool(self.first_octet & 0x20), 1, 1
+        else:
+            try:
+                sms = decode_pdu(body)
+            except PDUError:
+                self.stats.send_errors += 1
+                self._write('\r\n+CMS ERROR: 304\r\n')
+                return
+            tpdu = bytes.fromhex(body)[1 + int(body[:2], 16):]
+            number, text, srr = sms.number, sms.text, bool(tpdu[0] & 0x20)
+            part, total = (sms.concat.sequence, sms.concat.total) if sms.concat else (1, 1)
+
+        reference = self._reference
+        self._reference = (self._reference + 1) % 256
+        submitted = SubmittedSMS(number, text, reference, time.time(), srr, part, total)
+        self.sent.append(submitted)
+        self.stats.sent += 1
+        self._write(f'\r\n+CMGS: {reference}\r\n\r\nOK\r\n')
+
+        if self.on_submit is not None:
+            try:
+                self.on_submit(submitted)
+            except Exception as e:
+                logger.error(f"❌ Error en on_submit: {e}")
+
+        if srr and self.cnmi[3] == 1:
+            self._schedule(self.report_delay, lambda: self._status_report(submitted))
+
+    def _recorded(self, command: str, phase: str) -> Optional[float]:
+        return self.profile.sample(command, phase) if self.profile is not None else None
+
+    def _status_report(self, sms: SubmittedSMS, status: int = 0):
+        self.stats.reports += 1
+        timestamp, scts = _timestamp(datetime.now())
+        if self.text_mode:
+            self._write(f'\r\n+CDS: 6,{sms.reference},"{sms.number}",145,'
+                        f'"{timestamp}","{timestamp}",{status}\r\n')
+            return
+        report = bytes([0x06, sms.reference]) + encode_address(sms.number) + scts + scts + bytes([status])
+        self._write(f'\r\n+CDS: {len(report)}\r\n00{report.hex().upper()}\r\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Módem GSM simulado en un pseudo-terminal")
+    parser.add_argument('--latency', type=float, default=0.02, help="Segundos por comando AT")
+    parser.add_argument('--send-latency', type=float, default=None,
+                        help="Segundos por AT+CMGS (por defecto, --latency)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fracción de envíos que responden +CMS ERROR: 500")
+    parser.add_argument('--store-size', type=int, default=23, help="Capacidad de la memoria ME")
+    parser.add_argument('--report-delay', type=float, default=0.5,
+                        help="Segundos hasta el reporte de entrega")
+    parser.add_argument('--inbound-every', type=float, default=0.0,
+                        help="Genera un SMS entrante cada N segundos (0: nunca)")
+    parser.add_argument('--link', help="Symlink estable al pty (p. ej. /tmp/ttySIM0)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--profile', help="Traza AT_TRACE de un módem real: latencias grabadas por comando")
+    args = parser.parse_args()
+
+    profile = LatencyProfile.from_trace(args.profile, args.seed) if args.profile else None
+    modem = ModemSimulator(latency=args.latency, send_latency=args.send_latency,
+                           error_rate=args.error_rate, store_size=args.store_size,
+                           report_delay=args.report_delay, link=args.link, seed=args.seed,
+                           profile=profile)
+    port = modem.start()
+    # kill / terminate() desde un script de benchmark: limpiar igual que con Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"📟 Módem simulado en {port}" + (f" ({modem.port})" if args.link else ""))
+    print("Presiona Ctrl+C para detener")
+
+    try:
+        count = 0
+        while True:
+            if args.inbound_every > 0:
+                time.sleep(args.inbound_every)
+                count += 1
+                modem.deliver('+51946467799', f'Mensaje simulado {count}')
+            else:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        modem.stop()
+        print(f"\n📊 {modem.stats.as_dict()}")
+
+if __name__ == '__main__':
+    main()
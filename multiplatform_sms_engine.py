@@ -3,61 +3,92 @@ Motor SMS Multiplataforma
 Versión que funciona en Windows, Linux y macOS
 """
 import asyncio
+import re
 import time
 import serial
 import logging
+from collections import deque
 from dataclasses import dataclass
-from typing import Optional
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from datetime import datetime
-from system_config import config_manager, get_system_info
+from system_config import SystemConfig, config_manager, get_system_info, port_registry
+from port_probe import probe_until_answer, rank_responsive
+from serial_transport import AsyncSerialTransport
+from at_multiplexer import ATCommandMultiplexer, ATCommandError, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from sms_pdu import SubmitPDU, encode_submit
+from store_ingestion import list_stored
+from delivery_reports import REPORT_CNMI, SUBMIT_WITH_REPORT
+from message_normalizer import normalize_message, to_gsm_charset
 
 @dataclass
 class SMSResult:
     success: bool
     reference_id: Optional[str] = None
     error_message: Optional[str] = None
+    part_references: Optional[List[str]] = None  # Una referencia por segmento (modo PDU)
+
+@dataclass
+class BatchItemResult:
+    index: int
+    phone_number: str
+    result: SMSResult
+
+class ThroughputCounter:
+    """Mensajes por minuto, separando envíos con y sin AT+CMMS"""
+    
+    def __init__(self):
+        self._totals = {'with_cmms': [0, 0.0], 'without_cmms': [0, 0.0]}
+    
+    def record(self, link_kept: bool, messages: int, seconds: float):
+        totals = self._totals['with_cmms' if link_kept else 'without_cmms']
+        totals[0] += messages
+        totals[1] += seconds
+    
+    def snapshot(self) -> Dict:
+        stats = {}
+        for mode, (messages, seconds) in self._totals.items():
+            stats[mode] = {
+                'messages': messages,
+                'seconds': round(seconds, 3),
+                'messages_per_minute': round(messages * 60 / seconds, 1) if seconds > 0 else None
+            }
+        return stats
 
 class MultiplatformSMSEngine:
     """Motor SMS que funciona en cualquier sistema operativo"""
     
     def __init__(self):
         self.serial_connection = None
+        self.transport: Optional[AsyncSerialTransport] = None
+        self.modem: Optional[ATCommandMultiplexer] = None
         self.is_connected = False
+        self.pdu_mode = False
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(level=logging.INFO)
         self.config = config_manager.config
+        self.throughput = ThroughputCounter()
+        self._cmms_supported: Optional[bool] = None  # None = aún no probado
+    
+    @property
+    def delivery_reports(self) -> bool:
+        """Pedir reporte de entrega (+CDS) por cada SMS"""
+        return self.config.get('delivery_reports', True)
     
     async def connect(self, custom_port: str = None) -> bool:
         """Conecta al gateway con detección automática de puerto"""
         
         try:
             # Determinar puerto a usar
-            port_to_use = custom_port or config_manager.get_serial_port()
+            port_to_use = custom_port
+            if not port_to_use and not config_manager.config['auto_detect']:
+                port_to_use = config_manager.config.get('serial_port')
             
             if not port_to_use:
-                # Intentar detección automática
-                system_info = get_system_info()
-                detected_port = system_info['detected_modem']
-                
-                if detected_port:
-                    port_to_use = detected_port
-                    self.logger.info(f"🎯 Puerto detectado automáticamente: {port_to_use}")
-                else:
-                    # Probar puertos comunes
-                    common_ports = system_info['default_ports'][:5]  # Probar los primeros 5
-                    
-                    for test_port in common_ports:
-                        try:
-                            test_conn = serial.Serial(test_port, timeout=2)
-                            test_conn.close()
-                            port_to_use = test_port
-                            self.logger.info(f"🔍 Puerto encontrado por prueba: {port_to_use}")
-                            break
-                        except:
-                            continue
+                # Detección automática: el puerto que contesta AT, no sólo el que abre
+                port_to_use = await self._probe_port()
             
             if not port_to_use:
-                raise Exception("No se pudo encontrar un puerto serie válido")
+                raise Exception("Ningún puerto serie respondió a AT")
             
             self.logger.info(f"🔌 Conectando a {port_to_use} @ {self.config['baud_rate']} bps")
             
@@ -74,10 +105,16 @@ class MultiplatformSMSEngine:
                 dsrdtr=False
             )
             
+            self.transport = AsyncSerialTransport(self.serial_connection)
+            
             # Limpiar buffers
-            self.serial_connection.reset_input_buffer()
+            self.transport.discard()
             self.serial_connection.reset_output_buffer()
             
+            # Un único dueño del puerto para comandos y URC
+            self.modem = ATCommandMultiplexer(self.transport, name=port_to_use)
+            await self.modem.start()
+            
             # Test de conectividad
             await self._send_command("AT")
             
@@ -86,8 +123,8 @@ class MultiplatformSMSEngine:
             
             self.is_connected = True
             
-            # Guardar puerto exitoso en configuración
-            if not custom_port:
+            # Guardar puerto exitoso en configuración (sólo si cambió)
+            if not custom_port and config_manager.config.get('serial_port') != port_to_use:
                 config_manager.config['serial_port'] = port_to_use
                 config_manager.save_config()
             
@@ -96,14 +133,49 @@ class MultiplatformSMSEngine:
             
         except Exception as e:
             self.logger.error(f"❌ Error conectando: {e}")
-            if self.serial_connection:
+            if not custom_port:
+                # El puerto detectado pudo desaparecer: el próximo intento vuelve a enumerar
+                port_registry.invalidate()
+            if self.modem:
+                await self.modem.stop()
+                self.modem = None
+            if self.transport:
+                self.transport.close()
+                self.transport = None
+            elif self.serial_connection:
                 try:
                     self.serial_connection.close()
                 except:
                     pass
-                self.serial_connection = None
+            self.serial_connection = None
             return False
     
+    async def _probe_port(self) -> Optional[str]:
+        """Sondea en paralelo los candidatos con AT/ATI y devuelve el mejor"""
+        
+        saved = config_manager.config.get('serial_port')
+        candidates = list(dict.fromkeys(([saved] if saved else []) + port_registry.modem_ports() +
+                                        SystemConfig.get_default_ports()[:5]))
+        
+        start_time = time.monotonic()
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(None, probe_until_answer, candidates, self.config['baud_rate'])
+        ranked = rank_responsive(results)
+        
+        for result in results:
+            if result.responds:
+                self.logger.debug(f"   ✅ {result.port}: {result.description or 'responde AT'}"
+                                  f" ({result.elapsed * 1000:.0f} ms)")
+            else:
+                self.logger.debug(f"   ❌ {result.port}: {result.error}")
+        if not ranked:
+            return None
+        
+        self.logger.info(f"🎯 Puerto detectado por sondeo: {ranked[0].port}"
+                         f"{' (' + ranked[0].description + ')' if ranked[0].description else ''}, "
+                         f"{len(ranked)}/{len(candidates)} responden AT en {time.monotonic() - start_time:.2f} s")
+        return ranked[0].port
+    
     async def _configure_for_sms(self):
         """Configuración específica para SMS"""
         
@@ -112,13 +184,27 @@ class MultiplatformSMSEngine:
         # Obtener SMSC de la configuración
         smsc = self.config.get('smsc_number', '+51997990000')
         
-        config_commands = [
-            ("AT+CMGF=1", "Modo texto"),
-            ('AT+CSCS="GSM"', "Codificación GSM"),
+        # Modo PDU (opcional, sms_mode='pdu'): mensajes largos y con acentos/emoji sin recortarlos
+        self.pdu_mode = False
+        if self.config.get('sms_mode', 'text') == 'pdu':
+            try:
+                await self._send_command("AT+CMGF=0")
+                self.pdu_mode = True
+                self.logger.info("✅ Modo PDU: OK")
+            except Exception as e:
+                self.logger.warning(f"⚠️ Modo PDU no disponible, se usa modo texto: {e}")
+        
+        # Reporte de entrega: TP-SRR en CSMP (modo texto) o en cada PDU, y +CDS directo
+        reports = self.delivery_reports
+        
+        # AT+CSCS sólo afecta al modo texto; en PDU la codificación va en cada PDU
+        config_commands = [] if self.pdu_mode else [("AT+CMGF=1", "Modo texto"),
+                                                    ('AT+CSCS="GSM"', "Codificación GSM")]
+        config_commands += [
             (f'AT+CSCA="{smsc}"', "Centro de mensajes"),
-            ("AT+CSMP=17,167,0,0", "Parámetros de mensaje"),
+            (f"AT+CSMP={SUBMIT_WITH_REPORT if reports else 17},167,0,0", "Parámetros de mensaje"),
             ("AT+CPMS=\"ME\",\"ME\",\"ME\"", "Almacenamiento"),
-            ("AT+CNMI=1,1,0,0,0", "Notificaciones"),
+            (REPORT_CNMI if reports else "AT+CNMI=1,1,0,0,0", "Notificaciones"),
         ]
         
         for command, description in config_commands:
@@ -128,43 +214,28 @@ class MultiplatformSMSEngine:
             except Exception as e:
                 self.logger.warning(f"⚠️ {description}: {e}")
     
-    async def _send_command(self, command: str, timeout: float = 5.0) -> str:
-        """Envía comando AT multiplataforma"""
+    async def _send_command(self, command: str, timeout: float = 5.0,
+                            priority: int = PRIORITY_NORMAL) -> str:
+        """Envía comando AT multiplataforma a través del multiplexor"""
         
-        if not self.serial_connection:
+        if not self.modem:
             raise Exception("No hay conexión serial")
         
         try:
-            # Limpiar buffer
-            self.serial_connection.reset_input_buffer()
-            
-            # Enviar comando
-            full_command = command + '\r\n'
-            self.serial_connection.write(full_command.encode('utf-8'))
-            
-            # Leer respuesta
-            response = ""
-            start_time = time.time()
-            
-            while time.time() - start_time < timeout:
-                if self.serial_connection.in_waiting > 0:
-                    chunk = self.serial_connection.read(self.serial_connection.in_waiting)
-                    response += chunk.decode('utf-8', errors='ignore')
-                    
-                    if 'OK\r\n' in response or 'ERROR' in response:
-                        break
-                
-                await asyncio.sleep(0.1)
-            
-            if 'ERROR' in response:
-                raise Exception(f"Comando falló: {command}\n{response}")
-            
-            return response
+            response = await self.modem.execute(command, timeout=timeout, priority=priority)
+            return response.text
             
         except Exception as e:
             self.logger.error(f"❌ Error comando {command}: {e}")
             raise
     
+    def subscribe_urc(self, callback):
+        """Suscribe un callback a los códigos no solicitados (+CMT, +CDS, ...)"""
+        
+        if not self.modem:
+            raise Exception("No hay conexión serial")
+        return self.modem.subscribe(callback)
+    
     async def send_sms(self, phone_number: str, message: str) -> SMSResult:
         """Envía SMS multiplataforma"""
         
@@ -174,15 +245,14 @@ class MultiplatformSMSEngine:
         try:
             self.logger.info(f"📤 Enviando SMS a {phone_number}: {message}")
             
-            # Limpiar mensaje
-            clean_message = self._clean_message(message)
-            
-            # Envío
-            reference_id = await self._send_sms_improved(phone_number, clean_message)
+            start_time = time.monotonic()
+            references = await self._deliver(phone_number, message)
             
-            if reference_id:
-                self.logger.info(f"✅ SMS enviado. Referencia: {reference_id}")
-                return SMSResult(success=True, reference_id=reference_id)
+            if references:
+                link_kept = len(references) > 1 and bool(self._cmms_supported)
+                self.throughput.record(link_kept, 1, time.monotonic() - start_time)
+                self.logger.info(f"✅ SMS enviado. Referencia: {', '.join(references)}")
+                return SMSResult(success=True, reference_id=references[0], part_references=references)
             else:
                 return SMSResult(success=False, error_message="Sin referencia")
                 
@@ -191,118 +261,154 @@ class MultiplatformSMSEngine:
             self.logger.error(f"❌ Error enviando SMS: {error_msg}")
             return SMSResult(success=False, error_message=error_msg)
     
-    def _clean_message(self, message: str) -> str:
-        """Limpia mensaje para compatibilidad multiplataforma"""
+    async def send_batch(self, messages: Iterable[Tuple[str, str]],
+                         window: int = 8) -> AsyncIterator[BatchItemResult]:
+        """Envía varios SMS sobre la misma sesión AT y entrega cada resultado en orden
+        
+        Hasta `window` envíos quedan encolados en el multiplexor, así que el
+        siguiente AT+CMGS sale apenas llega la confirmación del anterior,
+        sin limpiar buffers ni esperar ticks entre mensajes. Si el módem lo
+        soporta, AT+CMMS mantiene abierto el enlace con el SMSC durante el lote.
+        
+            async for item in engine.send_batch([("946467799", "Hola"), ...]):
+                print(item.index, item.result.reference_id)
+        """
+        
+        in_flight = deque()
+        pending = iter(enumerate(messages))
+        
+        def schedule():
+            for index, (phone_number, message) in pending:
+                task = asyncio.ensure_future(self._deliver(phone_number, message))
+                in_flight.append((index, phone_number, task))
+                if len(in_flight) >= window:
+                    break
         
-        # Mapear caracteres especiales
-        replacements = {
-            'ñ': 'n', 'Ñ': 'N',
-            'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
-            'Á': 'A', 'É': 'E', 'Í': 'I', 'Ó': 'O', 'Ú': 'U',
-            '🧪': 'TEST', '📱': '', '💬': '', '✅': 'OK', '❌': 'ERROR'
-        }
+        if not self.is_connected:
+            for index, (phone_number, _) in pending:
+                yield BatchItemResult(index, phone_number,
+                                      SMSResult(success=False, error_message="Gateway no conectado"))
+            return
         
-        clean_message = message
-        for original, replacement in replacements.items():
-            clean_message = clean_message.replace(original, replacement)
+        link_kept = await self._keep_link()
+        start_time = time.monotonic()
+        sent = 0
         
-        # Limitar longitud
-        if len(clean_message) > 160:
-            clean_message = clean_message[:157] + "..."
+        try:
+            schedule()
+            
+            while in_flight:
+                index, phone_number, task = in_flight.popleft()
+                
+                try:
+                    references = await task
+                    if references:
+                        result = SMSResult(success=True, reference_id=references[0],
+                                           part_references=references)
+                    else:
+                        result = SMSResult(success=False, error_message="Sin referencia")
+                except Exception as e:
+                    result = SMSResult(success=False, error_message=str(e))
+                
+                if result.success:
+                    sent += 1
+                    self.logger.info(f"✅ Lote #{index} → {phone_number}. Referencia: {result.reference_id}")
+                else:
+                    self.logger.error(f"❌ Lote #{index} → {phone_number}: {result.error_message}")
+                
+                schedule()
+                yield BatchItemResult(index, phone_number, result)
         
-        return clean_message
+        finally:
+            # Si el consumidor abandona la iteración, no dejar envíos colgados
+            for _, _, task in in_flight:
+                task.cancel()
+            
+            if sent:
+                self.throughput.record(link_kept, sent, time.monotonic() - start_time)
     
-    async def _send_sms_improved(self, phone_number: str, message: str) -> Optional[str]:
-        """Envío SMS mejorado para multiplataforma"""
+    async def _keep_link(self) -> bool:
+        """AT+CMMS=1: mantiene el enlace con el SMSC entre mensajes consecutivos
         
-        # Limpiar buffers
-        self.serial_connection.reset_input_buffer()
-        self.serial_connection.reset_output_buffer()
+        El módem lo libera solo si pasan más de 1-5 s sin enviar. Si rechaza
+        el comando se recuerda y los siguientes lotes se envían sin él.
+        """
         
-        # Paso 1: Comando CMGS
-        cmgs_command = f'AT+CMGS="{phone_number}"'
-        self.serial_connection.write((cmgs_command + '\r').encode())
+        if not self.config.get('use_cmms', True) or self._cmms_supported is False:
+            return False
         
-        # Paso 2: Esperar prompt
-        prompt_timeout = 15
-        start_time = time.time()
-        response_buffer = ""
+        try:
+            await self.modem.execute("AT+CMMS=1", priority=PRIORITY_HIGH)
+            self._cmms_supported = True
+            return True
+        except ATCommandError as e:
+            self._cmms_supported = False
+            self.logger.warning(f"⚠️ El módem no soporta AT+CMMS, se envía sin mantener el enlace: {e}")
+            return False
+    
+    def get_throughput_stats(self) -> Dict:
+        """Mensajes por minuto con y sin AT+CMMS"""
         
-        while time.time() - start_time < prompt_timeout:
-            if self.serial_connection.in_waiting > 0:
-                chunk = self.serial_connection.read(self.serial_connection.in_waiting)
-                chunk_str = chunk.decode('utf-8', errors='ignore')
-                response_buffer += chunk_str
-                
-                if '>' in response_buffer:
-                    break
-                
-                if 'ERROR' in response_buffer:
-                    raise Exception(f"Error en CMGS: {response_buffer}")
-            
-            await asyncio.sleep(0.2)
+        stats = self.throughput.snapshot()
+        stats['cmms_supported'] = self._cmms_supported
+        return stats
+    
+    def _clean_message(self, message: str) -> str:
+        """Limpia mensaje para compatibilidad multiplataforma"""
+        return normalize_message(message)
+    
+    async def _deliver(self, phone_number: str, message: str) -> List[str]:
+        """Envía un mensaje lógico y devuelve las referencias de cada segmento
         
-        if '>' not in response_buffer:
-            raise Exception(f"Sin prompt. Respuesta: {response_buffer}")
+        En modo PDU los mensajes largos salen como SMS concatenados (UDH) y
+        los caracteres fuera de GSM-7 pasan a UCS-2; en modo texto se limpia
+        y recorta como siempre.
+        """
         
-        # Paso 3: Enviar mensaje
-        message_with_ctrl_z = message + '\x1A'
-        self.serial_connection.write(message_with_ctrl_z.encode('utf-8', errors='ignore'))
+        if not self.pdu_mode:
+            return [await self._send_sms_improved(phone_number, self._clean_message(message))]
         
-        # Paso 4: Esperar confirmación
-        confirmation_timeout = 30
-        start_time = time.time()
-        confirmation_buffer = ""
+        pdus = encode_submit(phone_number, message, status_report=self.delivery_reports)
+        if len(pdus) > 1:
+            self.logger.info(f"🧩 Mensaje largo: {len(pdus)} segmentos ({pdus[0].encoding})")
+            await self._keep_link()
         
-        while time.time() - start_time < confirmation_timeout:
-            if self.serial_connection.in_waiting > 0:
-                chunk = self.serial_connection.read(self.serial_connection.in_waiting)
-                chunk_str = chunk.decode('utf-8', errors='ignore')
-                confirmation_buffer += chunk_str
-                
-                if '+CMGS:' in confirmation_buffer:
-                    import re
-                    ref_match = re.search(r'\+CMGS:\s*(\d+)', confirmation_buffer)
-                    return ref_match.group(1) if ref_match else "SUCCESS"
-                
-                if 'ERROR' in confirmation_buffer:
-                    raise Exception(f"Error SMS: {confirmation_buffer}")
-            
-            await asyncio.sleep(0.2)
+        return [await self._send_pdu(pdu) for pdu in pdus]
+    
+    async def _send_pdu(self, pdu: SubmitPDU) -> str:
+        """AT+CMGS=<largo> → prompt → PDU en hexadecimal + Ctrl+Z"""
+        
+        response = await self.modem.execute(
+            f'AT+CMGS={pdu.tpdu_length}',
+            body=pdu.hex,
+            timeout=30,
+            prompt_timeout=15,
+            priority=PRIORITY_HIGH
+        )
+        
+        ref_match = re.search(r'\+CMGS:\s*(\d+)', response.text)
+        return ref_match.group(1) if ref_match else "SUCCESS"
+    
+    async def _send_sms_improved(self, phone_number: str, message: str) -> Optional[str]:
+        """Envío SMS mejorado para multiplataforma"""
         
-        raise Exception(f"Timeout confirmación: {confirmation_buffer}")
+        # CMGS → prompt → cuerpo en el juego "GSM" + Ctrl+Z → confirmación, sin compartir el puerto
+        response = await self.modem.execute(
+            f'AT+CMGS="{phone_number}"',
+            body=to_gsm_charset(message),
+            timeout=30,
+            prompt_timeout=15,
+            priority=PRIORITY_HIGH
+        )
+        
+        ref_match = re.search(r'\+CMGS:\s*(\d+)', response.text)
+        return ref_match.group(1) if ref_match else "SUCCESS"
     
     async def check_stored_messages(self):
         """Verifica mensajes almacenados"""
         
         try:
-            response = await self._send_command('AT+CMGL="ALL"')
-            messages = []
-            
-            lines = response.split('\n')
-            i = 0
-            
-            while i < len(lines):
-                line = lines[i].strip()
-                
-                if line.startswith('+CMGL:'):
-                    if i + 1 < len(lines):
-                        content = lines[i + 1].strip()
-                        
-                        parts = line.split(',')
-                        if len(parts) >= 3:
-                            sender = parts[2].strip().strip('"')
-                            
-                            messages.append({
-                                'sender': sender,
-                                'content': content,
-                                'raw': line
-                            })
-                    i += 1
-                i += 1
-            
-            return messages
-            
+            return await list_stored(self.modem, self.pdu_mode)
         except Exception as e:
             self.logger.error(f"Error verificando mensajes: {e}")
             return []
@@ -312,23 +418,32 @@ class MultiplatformSMSEngine:
         
         try:
             info = {}
-            
+
+            # Registro de red
+            try:
+                creg_response = await self.modem.execute("AT+CREG?", priority=PRIORITY_LOW)
+                for record in creg_response.records_named('+CREG'):
+                    if len(record.params) >= 2:
+                        info['network_status'] = record.params[1]
+                        info['lac'] = record.params[2] if len(record.params) >= 4 else 'N/A'
+                        info['cell_id'] = record.params[3] if len(record.params) >= 4 else 'N/A'
+            except:
+                info['network_status'] = 'Unknown'
+
             # Operador
             try:
-                operator_response = await self._send_command("AT+COPS?")
-                if '+COPS:' in operator_response:
-                    parts = operator_response.split(',')
-                    if len(parts) >= 3:
-                        info['operator'] = parts[2].strip().strip('"')
+                operator_response = await self.modem.execute("AT+COPS?", priority=PRIORITY_LOW)
+                for record in operator_response.records_named('+COPS'):
+                    if len(record.params) >= 3:
+                        info['operator'] = record.params[2]
             except:
                 info['operator'] = 'Unknown'
             
             # Señal
             try:
-                signal_response = await self._send_command("AT+CSQ")
-                if '+CSQ:' in signal_response:
-                    signal_part = signal_response.split('+CSQ:')[1].split(',')[0].strip()
-                    info['signal_strength'] = signal_part
+                signal_response = await self.modem.execute("AT+CSQ", priority=PRIORITY_LOW)
+                for record in signal_response.records_named('+CSQ'):
+                    info['signal_strength'] = record.params[0]
             except:
                 info['signal_strength'] = 'Unknown'
             
@@ -475,12 +590,15 @@ class MultiplatformSMSEngine:
     async def disconnect(self):
         """Desconecta del gateway"""
         
-        if self.serial_connection:
-            try:
-                self.serial_connection.close()
-                self.logger.info("🔌 Gateway desconectado")
-            except:
-                pass
+        if self.modem:
+            await self.modem.stop()
+            self.modem = None
+        
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+            self.serial_connection = None
+            self.logger.info("🔌 Gateway desconectado")
         
         self.is_connected = False
 
@@ -0,0 +1,158 @@
+"""
+Muestreo de Red en Segundo Plano
+Consulta operador, señal y registro cada cierto intervalo y guarda una
+instantánea en memoria; los endpoints de estado la sirven con ETag sin
+tocar el puerto serie
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class NetworkSnapshot:
+    info: Dict = field(default_factory=dict)
+    sampled_at: Optional[float] = None      # Última consulta al módem
+    changed_at: Optional[float] = None      # Último cambio de valores
+    version: int = 0
+
+    @property
+    def changed_at_iso(self) -> Optional[str]:
+        return datetime.fromtimestamp(self.changed_at).isoformat() if self.changed_at else None
+
+    @property
+    def age(self) -> Optional[float]:
+        return time.time() - self.sampled_at if self.sampled_at else None
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara If-None-Match (lista, '*' o validadores débiles W/) con el ETag"""
+
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+class CachedJSON:
+    """Cuerpo JSON + ETag que sólo se recalculan cuando cambia la clave"""
+
+    def __init__(self, build: Callable[[], Any]):
+        self._build = build
+        self._key: Any = object()
+        self._body = b''
+        self._etag = ''
+
+    def get(self, key: Any) -> Tuple[bytes, str]:
+        if key != self._key:
+            self._body = json.dumps(self._build(), ensure_ascii=False).encode('utf-8')
+            self._etag = make_etag(self._body)
+            self._key = key
+        return self._body, self._etag
+
+class NetworkSampler:
+    """Refresca la instantánea de red en el loop del motor
+
+        sampler = NetworkSampler(engine.get_network_info, interval=30,
+                                 is_connected=lambda: engine.is_connected)
+        await sampler.start()
+        sampler.snapshot.info   # sin comandos AT
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[Dict]], interval: float = 30.0,
+                 is_connected: Callable[[], bool] = lambda: True):
+        self.fetch = fetch
+        self.interval = interval
+        self.is_connected = is_connected
+        self.snapshot = NetworkSnapshot()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._subscribers: List[Callable[[NetworkSnapshot], Any]] = []
+
+    async def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_refresh(self):
+        """Adelanta la próxima muestra (p.ej. recién conectado)"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def subscribe(self, callback: Callable[[NetworkSnapshot], Any]) -> Callable[[], None]:
+        """Avisa cada vez que cambian los valores; devuelve la función para darse de baja"""
+
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    async def _run(self):
+        while True:
+            if self.is_connected():
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.warning(f"⚠️ No se pudo muestrear la red: {e}")
+            elif self.snapshot.info:
+                self.clear()
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def refresh(self) -> NetworkSnapshot:
+        """Consulta el módem ahora y actualiza la instantánea"""
+
+        info = await self.fetch()
+        now = time.time()
+        current = self.snapshot
+
+        if info == current.info:
+            current.sampled_at = now
+            return current
+
+        self._publish(NetworkSnapshot(info=info, sampled_at=now, changed_at=now,
+                                      version=current.version + 1))
+        return self.snapshot
+
+    def clear(self):
+        """Sin conexión: la instantánea queda vacía"""
+        self._publish(NetworkSnapshot(changed_at=time.time(), version=self.snapshot.version + 1))
+
+    def _publish(self, snapshot: NetworkSnapshot):
+        self.snapshot = snapshot
+        for callback in list(self._subscribers):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"❌ Error en suscriptor de red: {e}")
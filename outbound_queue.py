@@ -0,0 +1,297 @@
+"""
+Cola Persistente de Envíos
+Los SMS se encolan como filas PENDING de sms_messages; un worker por módem
+las reclama de forma atómica, las envía y reprograma las fallidas con
+espera exponencial hasta MAX_RETRIES. Un reinicio no pierde nada: lo
+PENDING sigue en la base y lo que quedó en SENDING se retoma al vencer su
+reserva
+"""
+import asyncio
+import logging
+import time
+import weakref
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal, message_update, status_writer
+from metrics import Gauge
+from models import SMSMessage, MessageStatus, MessageType
+from write_behind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+SEND_LEASE = 300          # Segundos: un SENDING más viejo quedó huérfano (proceso caído)
+IDLE_POLL = 1.0           # Segundos entre consultas sin avisos (reintentos programados)
+MAX_BACKOFF = 3600        # Tope de la espera entre reintentos
+RECONNECT_DELAY = 30      # Segundos entre intentos de reconectar un módem caído
+
+# Colas vivas, para informar en /metrics cuántos envíos esperan
+_queues: 'weakref.WeakSet[OutboundQueue]' = weakref.WeakSet()
+
+OUTBOUND_PENDING = Gauge('sms_gateway_outbound_pending', 'Envíos PENDING en sms_messages (incluye reintentos programados)',
+                         collect=lambda: sum(queue.pending_count() for queue in list(_queues)))
+
+@dataclass
+class SendFailure:
+    """Resultado de un envío que terminó en excepción (misma forma que SMSResponse)"""
+    error_message: str
+    success: bool = False
+    reference_id: Optional[str] = None
+
+def retry_delay(attempt: int, base: float = settings.RETRY_DELAY) -> float:
+    """Espera antes del reintento `attempt` (1, 2, ...): base, 2·base, 4·base, ..."""
+    return min(base * 2 ** (attempt - 1), MAX_BACKOFF)
+
+class OutboundQueue:
+    """Cola de envíos sobre SMSMessage.status
+
+        queue = OutboundQueue()
+        queue.add_worker(sms_engine, '/dev/ttyUSB0')
+        await queue.start()                       # en el loop donde vive el motor
+        message = queue.enqueue(db, numero, texto)   # desde la API (cualquier hilo)
+
+    Reclamar es un compare-and-set (`UPDATE ... WHERE status = 'PENDING'`),
+    así que dos workers o dos procesos nunca envían la misma fila. Los
+    resultados pasan por `writer` (write-behind) como el resto de los
+    cambios de estado. `on_sent(message_id, result, worker)` se llama en el
+    loop tras cada envío aceptado (p. ej. para esperar el reporte de entrega).
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 writer: WriteBehind = status_writer, lease: float = SEND_LEASE,
+                 poll_interval: float = IDLE_POLL,
+                 on_sent: Optional[Callable[[int, Any, 'SendWorker'], None]] = None):
+        self.session_factory = session_factory
+        self.writer = writer
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.on_sent = on_sent
+        self.workers: List[SendWorker] = []
+        self.stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'recovered': 0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        _queues.add(self)
+
+    def add_worker(self, engine: Any, name: str) -> 'SendWorker':
+        worker = SendWorker(self, engine, name)
+        self.workers.append(worker)
+        if self._loop is not None:
+            self._tasks.append(self._loop.create_task(worker.run()))
+        return worker
+
+    async def start(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+
+        recovered = await self._loop.run_in_executor(None, self.recover_expired)
+        if recovered:
+            logger.info(f"♻️ {recovered} envíos interrumpidos vuelven a la cola")
+
+        self._tasks = [self._loop.create_task(worker.run()) for worker in self.workers]
+        self._tasks.append(self._loop.create_task(self._maintenance()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        self._wake = None
+
+    def enqueue(self, db: Session, phone_number: str, message: str,
+                message_type: MessageType = MessageType.COMMAND) -> SMSMessage:
+        """Guarda el mensaje como PENDING y despierta a los workers"""
+
+        db_message = SMSMessage(
+            phone_number=phone_number,
+            message=message,
+            message_type=message_type,
+            status=MessageStatus.PENDING,
+            max_retries=settings.MAX_RETRIES
+        )
+        db.add(db_message)
+        db.commit()
+        db.refresh(db_message)
+        self.wake()
+        return db_message
+
+    def wake(self):
+        """Avisa que hay trabajo; se puede llamar desde cualquier hilo"""
+        loop = self._loop
+        if loop is not None and self._wake is not None:
+            loop.call_soon_threadsafe(self._wake.set)
+
+    async def wait(self):
+        """Hasta un aviso o `poll_interval` segundos (para los reintentos programados)"""
+        try:
+            await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Reserva el próximo mensaje vencido para `worker` (bloqueante)"""
+
+        now = datetime.now()
+        db = self.session_factory()
+        try:
+            while True:
+                candidate = db.query(SMSMessage.id).filter(
+                    SMSMessage.status == MessageStatus.PENDING,
+                    or_(SMSMessage.next_attempt_at.is_(None), SMSMessage.next_attempt_at <= now)
+                ).order_by(SMSMessage.id).first()
+                if candidate is None:
+                    return None
+
+                # Sólo gana quien la encuentra todavía PENDING
+                claimed = db.query(SMSMessage).filter(
+                    SMSMessage.id == candidate.id,
+                    SMSMessage.status == MessageStatus.PENDING
+                ).update({
+                    SMSMessage.status: MessageStatus.SENDING,
+                    SMSMessage.device_info: worker,
+                    SMSMessage.updated_at: now
+                }, synchronize_session=False)
+                db.commit()
+
+                if claimed:
+                    row = db.query(SMSMessage.id, SMSMessage.phone_number, SMSMessage.message,
+                                   SMSMessage.retries, SMSMessage.max_retries).filter(
+                        SMSMessage.id == candidate.id).one()
+                    return {'id': row.id, 'phone_number': row.phone_number, 'message': row.message,
+                            'retries': row.retries or 0,
+                            'max_retries': row.max_retries or settings.MAX_RETRIES}
+        finally:
+            db.close()
+
+    def pending_count(self) -> int:
+        """Mensajes PENDING (bloqueante: una consulta)"""
+
+        db = self.session_factory()
+        try:
+            return db.query(SMSMessage.id).filter(SMSMessage.status == MessageStatus.PENDING).count()
+        finally:
+            db.close()
+
+    def recover_expired(self) -> int:
+        """SENDING con la reserva vencida -> PENDING (bloqueante)"""
+
+        db = self.session_factory()
+        try:
+            recovered = db.query(SMSMessage).filter(
+                SMSMessage.status == MessageStatus.SENDING,
+                SMSMessage.updated_at < datetime.now() - timedelta(seconds=self.lease)
+            ).update({
+                SMSMessage.status: MessageStatus.PENDING,
+                SMSMessage.next_attempt_at: None,
+                SMSMessage.updated_at: datetime.now()
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self.stats['recovered'] += recovered
+        return recovered
+
+    def record_result(self, job: Dict, result: Any, worker: 'SendWorker'):
+        """SENT, o PENDING con el próximo intento programado, o FAILED sin más intentos"""
+
+        if result.success:
+            self.stats['sent'] += 1
+            self.writer.submit(message_update(job['id'], MessageStatus.SENT,
+                                              reference_id=result.reference_id,
+                                              sent_at=datetime.now(), next_attempt_at=None))
+            if self.on_sent is not None:
+                try:
+                    self.on_sent(job['id'], result, worker)
+                except Exception as e:
+                    logger.error(f"❌ Error tras el envío de {job['id']}: {e}")
+            return
+
+        attempt = job['retries'] + 1
+        if attempt >= job['max_retries']:
+            self.stats['failed'] += 1
+            logger.error(f"❌ SMS {job['id']} falló tras {attempt} intentos: {result.error_message}")
+            self.writer.submit(message_update(job['id'], MessageStatus.FAILED, retries=attempt,
+                                              error_message=result.error_message,
+                                              next_attempt_at=None))
+            return
+
+        delay = retry_delay(attempt)
+        self.stats['retried'] += 1
+        logger.warning(f"⚠️ SMS {job['id']} falló (intento {attempt}/{job['max_retries']}), "
+                       f"reintento en {delay:.0f} s: {result.error_message}")
+        self.writer.submit(message_update(job['id'], MessageStatus.PENDING, retries=attempt,
+                                          error_message=result.error_message,
+                                          next_attempt_at=datetime.now() + timedelta(seconds=delay)))
+
+    async def _maintenance(self):
+        while True:
+            await asyncio.sleep(self.lease / 4)
+            try:
+                if await self._loop.run_in_executor(None, self.recover_expired):
+                    self.wake()
+            except Exception as e:
+                logger.error(f"❌ Error revisando envíos interrumpidos: {e}")
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['workers'] = {worker.name: worker.sent for worker in self.workers}
+        return stats
+
+class SendWorker:
+    """Envía de a un mensaje por vez por su módem (el puerto es serie de todos modos)"""
+
+    def __init__(self, queue: OutboundQueue, engine: Any, name: str):
+        self.queue = queue
+        self.engine = engine
+        self.name = name
+        self.sent = 0
+        self._last_connect = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not await self._ensure_connected():
+                await self.queue.wait()
+                continue
+
+            try:
+                job = await loop.run_in_executor(None, self.queue.claim, self.name)
+            except Exception as e:
+                logger.error(f"❌ [{self.name}] Error reclamando envíos: {e}")
+                job = None
+
+            if job is None:
+                await self.queue.wait()
+                continue
+
+            self.queue.stats['claimed'] += 1
+            try:
+                result = await self.engine.send_sms(job['phone_number'], job['message'])
+            except Exception as e:
+                result = SendFailure(error_message=str(e))
+            if result.success:
+                self.sent += 1
+            self.queue.record_result(job, result, self)
+
+    async def _ensure_connected(self) -> bool:
+        if self.engine.is_connected:
+            return True
+        # Reconectar como mucho cada RECONNECT_DELAY segundos; mientras tanto la cola espera
+        if time.monotonic() - self._last_connect < RECONNECT_DELAY:
+            return False
+        self._last_connect = time.monotonic()
+        logger.info(f"🔌 [{self.name}] Módem desconectado, reconectando...")
+        try:
+            return await self.engine.connect()
+        except Exception as e:
+            logger.error(f"❌ [{self.name}] No se pudo reconectar: {e}")
+            return False
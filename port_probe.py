@@ -0,0 +1,125 @@
+"""
+Sondeo de Puertos Serie
+Abre todos los puertos candidatos a la vez, envía AT y ATI con un plazo
+corto y ordena los que contestan. Un módem USB expone varias interfaces
+(módem, diagnóstico, PC UI): que un puerto abra no significa que hable
+AT, y la de diagnóstico nunca devuelve OK
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import serial
+
+from at_parser import ATResponseParser, FinalResult, IntermediateResult
+
+PROBE_TIMEOUT = 0.5     # Segundos por puerto (todos en paralelo) para AT + ATI
+_READ_SLICE = 0.02      # Espera máxima de cada lectura mientras no llega nada
+
+@dataclass
+class ProbeResult:
+    """Lo que contestó un puerto al sondeo"""
+    port: str
+    responds: bool = False                               # Devolvió OK a AT
+    identity: List[str] = field(default_factory=list)    # Líneas de ATI ("Manufacturer: huawei", ...)
+    elapsed: float = 0.0
+    error: Optional[str] = None                          # No abrió o no contestó a tiempo
+
+    @property
+    def description(self) -> str:
+        values = [line.split(':', 1)[-1].strip() for line in self.identity[:2]]
+        return ' '.join(value for value in values if value)
+
+def _exchange(connection: serial.Serial, parser: ATResponseParser, command: str,
+              deadline: float) -> Optional[Tuple[bool, List[str]]]:
+    """Envía un comando; (ok, líneas) o None si no hubo código final antes de `deadline`"""
+    parser.begin(command)
+    connection.write(command.encode('ascii') + b'\r')
+    lines = []
+    while time.monotonic() < deadline:
+        data = connection.read(connection.in_waiting or 1)
+        if not data:
+            continue
+        for event in parser.feed(data):
+            if isinstance(event, FinalResult):
+                return event.ok, lines
+            if isinstance(event, IntermediateResult):
+                lines.append(event.line)
+    return None
+
+def probe_port(port: str, baudrate: int = 9600, timeout: float = PROBE_TIMEOUT) -> ProbeResult:
+    """AT y, si contesta, ATI sobre un puerto; nunca lanza excepciones"""
+
+    result = ProbeResult(port)
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        with serial.Serial(port, baudrate, timeout=_READ_SLICE, write_timeout=timeout) as connection:
+            connection.reset_input_buffer()
+            parser = ATResponseParser()
+            answer = _exchange(connection, parser, 'AT', deadline)
+            if answer is None:
+                result.error = "sin respuesta"
+            elif not answer[0]:
+                result.error = "AT rechazado"
+            else:
+                result.responds = True
+                identity = _exchange(connection, parser, 'ATI', deadline)
+                if identity is not None and identity[0]:
+                    result.identity = identity[1]
+    except (serial.SerialException, OSError, ValueError) as e:
+        result.error = str(e)
+    result.elapsed = time.monotonic() - start
+    return result
+
+def probe_ports(ports: List[str], baudrate: int = 9600, timeout: float = PROBE_TIMEOUT) -> List[ProbeResult]:
+    """Sondea todos los puertos en paralelo; resultados en el orden recibido"""
+
+    ports = list(dict.fromkeys(ports))
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix='port-probe') as executor:
+        return list(executor.map(lambda port: probe_port(port, baudrate, timeout), ports))
+
+def probe_until_answer(ports: List[str], baudrate: int = 9600,
+                       timeout: float = PROBE_TIMEOUT) -> List[ProbeResult]:
+    """Como probe_ports, pero termina en cuanto el mejor puerto ya no puede cambiar
+
+    Eso ocurre cuando un puerto contestó AT e ATI y todos los candidatos
+    anteriores terminaron: rank_responsive elegiría el mismo que esperando
+    a todos, así que las interfaces mudas posteriores no demoran la
+    conexión. Los sondeos sin terminar quedan fuera del resultado (siguen
+    en segundo plano hasta su plazo y cierran su puerto).
+    """
+    ports = list(dict.fromkeys(ports))
+    if not ports:
+        return []
+    executor = ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix='port-probe')
+    try:
+        futures = [executor.submit(probe_port, port, baudrate, timeout) for port in ports]
+        pending = set(futures)
+        while pending and not _settled(futures):
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        return [future.result() for future in futures if future.done()]
+    finally:
+        executor.shutdown(wait=False)
+
+def _settled(futures) -> bool:
+    # El primero que se identificó con todos los anteriores terminados (y sin identificar)
+    for future in futures:
+        if not future.done():
+            return False
+        result = future.result()
+        if result.responds and result.identity:
+            return True
+    return False
+
+def rank_responsive(results: List[ProbeResult]) -> List[ProbeResult]:
+    """Los puertos que contestaron AT: primero los que además se identificaron con ATI
+
+    Dentro de cada grupo se mantiene el orden de los candidatos (el de
+    `find_modem_ports()`, con el último puerto que funcionó adelante).
+    """
+    responsive = [result for result in results if result.responds]
+    return sorted(responsive, key=lambda result: not result.identity)
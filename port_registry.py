@@ -0,0 +1,215 @@
+"""
+Registro de Puertos Serie
+Guarda el resultado de enumerar los puertos y sólo vuelve a enumerar
+cuando se conecta o desconecta un dispositivo: en Linux escucha /dev con
+inotify (o compara /sys/class/tty periódicamente si no está disponible);
+en el resto de los sistemas reescanea en segundo plano. Consultar el
+estado nunca toca sysfs ni el archivo de configuración
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5.0       # Segundos entre comparaciones de /sys/class/tty (sin inotify)
+SCAN_INTERVAL = 30.0      # Segundos entre escaneos completos donde no hay cómo detectar cambios
+SETTLE_DELAY = 0.5        # udev crea el nodo antes de terminar de configurarlo
+
+# inotify(7)
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+_SERIAL_PREFIXES = ('tty', 'rfcomm')
+
+def rank_modem_ports(ports: List[Dict]) -> List[str]:
+    """Puertos candidatos a módem, en orden de prioridad"""
+
+    def priority(port: Dict) -> int:
+        # 0: Huawei con VID:PID específico (12d1:1506), 1: cualquier Huawei, 2: cualquier módem
+        if port['vid'] == 0x12d1 and port['pid'] == 0x1506:
+            return 0
+        return 1 if port['is_huawei'] else 2
+
+    eligible = [port for port in ports if port['is_huawei'] or port['is_modem']]
+    return [port['device'] for port in sorted(eligible, key=priority)]
+
+class _DevWatcher:
+    """inotify sobre /dev vía libc; None si el sistema no lo permite"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, path: str = '/dev') -> Optional['_DevWatcher']:
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM | _IN_MOVED_TO
+            if libc.inotify_add_watch(fd, path.encode(), mask) < 0:
+                os.close(fd)
+                return None
+            return cls(fd)
+        except (OSError, AttributeError):
+            return None
+
+    def wait(self, timeout: float) -> bool:
+        """True si apareció o desapareció un nodo tty* antes de `timeout`"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        changed = False
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', errors='replace')
+            offset += length
+            if name.startswith(_SERIAL_PREFIXES):
+                changed = True
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def _sysfs_signature() -> Optional[Tuple[str, ...]]:
+    try:
+        return tuple(sorted(os.listdir('/sys/class/tty')))
+    except OSError:
+        return None
+
+class PortRegistry:
+    """Puertos serie enumerados una vez y actualizados al enchufar/desenchufar
+
+        registry = PortRegistry(SystemConfig.scan_available_ports)
+        registry.ports()          # lista en memoria (la primera llamada enumera)
+        registry.modem_ports()    # candidatos a módem por prioridad
+        registry.version          # cambia con cada conexión/desconexión
+
+    Un hilo en segundo plano espera los cambios: inotify en /dev, si no
+    la firma de /sys/class/tty cada POLL_INTERVAL segundos y, donde no hay
+    ninguno de los dos (Windows, macOS), un escaneo cada SCAN_INTERVAL.
+    """
+
+    def __init__(self, scan: Callable[[], List[Dict]], poll_interval: float = POLL_INTERVAL,
+                 scan_interval: float = SCAN_INTERVAL, watch: bool = True):
+        self.scan = scan
+        self.poll_interval = poll_interval
+        self.scan_interval = scan_interval
+        self.watch = watch
+        self.version = 0
+        self.stats = {'scans': 0, 'changes': 0}
+        self.mode: Optional[str] = None    # 'inotify', 'sysfs' o 'scan'
+        self._ports: Optional[List[Dict]] = None
+        self._modem_ports: List[str] = []
+        self._lock = threading.Lock()
+        self._stale = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def ports(self) -> List[Dict]:
+        self._ensure()
+        return list(self._ports)
+
+    def modem_ports(self) -> List[str]:
+        self._ensure()
+        return list(self._modem_ports)
+
+    def invalidate(self):
+        """El próximo acceso vuelve a enumerar (p. ej. tras fallar al abrir un puerto)"""
+        self._stale = True
+
+    def refresh(self) -> bool:
+        """Enumera ahora; True si la lista cambió"""
+        ports = self.scan()
+        with self._lock:
+            self.stats['scans'] += 1
+            self._stale = False
+            previous, self._ports = self._ports, ports
+            self._modem_ports = rank_modem_ports(ports)
+            if previous is not None and _devices(ports) == _devices(previous):
+                return False
+            if previous is not None:
+                added = _devices(ports) - _devices(previous)
+                removed = _devices(previous) - _devices(ports)
+                logger.info(f"🔌 Puertos serie: +{sorted(added) or '-'} -{sorted(removed) or '-'}")
+                self.stats['changes'] += 1
+            self.version += 1
+            return True
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def _ensure(self):
+        if self._ports is None or self._stale:
+            self.refresh()
+        if self.watch and self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name='port-registry', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        watcher = _DevWatcher.open()
+        try:
+            if watcher is not None:
+                self.mode = 'inotify'
+                while not self._stop.is_set():
+                    if watcher.wait(1.0):
+                        # Juntar la ráfaga de eventos de un mismo USB (varias interfaces)
+                        time.sleep(SETTLE_DELAY)
+                        while watcher.wait(0):
+                            pass
+                        self._safe_refresh()
+                return
+
+            signature = _sysfs_signature()
+            if signature is not None:
+                self.mode = 'sysfs'
+                while not self._stop.wait(self.poll_interval):
+                    current = _sysfs_signature()
+                    if current != signature:
+                        signature = current
+                        time.sleep(SETTLE_DELAY)
+                        self._safe_refresh()
+                return
+
+            self.mode = 'scan'
+            while not self._stop.wait(self.scan_interval):
+                self._safe_refresh()
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"❌ Error enumerando puertos serie: {e}")
+
+def _devices(ports: List[Dict]) -> Set[str]:
+    return {port['device'] for port in ports}
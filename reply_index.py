@@ -0,0 +1,83 @@
+"""
+Índice de Correlación de Respuestas
+Envíos pendientes de respuesta agrupados por número y ordenados por hora
+de envío: una respuesta se asocia al envío más reciente a ese número en
+O(1) amortizado, aunque haya miles pendientes
+"""
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+RESPONSE_WINDOW = 24 * 3600   # Una respuesta cuenta si llega dentro de las 24 h del envío
+
+def normalize_number(number: str, country_code: str = '51') -> str:
+    """'+51 946 467 799', '0051946467799' y '946467799' -> '946467799'"""
+
+    digits = ''.join(ch for ch in number if ch.isdigit()).lstrip('0')
+    if country_code and digits.startswith(country_code) and len(digits) - len(country_code) >= 8:
+        digits = digits[len(country_code):]
+    return digits
+
+class ReplyIndex:
+    """Envíos pendientes por número
+
+        replies = ReplyIndex()
+        replies.add('946467799', 'msg_001')
+        replies.match('+51946467799')   # -> 'msg_001' (y deja de estar pendiente)
+    """
+
+    def __init__(self, window: float = RESPONSE_WINDOW, country_code: str = '51',
+                 clock: Callable[[], float] = time.time):
+        self.window = window
+        self.country_code = country_code
+        self._clock = clock
+        self._by_number: Dict[str, Deque[Tuple[float, Any]]] = {}
+        # Todas las entradas en orden de envío, para expirar sin recorrer los números
+        self._expiry: Deque[Tuple[float, str, Tuple[float, Any]]] = deque()
+
+    def __len__(self) -> int:
+        return sum(len(pending) for pending in self._by_number.values())
+
+    def add(self, number: str, key: Any, sent_at: Optional[float] = None):
+        """Registra un envío exitoso que puede recibir respuesta"""
+
+        now = self._clock()
+        self._evict(now)
+
+        entry = (now if sent_at is None else sent_at, key)
+        number = normalize_number(number, self.country_code)
+        self._by_number.setdefault(number, deque()).append(entry)
+        self._expiry.append((entry[0], number, entry))
+
+    def match(self, number: str) -> Optional[Any]:
+        """Clave del envío más reciente a `number` dentro de la ventana, o None
+
+        El envío queda respondido: una segunda respuesta se asocia al
+        anterior a ese número, si lo hay.
+        """
+        now = self._clock()
+        self._evict(now)
+
+        pending = self._by_number.get(normalize_number(number, self.country_code))
+        if not pending:
+            return None
+
+        _, key = pending.pop()
+        if not pending:
+            del self._by_number[normalize_number(number, self.country_code)]
+        return key
+
+    def _evict(self, now: float):
+        expiry = self._expiry
+        while expiry and now - expiry[0][0] >= self.window:
+            _, number, entry = expiry.popleft()
+            pending = self._by_number.get(number)
+            # Las respondidas ya no están; las vencidas de cada número están al principio
+            if pending and pending[0] is entry:
+                pending.popleft()
+                if not pending:
+                    del self._by_number[number]
+
+    def clear(self):
+        self._by_number.clear()
+        self._expiry.clear()
@@ -0,0 +1,231 @@
+"""
+Transporte Serie Asíncrono
+Lector compartido por los motores SMS: despierta al llegar bytes en lugar
+de hacer polling de in_waiting con asyncio.sleep()
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from at_parser import ATEvent, ATResponseParser, FinalResult, Prompt
+
+logger = logging.getLogger(__name__)
+
+class SerialTransportError(Exception):
+    """Error de E/S en el transporte serie"""
+    pass
+
+class AsyncSerialTransport:
+    """Envuelve un serial.Serial y entrega los bytes recibidos al event loop
+
+    En Linux/macOS el descriptor del puerto se registra con loop.add_reader(),
+    así que el loop despierta exactamente cuando el módem escribe. En Windows
+    (sin fileno()) un hilo lector dedicado bloquea en read() y reenvía los
+    datos al loop con call_soon_threadsafe().
+    """
+
+    def __init__(self, serial_connection):
+        self.serial_connection = serial_connection
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._data_event: Optional[asyncio.Event] = None
+        self._fd: Optional[int] = self._get_fileno(serial_connection)
+        self._reader_thread: Optional[threading.Thread] = None
+        self._error: Optional[Exception] = None
+        self._closed = False
+
+    @staticmethod
+    def _get_fileno(serial_connection) -> Optional[int]:
+        """Descriptor del puerto si el sistema permite registrarlo en el loop"""
+        try:
+            return serial_connection.fileno()
+        except Exception:
+            return None
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed and bool(self.serial_connection) and self.serial_connection.is_open
+
+    def _ensure_attached(self):
+        """Asocia el lector al loop en ejecución (re-registra si cambió)"""
+
+        if self._closed:
+            raise SerialTransportError("Transporte serie cerrado")
+
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+
+        self._detach()
+        self._loop = loop
+        self._data_event = asyncio.Event()
+
+        with self._lock:
+            if self._buffer:
+                self._data_event.set()
+
+        if self._fd is not None:
+            loop.add_reader(self._fd, self._on_readable)
+        elif not self._reader_thread or not self._reader_thread.is_alive():
+            self._reader_thread = threading.Thread(
+                target=self._reader_thread_loop,
+                daemon=True
+            )
+            self._reader_thread.start()
+
+    def _detach(self):
+        """Quita el registro del loop anterior"""
+
+        if self._loop is not None and self._fd is not None:
+            try:
+                self._loop.remove_reader(self._fd)
+            except Exception:
+                pass
+        self._loop = None
+        self._data_event = None
+
+    def _on_readable(self):
+        """Callback del loop cuando el descriptor tiene datos"""
+
+        try:
+            waiting = self.serial_connection.in_waiting
+            data = self.serial_connection.read(waiting or 1)
+        except Exception as e:
+            self._fail(e)
+            return
+
+        if data:
+            self._feed(data)
+
+    def _reader_thread_loop(self):
+        """Hilo lector para sistemas sin add_reader() sobre el puerto"""
+
+        while not self._closed:
+            try:
+                waiting = self.serial_connection.in_waiting
+                data = self.serial_connection.read(waiting or 1)
+            except Exception as e:
+                if not self._closed:
+                    self._fail(e)
+                return
+
+            if data:
+                self._feed(data)
+
+    def _feed(self, data: bytes):
+        """Agrega bytes al buffer y despierta a quien esté esperando"""
+
+        with self._lock:
+            self._buffer += data
+        self._wake()
+
+    def _fail(self, error: Exception):
+        """Registra un error de E/S y despierta a los lectores"""
+
+        logger.error(f"❌ Error leyendo puerto serie: {error}")
+        self._error = error
+        if self._loop is not None and self._fd is not None:
+            try:
+                self._loop.remove_reader(self._fd)
+            except Exception:
+                pass
+        self._wake()
+
+    def _wake(self):
+        loop, event = self._loop, self._data_event
+        if loop is None or event is None:
+            return
+
+        if self._fd is not None:
+            # Ya estamos en el hilo del loop
+            event.set()
+        else:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # El loop fue cerrado; los datos quedan en el buffer
+                pass
+
+    def _take(self) -> bytes:
+        with self._lock:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        return data
+
+    async def read(self, timeout: float) -> bytes:
+        """Devuelve los bytes disponibles, esperando hasta `timeout` a que llegue alguno"""
+
+        self._ensure_attached()
+
+        if self._error:
+            raise SerialTransportError(f"Puerto serie no disponible: {self._error}")
+
+        if not self._buffer:
+            self._data_event.clear()
+            if timeout <= 0:
+                return b""
+            try:
+                await asyncio.wait_for(self._data_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return b""
+
+            if self._error and not self._buffer:
+                raise SerialTransportError(f"Puerto serie no disponible: {self._error}")
+
+        return self._take()
+
+    async def read_until(self, parser: ATResponseParser, timeout: float) -> List[ATEvent]:
+        """Pasa lo recibido por `parser` hasta el código final (o el prompt '>') o `timeout`
+
+        Cada lectura se procesa una sola vez y el parser decodifica por
+        líneas completas: un carácter multibyte partido entre dos lecturas
+        no se pierde. Llamar antes a `parser.begin(comando)`.
+        """
+
+        events: List[ATEvent] = []
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            chunk = await self.read(remaining)
+            if not chunk:
+                break
+
+            new = parser.feed(chunk)
+            events.extend(new)
+            if any(isinstance(event, (FinalResult, Prompt)) for event in new):
+                break
+
+        return events
+
+    def write(self, data: bytes):
+        """Escribe bytes en el puerto"""
+
+        if self._closed:
+            raise SerialTransportError("Transporte serie cerrado")
+        self.serial_connection.write(data)
+
+    def discard(self):
+        """Descarta lo recibido y no leído (equivale a reset_input_buffer)"""
+
+        self._take()
+        try:
+            self.serial_connection.reset_input_buffer()
+        except Exception:
+            pass
+
+    def close(self):
+        """Cierra el transporte y el puerto serie"""
+
+        self._closed = True
+        self._detach()
+        try:
+            self.serial_connection.close()
+        except Exception:
+            pass
@@ -4,22 +4,54 @@ Servidor web básico para el SMS Gateway
 Funciona sin FastAPI para evitar problemas de compatibilidad
 """
 import json
-import asyncio
-from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
-import threading
 import logging
 
 from config import settings
-from database import create_tables, get_db_sync
-from models import SMSMessage, Device, MessageStatus, MessageType
+from database import create_tables, get_db_sync, status_writer
+from models import SMSMessage, Device, MessageType
 from sms_engine import sms_engine
+from engine_loop import EngineLoopThread
+from outbound_queue import OutboundQueue
+from network_sampler import CachedJSON, NetworkSampler, etag_matches
+import metrics
 
 # Configurar logging
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
 logger = logging.getLogger(__name__)
 
+# El motor, su multiplexor y el worker de envíos viven en un único loop;
+# los hilos HTTP le entregan corrutinas y sólo encolan los envíos
+engine_loop = EngineLoopThread()
+outbound_queue = OutboundQueue()
+outbound_queue.add_worker(sms_engine, settings.SERIAL_PORT)
+QUERY_TIMEOUT = 30
+
+# Operador, señal y registro se muestrean en el loop del motor; /status y
+# /network-info sirven la última muestra con ETag sin tocar el puerto
+network_sampler = NetworkSampler(sms_engine.get_network_info,
+                                 interval=settings.NETWORK_SAMPLE_INTERVAL,
+                                 is_connected=lambda: sms_engine.is_connected)
+
+def _build_status() -> dict:
+    snapshot = network_sampler.snapshot
+    return {
+        "connected": sms_engine.is_connected,
+        "timestamp": snapshot.changed_at_iso,
+        "network": snapshot.info if sms_engine.is_connected else {"error": "Gateway no conectado"},
+        "port": settings.SERIAL_PORT,
+        "baudrate": settings.SERIAL_BAUDRATE
+    }
+
+status_cache = CachedJSON(_build_status)
+network_info_cache = CachedJSON(lambda: network_sampler.snapshot.info)
+
+class GatewayHTTPServer(ThreadingHTTPServer):
+    """Un hilo por petición: un POST /send-sms no espera a que termine el anterior"""
+    daemon_threads = True
+    request_queue_size = 128  # Con el backlog por defecto (5) las ráfagas esperan el reintento de SYN (~1 s)
+
 class SMSGatewayHandler(BaseHTTPRequestHandler):
     """Manejador HTTP para el SMS Gateway"""
     
@@ -39,6 +71,8 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
                 self.send_network_info()
             elif path == '/devices':
                 self.send_devices()
+            elif path == '/metrics':
+                self.send_metrics()
             else:
                 self.send_404()
         except Exception as e:
@@ -163,24 +197,9 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
         self.wfile.write(html.encode('utf-8'))
     
     def send_status(self):
-        """Envía el estado del gateway"""
-        try:
-            if sms_engine.is_connected:
-                network_info = asyncio.run(sms_engine.get_network_info())
-            else:
-                network_info = {"error": "Gateway no conectado"}
-            
-            status = {
-                "connected": sms_engine.is_connected,
-                "timestamp": datetime.now().isoformat(),
-                "network": network_info,
-                "port": settings.SERIAL_PORT,
-                "baudrate": settings.SERIAL_BAUDRATE
-            }
-            
-            self.send_json_response(status)
-        except Exception as e:
-            self.send_error_response(str(e))
+        """Envía el estado del gateway (instantánea de red, sin comandos AT)"""
+        connected = sms_engine.is_connected
+        self.send_cached_response(*status_cache.get((connected, network_sampler.snapshot.version)))
     
     def send_messages(self):
         """Envía la lista de mensajes"""
@@ -207,18 +226,20 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
             self.send_error_response(str(e))
     
     def send_network_info(self):
-        """Envía información de red"""
-        try:
-            if not sms_engine.is_connected:
-                connected = asyncio.run(sms_engine.connect())
-                if not connected:
-                    self.send_error_response("No se pudo conectar al gateway")
-                    return
-            
-            info = asyncio.run(sms_engine.get_network_info())
-            self.send_json_response(info)
-        except Exception as e:
-            self.send_error_response(str(e))
+        """Envía información de red (el worker de envíos se encarga de reconectar)"""
+        if not sms_engine.is_connected:
+            self.send_error_response("Gateway no conectado", 503)
+            return
+        self.send_cached_response(*network_info_cache.get(network_sampler.snapshot.version))
+    
+    def send_metrics(self):
+        """Envía las métricas en formato Prometheus"""
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header('Content-type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def send_devices(self):
         """Envía lista de dispositivos"""
@@ -256,26 +277,12 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
                 self.send_error_response("phone_number y message son requeridos")
                 return
             
-            # Crear registro en base de datos
+            # Sólo se encola: el worker del módem lo envía y reintenta si hace falta
             db = get_db_sync()
-            db_message = SMSMessage(
-                phone_number=phone_number,
-                message=message,
-                message_type=MessageType.COMMAND,
-                status=MessageStatus.PENDING
-            )
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
-            message_id = db_message.id
-            db.close()
-            
-            # Enviar SMS en background
-            threading.Thread(
-                target=self.process_sms_background,
-                args=(message_id, phone_number, message),
-                daemon=True
-            ).start()
+            try:
+                message_id = outbound_queue.enqueue(db, phone_number, message, MessageType.COMMAND).id
+            finally:
+                db.close()
             
             response = {
                 "id": message_id,
@@ -289,46 +296,6 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error_response(str(e))
     
-    def process_sms_background(self, message_id: int, phone_number: str, message: str):
-        """Procesa el envío de SMS en background"""
-        try:
-            # Conectar si no está conectado
-            if not sms_engine.is_connected:
-                connected = asyncio.run(sms_engine.connect())
-                if not connected:
-                    self.update_message_status(message_id, MessageStatus.FAILED, "No se pudo conectar al gateway")
-                    return
-            
-            # Enviar SMS
-            result = asyncio.run(sms_engine.send_sms(phone_number, message))
-            
-            if result.success:
-                self.update_message_status(message_id, MessageStatus.SENT, None, result.reference_id)
-            else:
-                self.update_message_status(message_id, MessageStatus.FAILED, result.error_message)
-                
-        except Exception as e:
-            logger.error(f"Error en background SMS {message_id}: {e}")
-            self.update_message_status(message_id, MessageStatus.FAILED, str(e))
-    
-    def update_message_status(self, message_id: int, status: MessageStatus, error_message: str = None, reference_id: str = None):
-        """Actualiza el estado de un mensaje"""
-        try:
-            db = get_db_sync()
-            message = db.query(SMSMessage).filter(SMSMessage.id == message_id).first()
-            if message:
-                message.status = status
-                if error_message:
-                    message.error_message = error_message
-                if reference_id:
-                    message.reference_id = reference_id
-                if status == MessageStatus.SENT:
-                    message.sent_at = datetime.now()
-                db.commit()
-            db.close()
-        except Exception as e:
-            logger.error(f"Error actualizando mensaje {message_id}: {e}")
-    
     def send_json_response(self, data):
         """Envía una respuesta JSON"""
         self.send_response(200)
@@ -339,9 +306,25 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(data, default=str, ensure_ascii=False).encode('utf-8'))
     
-    def send_error_response(self, error_message):
+    def send_cached_response(self, body: bytes, etag: str):
+        """Envía un JSON precalculado, o 304 si el cliente ya tiene ese ETag"""
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_error_response(self, error_message, status=500):
         """Envía una respuesta de error"""
-        self.send_response(500)
+        self.send_response(status)
         self.send_header('Content-type', 'application/json; charset=utf-8')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
@@ -372,11 +355,19 @@ def start_server():
     """Inicia el servidor HTTP"""
     # Inicializar base de datos
     create_tables()
+    status_writer.start()
     logger.info("✅ Base de datos inicializada")
     
+    # Si el módem no responde, el worker reintenta la conexión por su cuenta
+    engine_loop.start()
+    if not engine_loop.run(sms_engine.connect(), QUERY_TIMEOUT):
+        logger.warning("⚠️ Gateway no conectado; los envíos quedan en cola")
+    engine_loop.run(outbound_queue.start())
+    engine_loop.run(network_sampler.start())
+    
     # Crear servidor
     server_address = (settings.HOST, settings.PORT)
-    httpd = HTTPServer(server_address, SMSGatewayHandler)
+    httpd = GatewayHTTPServer(server_address, SMSGatewayHandler)
     
     logger.info(f"🚀 Servidor iniciado en http://{settings.HOST}:{settings.PORT}")
     logger.info(f"📡 Gateway SMS configurado en {settings.SERIAL_PORT}")
@@ -385,7 +376,11 @@ def start_server():
         httpd.serve_forever()
     except KeyboardInterrupt:
         logger.info("🔌 Cerrando servidor...")
-        asyncio.run(sms_engine.disconnect())
+        engine_loop.run(outbound_queue.stop())
+        engine_loop.run(network_sampler.stop())
+        engine_loop.run(sms_engine.disconnect())
+        engine_loop.stop()
+        status_writer.stop()
         httpd.shutdown()
 
 if __name__ == "__main__":
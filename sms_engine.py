@@ -11,6 +11,9 @@ from dataclasses import dataclass
 import re
 
 from config import settings
+from serial_transport import AsyncSerialTransport
+from at_multiplexer import ATCommandMultiplexer, ATCommandError, PRIORITY_HIGH
+from delivery_reports import enable_status_reports
 
 # Configurar logging
 logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL))
@@ -23,15 +26,13 @@ class SMSResponse:
     error_message: Optional[str] = None
     details: Optional[str] = None
 
-class ATCommandError(Exception):
-    """Excepción para errores de comandos AT"""
-    pass
-
 class SMSEngine:
     """Motor principal para gestión de SMS usando comandos AT"""
     
     def __init__(self):
         self.serial_connection: Optional[serial.Serial] = None
+        self.transport: Optional[AsyncSerialTransport] = None
+        self.modem: Optional[ATCommandMultiplexer] = None
         self.is_connected = False
         
     async def connect(self) -> bool:
@@ -44,6 +45,9 @@ class SMSEngine:
                 baudrate=settings.SERIAL_BAUDRATE,
                 timeout=settings.SERIAL_TIMEOUT
             )
+            self.transport = AsyncSerialTransport(self.serial_connection)
+            self.modem = ATCommandMultiplexer(self.transport, name=self.serial_connection.port)
+            await self.modem.start()
             
             # Esperar estabilización
             await asyncio.sleep(2)
@@ -60,17 +64,25 @@ class SMSEngine:
         except Exception as e:
             logger.error(f"❌ Error conectando al gateway: {e}")
             self.is_connected = False
-            if self.serial_connection and self.serial_connection.is_open:
-                self.serial_connection.close()
-                self.serial_connection = None
+            if self.modem:
+                await self.modem.stop()
+                self.modem = None
+            if self.transport:
+                self.transport.close()
+                self.transport = None
+            self.serial_connection = None
             return False
     
     async def disconnect(self):
         """Cierra la conexión con el gateway"""
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
+        if self.modem:
+            await self.modem.stop()
+        if self.transport:
+            self.transport.close()
         
         self.is_connected = False
+        self.modem = None
+        self.transport = None
         self.serial_connection = None
         logger.info("🔌 Conexión cerrada")
     
@@ -96,45 +108,30 @@ class SMSEngine:
                 logger.debug(f"Comando inicialización OK: {cmd}")
             except Exception as e:
                 logger.warning(f"Error en comando {cmd}: {e}")
+        
+        # TP-SRR en AT+CSMP y +CDS directo (ds=1)
+        if settings.DELIVERY_REPORTS and await enable_status_reports(self.modem):
+            logger.info("📬 Reportes de entrega activados")
+    
+    def subscribe_urc(self, callback):
+        """Suscribe un callback a los códigos no solicitados (+CMTI, +CDS, ...)"""
+        if not self.modem:
+            raise ATCommandError("No hay conexión serial")
+        return self.modem.subscribe(callback)
     
     async def _send_command(self, command: str, wait_time: float = 2.0) -> Optional[str]:
         """Envía un comando AT y espera respuesta"""
-        if not self.serial_connection or not self.serial_connection.is_open:
+        if not self.modem or not self.transport.is_open:
             raise ATCommandError("No hay conexión serial")
         
         try:
-            # Limpiar buffer de entrada
-            self.serial_connection.reset_input_buffer()
-            
-            # Enviar comando
-            full_command = f"{command}\r\n"
-            self.serial_connection.write(full_command.encode())
             logger.debug(f"📤 Enviado: {command}")
             
-            # Esperar respuesta
-            await asyncio.sleep(wait_time)
-            
-            response = ""
-            max_attempts = 10
-            attempts = 0
-            
-            while attempts < max_attempts:
-                if self.serial_connection.in_waiting > 0:
-                    data = self.serial_connection.read(self.serial_connection.in_waiting)
-                    response += data.decode('utf-8', errors='ignore')
-                    
-                    # Si tenemos OK o ERROR, terminamos
-                    if "OK" in response or "ERROR" in response:
-                        break
-                        
-                await asyncio.sleep(0.1)
-                attempts += 1
+            # El multiplexor termina en cuanto llega OK o ERROR
+            response = (await self.modem.execute(command, timeout=wait_time + 1)).text
             
             logger.debug(f"📥 Respuesta: {response.strip()}")
             
-            if "ERROR" in response:
-                raise ATCommandError(f"Comando falló: {response.strip()}")
-            
             return response.strip()
                     
         except Exception as e:
@@ -157,35 +154,19 @@ class SMSEngine:
             
             logger.info(f"📤 Enviando SMS a {phone_number}: {clean_message}")
             
-            # Iniciar envío de SMS
-            response = await self._send_command(f'AT+CMGS="{phone_number}"', wait_time=1.0)
-            
-            if not response or ">" not in response:
-                raise ATCommandError("No se recibió prompt para mensaje")
-            
-            # Enviar mensaje + Ctrl+Z
-            if self.serial_connection:
-                self.serial_connection.write(clean_message.encode('ascii'))
-                self.serial_connection.write(bytes([26]))  # Ctrl+Z
-                
-                # Esperar confirmación de envío
-                await asyncio.sleep(5.0)
-                
-                send_response = ""
-                max_attempts = 20
-                attempts = 0
-                
-                while attempts < max_attempts:
-                    if self.serial_connection.in_waiting > 0:
-                        data = self.serial_connection.read(self.serial_connection.in_waiting)
-                        send_response += data.decode('utf-8', errors='ignore')
-                        
-                        # Si tenemos respuesta completa, terminamos
-                        if "OK" in send_response or "ERROR" in send_response or "+CMS ERROR" in send_response:
-                            break
-                            
-                    await asyncio.sleep(0.2)
-                    attempts += 1
+            # CMGS → prompt → mensaje + Ctrl+Z → confirmación de envío
+            try:
+                send_response = (await self.modem.execute(
+                    f'AT+CMGS="{phone_number}"',
+                    body=clean_message,
+                    timeout=9.0,
+                    prompt_timeout=2.0,
+                    priority=PRIORITY_HIGH
+                )).text
+            except ATCommandError as e:
+                if "+CMS ERROR" not in e.response:
+                    raise
+                send_response = e.response
             
             # Extraer reference ID
             reference_id = None
@@ -3,11 +3,15 @@ Motor SMS Corregido - Solucionando problemas de envío
 Versión optimizada para el Huawei E8278
 """
 import asyncio
+import re
 import time
 import serial
 import logging
 from dataclasses import dataclass
 from typing import Optional
+from serial_transport import AsyncSerialTransport
+from at_multiplexer import ATCommandMultiplexer, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from message_normalizer import normalize_message, to_gsm_charset
 
 @dataclass
 class SMSResult:
@@ -20,6 +24,8 @@ class FixedSMSEngine:
     
     def __init__(self):
         self.serial_connection = None
+        self.transport: Optional[AsyncSerialTransport] = None
+        self.modem: Optional[ATCommandMultiplexer] = None
         self.is_connected = False
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(level=logging.INFO)
@@ -43,10 +49,16 @@ class FixedSMSEngine:
                 dsrdtr=False
             )
             
+            self.transport = AsyncSerialTransport(self.serial_connection)
+            
             # Limpiar buffer
-            self.serial_connection.reset_input_buffer()
+            self.transport.discard()
             self.serial_connection.reset_output_buffer()
             
+            # Un único dueño del puerto para comandos y URC
+            self.modem = ATCommandMultiplexer(self.transport, name=self.serial_connection.port)
+            await self.modem.start()
+            
             # Test de conectividad
             await self._send_command("AT")
             
@@ -58,7 +70,13 @@ class FixedSMSEngine:
             
         except Exception as e:
             self.logger.error(f"❌ Error conectando: {e}")
-            if self.serial_connection:
+            if self.modem:
+                await self.modem.stop()
+                self.modem = None
+            if self.transport:
+                self.transport.close()
+                self.transport = None
+            elif self.serial_connection:
                 self.serial_connection.close()
             raise
     
@@ -85,48 +103,29 @@ class FixedSMSEngine:
                 self.logger.warning(f"⚠️ {description}: {e}")
                 # Continuar con las demás configuraciones
     
-    async def _send_command(self, command: str, timeout: float = 5.0) -> str:
+    async def _send_command(self, command: str, timeout: float = 5.0,
+                            priority: int = PRIORITY_NORMAL) -> str:
         """Envía comando AT con timeout configurable"""
         
-        if not self.serial_connection:
+        if not self.modem:
             raise Exception("No hay conexión serial")
         
         try:
-            # Limpiar buffer de entrada
-            self.serial_connection.reset_input_buffer()
-            
-            # Enviar comando
-            full_command = command + '\r\n'
-            self.serial_connection.write(full_command.encode('utf-8'))
-            
-            # Leer respuesta con timeout
-            response = ""
-            start_time = time.time()
-            
-            while time.time() - start_time < timeout:
-                if self.serial_connection.in_waiting > 0:
-                    chunk = self.serial_connection.read(self.serial_connection.in_waiting)
-                    response += chunk.decode('utf-8', errors='ignore')
-                    
-                    # Verificar si la respuesta está completa
-                    if 'OK\r\n' in response or 'ERROR' in response or '+CMS ERROR:' in response or '+CME ERROR:' in response:
-                        break
-                
-                await asyncio.sleep(0.1)
-            
-            # Verificar errores
-            if 'ERROR' in response:
-                raise Exception(f"Comando falló: {command}\n{response}")
-            
-            if 'OK' not in response and command != "AT":
-                raise Exception(f"Respuesta incompleta: {command}\n{response}")
-            
-            return response
+            # El multiplexor espera el código final (OK / ERROR / +CMS ERROR / +CME ERROR)
+            response = await self.modem.execute(command, timeout=timeout, priority=priority)
+            return response.text
             
         except Exception as e:
             self.logger.error(f"❌ Error comando {command}: {e}")
             raise
     
+    def subscribe_urc(self, callback):
+        """Suscribe un callback a los códigos no solicitados (+CMT, +CDS, ...)"""
+        
+        if not self.modem:
+            raise Exception("No hay conexión serial")
+        return self.modem.subscribe(callback)
+    
     async def send_sms_fixed(self, phone_number: str, message: str) -> SMSResult:
         """Método de envío SMS corregido"""
         
@@ -155,106 +154,27 @@ class FixedSMSEngine:
     
     def _clean_message(self, message: str) -> str:
         """Limpia el mensaje para evitar problemas de codificación"""
-        
-        # Remover caracteres problemáticos
-        import unicodedata
-        
-        # Normalizar unicode
-        normalized = unicodedata.normalize('NFKD', message)
-        
-        # Convertir a ASCII ignorando caracteres especiales
-        ascii_message = normalized.encode('ascii', 'ignore').decode('ascii')
-        
-        # Mapear caracteres especiales comunes
-        replacements = {
-            'ñ': 'n', 'Ñ': 'N',
-            'á': 'a', 'é': 'e', 'í': 'i', 'ó': 'o', 'ú': 'u',
-            'Á': 'A', 'É': 'E', 'Í': 'I', 'Ó': 'O', 'Ú': 'U',
-            '🧪': 'TEST', '📱': '', '💬': '', '✅': 'OK', '❌': 'ERROR'
-        }
-        
-        clean_message = message
-        for original, replacement in replacements.items():
-            clean_message = clean_message.replace(original, replacement)
-        
-        # Limitar longitud
-        if len(clean_message) > 160:
-            clean_message = clean_message[:157] + "..."
-        
-        return clean_message
+        return normalize_message(message)
     
     async def _send_sms_improved(self, phone_number: str, message: str) -> Optional[str]:
         """Método mejorado de envío SMS"""
         
-        # Limpiar buffers
-        self.serial_connection.reset_input_buffer()
-        self.serial_connection.reset_output_buffer()
-        
-        # Paso 1: Enviar comando CMGS
-        cmgs_command = f'AT+CMGS="{phone_number}"'
-        self.serial_connection.write((cmgs_command + '\r').encode())
-        
-        # Paso 2: Esperar prompt '>' con timeout más largo
-        prompt_received = False
-        prompt_timeout = 15  # 15 segundos para el prompt
-        start_time = time.time()
-        response_buffer = ""
-        
-        while time.time() - start_time < prompt_timeout:
-            if self.serial_connection.in_waiting > 0:
-                chunk = self.serial_connection.read(self.serial_connection.in_waiting)
-                chunk_str = chunk.decode('utf-8', errors='ignore')
-                response_buffer += chunk_str
-                
-                self.logger.info(f"📥 Respuesta parcial: {repr(chunk_str)}")
-                
-                if '>' in response_buffer:
-                    prompt_received = True
-                    self.logger.info("✅ Prompt '>' recibido")
-                    break
-                
-                if 'ERROR' in response_buffer:
-                    raise Exception(f"Error en comando CMGS: {response_buffer}")
-            
-            await asyncio.sleep(0.2)
-        
-        if not prompt_received:
-            raise Exception(f"No se recibió prompt '>'. Respuesta: {response_buffer}")
-        
-        # Paso 3: Enviar mensaje con Ctrl+Z
-        message_with_ctrl_z = message + '\x1A'  # Ctrl+Z
-        self.serial_connection.write(message_with_ctrl_z.encode('utf-8', errors='ignore'))
-        
-        # Paso 4: Esperar confirmación
-        confirmation_timeout = 30  # 30 segundos para confirmación
-        start_time = time.time()
-        confirmation_buffer = ""
-        
-        while time.time() - start_time < confirmation_timeout:
-            if self.serial_connection.in_waiting > 0:
-                chunk = self.serial_connection.read(self.serial_connection.in_waiting)
-                chunk_str = chunk.decode('utf-8', errors='ignore')
-                confirmation_buffer += chunk_str
-                
-                self.logger.info(f"📥 Confirmación: {repr(chunk_str)}")
-                
-                # Buscar confirmación exitosa
-                if '+CMGS:' in confirmation_buffer:
-                    # Extraer referencia
-                    import re
-                    ref_match = re.search(r'\+CMGS:\s*(\d+)', confirmation_buffer)
-                    if ref_match:
-                        return ref_match.group(1)
-                    else:
-                        return "SUCCESS"
-                
-                # Verificar errores
-                if '+CMS ERROR:' in confirmation_buffer or '+CME ERROR:' in confirmation_buffer:
-                    raise Exception(f"Error SMS: {confirmation_buffer}")
-            
-            await asyncio.sleep(0.2)
+        # CMGS → prompt '>' (15 s) → mensaje + Ctrl+Z → confirmación (30 s)
+        response = await self.modem.execute(
+            f'AT+CMGS="{phone_number}"',
+            body=to_gsm_charset(message),
+            timeout=30,
+            prompt_timeout=15,
+            priority=PRIORITY_HIGH
+        )
+        self.logger.info(f"📥 Confirmación: {repr(response.text)}")
         
-        raise Exception(f"Timeout esperando confirmación. Buffer: {confirmation_buffer}")
+        # Extraer referencia
+        ref_match = re.search(r'\+CMGS:\s*(\d+)', response.text)
+        if ref_match:
+            return ref_match.group(1)
+        else:
+            return "SUCCESS"
     
     async def get_network_info(self):
         """Obtiene información de red"""
@@ -263,14 +183,14 @@ class FixedSMSEngine:
             info = {}
             
             # Operador
-            operator_response = await self._send_command("AT+COPS?")
+            operator_response = await self._send_command("AT+COPS?", priority=PRIORITY_LOW)
             if '+COPS:' in operator_response:
                 parts = operator_response.split(',')
                 if len(parts) >= 3:
                     info['operator'] = parts[2].strip().strip('"')
             
             # Señal
-            signal_response = await self._send_command("AT+CSQ")
+            signal_response = await self._send_command("AT+CSQ", priority=PRIORITY_LOW)
             if '+CSQ:' in signal_response:
                 signal_part = signal_response.split('+CSQ:')[1].split(',')[0].strip()
                 info['signal_strength'] = signal_part
@@ -284,12 +204,15 @@ class FixedSMSEngine:
     async def disconnect(self):
         """Desconecta del gateway"""
         
-        if self.serial_connection:
-            try:
-                self.serial_connection.close()
-                self.logger.info("🔌 Gateway desconectado")
-            except:
-                pass
+        if self.modem:
+            await self.modem.stop()
+            self.modem = None
+        
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+            self.serial_connection = None
+            self.logger.info("🔌 Gateway desconectado")
         
         self.is_connected = False
 
@@ -8,6 +8,8 @@ import logging
 import re
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
+from serial_transport import AsyncSerialTransport
+from at_multiplexer import ATCommandMultiplexer, ATCommandError, PRIORITY_HIGH
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +27,8 @@ class SMSEngine:
     
     def __init__(self):
         self.serial_connection: Optional[serial.Serial] = None
+        self.transport: Optional[AsyncSerialTransport] = None
+        self.modem: Optional[ATCommandMultiplexer] = None
         self.is_connected = False
         self.port = "/dev/ttyUSB0"
         self.baudrate = 9600
@@ -36,14 +40,17 @@ class SMSEngine:
             logger.info(f"🔌 Conectando a {self.port} @ {self.baudrate} bps")
             
             # Cerrar conexión existente si la hay
-            if self.serial_connection and self.serial_connection.is_open:
-                self.serial_connection.close()
+            if self.transport:
+                self.transport.close()
             
             self.serial_connection = serial.Serial(
                 port=self.port,
                 baudrate=self.baudrate,
                 timeout=self.timeout
             )
+            self.transport = AsyncSerialTransport(self.serial_connection)
+            self.modem = ATCommandMultiplexer(self.transport, name=self.serial_connection.port)
+            await self.modem.start()
             
             # Esperar estabilización
             await asyncio.sleep(2)
@@ -60,16 +67,24 @@ class SMSEngine:
         except Exception as e:
             logger.error(f"❌ Error conectando: {e}")
             self.is_connected = False
-            if self.serial_connection and self.serial_connection.is_open:
-                self.serial_connection.close()
-                self.serial_connection = None
+            if self.modem:
+                await self.modem.stop()
+                self.modem = None
+            if self.transport:
+                self.transport.close()
+                self.transport = None
+            self.serial_connection = None
             return False
     
     async def disconnect(self):
         """Desconecta del gateway"""
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
+        if self.modem:
+            await self.modem.stop()
+        if self.transport:
+            self.transport.close()
         self.is_connected = False
+        self.modem = None
+        self.transport = None
         self.serial_connection = None
         logger.info("🔌 Gateway desconectado")
     
@@ -91,41 +106,17 @@ class SMSEngine:
     
     async def _send_command(self, command: str, wait_time: float = 2) -> str:
         """Envía comando AT y espera respuesta"""
-        if not self.serial_connection or not self.serial_connection.is_open:
+        if not self.modem or not self.transport.is_open:
             raise Exception("No hay conexión serial")
         
         try:
-            # Limpiar buffer
-            self.serial_connection.reset_input_buffer()
-            
-            # Enviar comando
-            cmd = f"{command}\r\n"
-            self.serial_connection.write(cmd.encode())
             logger.debug(f"📤 {command}")
             
-            # Esperar respuesta
-            await asyncio.sleep(wait_time)
-            
-            response = ""
-            attempts = 0
-            max_attempts = 20
-            
-            while attempts < max_attempts:
-                if self.serial_connection.in_waiting > 0:
-                    data = self.serial_connection.read(self.serial_connection.in_waiting)
-                    response += data.decode('utf-8', errors='ignore')
-                    
-                    if "OK" in response or "ERROR" in response or "+CMS ERROR" in response:
-                        break
-                        
-                await asyncio.sleep(0.1)
-                attempts += 1
+            # El multiplexor termina en cuanto llega el código final
+            response = (await self.modem.execute(command, timeout=wait_time + 2)).text
             
             logger.debug(f"📥 {response.strip()}")
             
-            if "ERROR" in response or "+CMS ERROR" in response:
-                raise Exception(f"Comando falló: {response.strip()}")
-            
             return response.strip()
             
         except Exception as e:
@@ -145,33 +136,19 @@ class SMSEngine:
             
             logger.info(f"📤 Enviando SMS a {phone_number}: {clean_msg}")
             
-            # Comando para iniciar SMS
-            response = await self._send_command(f'AT+CMGS="{phone_number}"', 1)
-            
-            if ">" not in response:
-                raise Exception("No se recibió prompt (>) para el mensaje")
-            
-            # Enviar mensaje + Ctrl+Z
-            self.serial_connection.write(clean_msg.encode('ascii'))
-            self.serial_connection.write(bytes([26]))  # Ctrl+Z
-            
-            # Esperar confirmación
-            await asyncio.sleep(5)
-            
-            send_response = ""
-            attempts = 0
-            max_attempts = 30
-            
-            while attempts < max_attempts:
-                if self.serial_connection.in_waiting > 0:
-                    data = self.serial_connection.read(self.serial_connection.in_waiting)
-                    send_response += data.decode('utf-8', errors='ignore')
-                    
-                    if "OK" in send_response or "ERROR" in send_response or "+CMS ERROR" in send_response:
-                        break
-                        
-                await asyncio.sleep(0.2)
-                attempts += 1
+            # CMGS → prompt (>) → mensaje + Ctrl+Z → confirmación
+            try:
+                send_response = (await self.modem.execute(
+                    f'AT+CMGS="{phone_number}"',
+                    body=clean_msg,
+                    timeout=11,
+                    prompt_timeout=3,
+                    priority=PRIORITY_HIGH
+                )).text
+            except ATCommandError as e:
+                if "+CMS ERROR" not in e.response:
+                    raise
+                send_response = e.response
             
             # Extraer referencia
             reference_id = None
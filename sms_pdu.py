@@ -0,0 +1,459 @@
+"""
+Codificador/Decodificador PDU (GSM 03.40 / 03.38)
+SMS-SUBMIT con alfabeto GSM-7 o UCS-2 y concatenación por UDH, y lectura
+de SMS-DELIVER / SMS-STATUS-REPORT recibidos en modo PDU (AT+CMGF=0)
+"""
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Alfabeto por defecto GSM 03.38 (posición = septeto)
+GSM7_BASIC = (
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+
+# Tabla de extensión: se envían como ESC + septeto
+GSM7_EXTENSION = {
+    '\f': 0x0A, '^': 0x14, '{': 0x28, '}': 0x29, '\\': 0x2F,
+    '[': 0x3C, '~': 0x3D, ']': 0x3E, '|': 0x40, '€': 0x65,
+}
+
+ESCAPE = 0x1B
+
+# Capacidad por segmento (septetos GSM-7 / unidades UTF-16)
+GSM7_SINGLE = 160
+GSM7_MULTIPART = 153
+UCS2_SINGLE = 70
+UCS2_MULTIPART = 67
+
+# Tablas precalculadas ------------------------------------------------------
+
+GSM7_CHARSET = frozenset(GSM7_BASIC.replace('\x1b', '')) | frozenset(GSM7_EXTENSION)
+GSM7_EXTENDED_CHARS = frozenset(GSM7_EXTENSION)
+
+# Carácter -> bits de sus septetos, en orden inverso (el septeto i ocupa los
+# bits 7i..7i+6 del entero empaquetado), para empaquetar con un solo
+# str.translate + int(bits, 2) en lugar de desplazar septeto por septeto
+_PACK_TABLE = {ord(ch): format(i, '07b') for i, ch in enumerate(GSM7_BASIC) if i != ESCAPE}
+_PACK_TABLE.update({
+    ord(ch): format(code, '07b') + format(ESCAPE, '07b')
+    for ch, code in GSM7_EXTENSION.items()
+})
+
+_DECODE_BASIC = {i: ch for i, ch in enumerate(GSM7_BASIC)}
+_DECODE_EXTENSION = {code: ch for ch, code in GSM7_EXTENSION.items()}
+
+STATUS_NAMES = {0: 'REC UNREAD', 1: 'REC READ', 2: 'STO UNSENT', 3: 'STO SENT'}
+
+# Referencia de concatenación (8 bits) compartida por el proceso
+_concat_references = itertools.cycle(range(256))
+
+class PDUError(ValueError):
+    """PDU mal formado o no soportado"""
+    pass
+
+# ---------------------------------------------------------------------------
+# Alfabetos
+# ---------------------------------------------------------------------------
+
+def is_gsm7(text: str) -> bool:
+    """True si todo el texto se puede enviar con el alfabeto GSM-7"""
+    return set(text) <= GSM7_CHARSET
+
+def gsm7_length(text: str) -> int:
+    """Septetos que ocupa el texto (los caracteres de extensión cuentan doble)"""
+    extended = GSM7_EXTENDED_CHARS.intersection(text)
+    return len(text) + sum(text.count(ch) for ch in extended)
+
+def pack_gsm7(text: str, fill_bits: int = 0) -> bytes:
+    """Empaqueta texto GSM-7 en octetos, con `fill_bits` de relleno al inicio"""
+
+    if not text:
+        return b''
+    bits = text[::-1].translate(_PACK_TABLE)
+    total_bits = len(bits) + fill_bits
+    return (int(bits, 2) << fill_bits).to_bytes((total_bits + 7) // 8, 'little')
+
+def unpack_gsm7(data: bytes, septets: int, fill_bits: int = 0) -> str:
+    """Desempaqueta `septets` caracteres GSM-7 (resolviendo la tabla de extensión)"""
+
+    value = int.from_bytes(data, 'little') >> fill_bits
+    chars = []
+    escaped = False
+    for _ in range(septets):
+        code = value & 0x7F
+        value >>= 7
+        if escaped:
+            chars.append(_DECODE_EXTENSION.get(code, ' '))
+            escaped = False
+        elif code == ESCAPE:
+            escaped = True
+        else:
+            chars.append(_DECODE_BASIC[code])
+    return ''.join(chars)
+
+def decode_gsm_charset(data: bytes) -> str:
+    """Texto en el juego "GSM" de AT+CSCS (un septeto por byte, sin empaquetar)"""
+
+    chars = []
+    escaped = False
+    for code in data:
+        code &= 0x7F
+        if escaped:
+            chars.append(_DECODE_EXTENSION.get(code, ' '))
+            escaped = False
+        elif code == ESCAPE:
+            escaped = True
+        else:
+            chars.append(_DECODE_BASIC[code])
+    return ''.join(chars)
+
+def _split_gsm7(text: str, limit: int) -> List[str]:
+    """Corta en trozos de `limit` septetos sin separar ESC de su carácter"""
+
+    if not GSM7_EXTENDED_CHARS.intersection(text):
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+
+    parts = []
+    start = used = 0
+    for i, ch in enumerate(text):
+        size = 2 if ch in GSM7_EXTENDED_CHARS else 1
+        if used + size > limit:
+            parts.append(text[start:i])
+            start, used = i, 0
+        used += size
+    parts.append(text[start:])
+    return parts
+
+def _split_ucs2(data: bytes, limit: int) -> List[bytes]:
+    """Corta UTF-16-BE en trozos de `limit` unidades sin partir pares sustitutos"""
+
+    parts = []
+    step = limit * 2
+    start = 0
+    while start < len(data):
+        end = min(start + step, len(data))
+        if end < len(data) and 0xD8 <= data[end - 2] <= 0xDB:
+            end -= 2  # El trozo terminaría en la primera mitad de un emoji
+        parts.append(data[start:end])
+        start = end
+    return parts
+
+def segment_info(text: str) -> Tuple[str, int]:
+    """('gsm7' | 'ucs2', cantidad de segmentos) que ocupará el texto"""
+
+    if is_gsm7(text):
+        length = gsm7_length(text)
+        if length <= GSM7_SINGLE:
+            return 'gsm7', 1
+        return 'gsm7', len(_split_gsm7(text, GSM7_MULTIPART))
+
+    data = text.encode('utf-16-be')
+    if len(data) <= UCS2_SINGLE * 2:
+        return 'ucs2', 1
+    return 'ucs2', len(_split_ucs2(data, UCS2_MULTIPART))
+
+# ---------------------------------------------------------------------------
+# Direcciones y fechas (semi-octetos)
+# ---------------------------------------------------------------------------
+
+def _encode_semi_octets(digits: str) -> bytes:
+    if len(digits) % 2:
+        digits += 'F'
+    return bytes.fromhex(''.join(digits[i + 1] + digits[i] for i in range(0, len(digits), 2)))
+
+def _decode_semi_octets(data: bytes) -> str:
+    swapped = ''.join(f"{byte & 0x0F:X}{byte >> 4:X}" for byte in data)
+    return swapped.rstrip('F')
+
+def encode_address(number: str) -> bytes:
+    """Número destino: largo en dígitos + tipo (0x91 internacional / 0x81) + semi-octetos"""
+
+    international = number.startswith('+')
+    digits = ''.join(ch for ch in number if ch.isdigit())
+    if not digits:
+        raise PDUError(f"Número inválido: {number}")
+    return bytes([len(digits), 0x91 if international else 0x81]) + _encode_semi_octets(digits)
+
+def _decode_address(pdu: bytes, pos: int) -> Tuple[str, int]:
+    """Devuelve (número, posición siguiente)"""
+
+    length = pdu[pos]
+    toa = pdu[pos + 1]
+    size = (length + 1) // 2
+    data = pdu[pos + 2:pos + 2 + size]
+
+    if toa & 0x70 == 0x50:
+        # Alfanumérico (p.ej. remitentes de operador): GSM-7 empaquetado
+        number = unpack_gsm7(data, length * 4 // 7)
+    else:
+        number = _decode_semi_octets(data)[:length]
+        if toa & 0x70 == 0x10:
+            number = '+' + number
+
+    return number, pos + 2 + size
+
+def _decode_timestamp(data: bytes) -> str:
+    """SCTS -> 'yy/MM/dd,hh:mm:ss±zz' (mismo formato que el modo texto)"""
+
+    digits = _decode_semi_octets(data[:6]).ljust(12, '0')
+    tz = data[6]
+    quarters = (tz & 0x07) * 10 + (tz >> 4)
+    sign = '-' if tz & 0x08 else '+'
+    return (f"{digits[0:2]}/{digits[2:4]}/{digits[4:6]},"
+            f"{digits[6:8]}:{digits[8:10]}:{digits[10:12]}{sign}{quarters:02d}")
+
+# ---------------------------------------------------------------------------
+# SMS-SUBMIT
+# ---------------------------------------------------------------------------
+
+@dataclass
+class SubmitPDU:
+    """Un segmento listo para AT+CMGS=<tpdu_length> en modo PDU"""
+    hex: str
+    tpdu_length: int          # Octetos sin contar el SMSC
+    part: int = 1
+    total: int = 1
+    encoding: str = 'gsm7'
+
+def _concat_header(reference: int, total: int, sequence: int) -> bytes:
+    # UDHL=5, IE 0x00 (concatenación, referencia de 8 bits), largo 3
+    return bytes([5, 0x00, 3, reference & 0xFF, total, sequence])
+
+def encode_submit(number: str, text: str, reference: Optional[int] = None,
+                  status_report: bool = False, validity: int = 0xA7) -> List[SubmitPDU]:
+    """Codifica un mensaje (de cualquier largo) en uno o más SMS-SUBMIT
+
+    Usa GSM-7 si todos los caracteres están en el alfabeto y UCS-2 si no.
+    Los mensajes largos se parten con UDH de concatenación; `reference`
+    identifica al grupo (por defecto, el siguiente de un contador 0-255).
+    """
+
+    address = encode_address(number)
+    gsm7 = is_gsm7(text)
+
+    if gsm7:
+        chunks = [text] if gsm7_length(text) <= GSM7_SINGLE else _split_gsm7(text, GSM7_MULTIPART)
+    else:
+        data = text.encode('utf-16-be')
+        chunks = [data] if len(data) <= UCS2_SINGLE * 2 else _split_ucs2(data, UCS2_MULTIPART)
+
+    total = len(chunks)
+    if total > 255:
+        raise PDUError("Mensaje demasiado largo (más de 255 segmentos)")
+    if total > 1 and reference is None:
+        reference = next(_concat_references)
+
+    # SMS-SUBMIT, validez relativa (como AT+CSMP=17,...), reporte de entrega opcional
+    first_octet = 0x11 | (0x20 if status_report else 0) | (0x40 if total > 1 else 0)
+    dcs = 0x00 if gsm7 else 0x08
+
+    pdus = []
+    for sequence, chunk in enumerate(chunks, start=1):
+        udh = _concat_header(reference, total, sequence) if total > 1 else b''
+
+        if gsm7:
+            fill_bits = (7 - (len(udh) * 8) % 7) % 7 if udh else 0
+            user_data = udh + pack_gsm7(chunk, fill_bits)
+            udl = (len(udh) * 8 + fill_bits) // 7 + gsm7_length(chunk)
+        else:
+            user_data = udh + chunk
+            udl = len(user_data)
+
+        tpdu = bytes([first_octet, 0x00]) + address + bytes([0x00, dcs, validity, udl]) + user_data
+        pdus.append(SubmitPDU(
+            # '00': usar el SMSC configurado con AT+CSCA
+            hex='00' + tpdu.hex().upper(),
+            tpdu_length=len(tpdu),
+            part=sequence,
+            total=total,
+            encoding='gsm7' if gsm7 else 'ucs2'
+        ))
+
+    return pdus
+
+# ---------------------------------------------------------------------------
+# Lectura de PDU recibidos
+# ---------------------------------------------------------------------------
+
+@dataclass
+class ConcatInfo:
+    reference: int
+    total: int
+    sequence: int
+
+@dataclass
+class DecodedSMS:
+    kind: str                                   # 'deliver' | 'submit' | 'status_report'
+    number: str                                 # Remitente / destinatario
+    text: str = ''
+    timestamp: Optional[str] = None             # SCTS en formato 'yy/MM/dd,hh:mm:ss±zz'
+    encoding: str = 'gsm7'
+    concat: Optional[ConcatInfo] = None
+    message_reference: Optional[int] = None     # TP-MR (submit / reporte de entrega)
+    discharge_time: Optional[str] = None        # Reporte de entrega
+    status: Optional[int] = None                # TP-ST del reporte de entrega
+
+def _alphabet(dcs: int) -> str:
+    group = dcs & 0xF0
+    if dcs & 0xC0 == 0x00:
+        return ('gsm7', '8bit', 'ucs2', 'gsm7')[(dcs >> 2) & 0x03]
+    if group == 0xF0:
+        return '8bit' if dcs & 0x04 else 'gsm7'
+    if group == 0xE0:
+        return 'ucs2'
+    return 'gsm7'
+
+def _parse_udh(header: bytes) -> Optional[ConcatInfo]:
+    pos = 0
+    while pos + 1 < len(header):
+        iei, length = header[pos], header[pos + 1]
+        value = header[pos + 2:pos + 2 + length]
+        if iei == 0x00 and length == 3:
+            return ConcatInfo(reference=value[0], total=value[1], sequence=value[2])
+        if iei == 0x08 and length == 4:
+            return ConcatInfo(reference=(value[0] << 8) | value[1], total=value[2], sequence=value[3])
+        pos += 2 + length
+    return None
+
+def _decode_user_data(pdu: bytes, pos: int, dcs: int, udhi: bool,
+                      sms: DecodedSMS) -> DecodedSMS:
+    udl = pdu[pos]
+    user_data = pdu[pos + 1:]
+    alphabet = _alphabet(dcs)
+    sms.encoding = alphabet
+
+    header_octets = 0
+    if udhi and user_data:
+        header_octets = user_data[0] + 1
+        sms.concat = _parse_udh(user_data[1:header_octets])
+
+    if alphabet == 'gsm7':
+        fill_bits = (7 - (header_octets * 8) % 7) % 7 if header_octets else 0
+        header_septets = (header_octets * 8 + fill_bits) // 7
+        sms.text = unpack_gsm7(user_data[header_octets:], udl - header_septets, fill_bits)
+    else:
+        body = user_data[header_octets:udl]
+        if alphabet == 'ucs2':
+            sms.text = body.decode('utf-16-be', errors='replace')
+        else:
+            sms.text = body.decode('latin-1')
+
+    return sms
+
+def decode_pdu(pdu_hex: str) -> DecodedSMS:
+    """Decodifica un PDU de +CMGL / +CMGR / +CMT / +CDS (con prefijo SMSC)"""
+
+    try:
+        pdu = bytes.fromhex(pdu_hex.strip())
+        pos = 1 + pdu[0]                    # Saltar SMSC
+        first_octet = pdu[pos]
+        mti = first_octet & 0x03
+        udhi = bool(first_octet & 0x40)
+        pos += 1
+
+        if mti == 0x00:
+            # SMS-DELIVER
+            number, pos = _decode_address(pdu, pos)
+            dcs = pdu[pos + 1]
+            timestamp = _decode_timestamp(pdu[pos + 2:pos + 9])
+            sms = DecodedSMS(kind='deliver', number=number, timestamp=timestamp)
+            return _decode_user_data(pdu, pos + 9, dcs, udhi, sms)
+
+        if mti == 0x01:
+            # SMS-SUBMIT guardado (STO SENT / STO UNSENT)
+            reference = pdu[pos]
+            number, pos = _decode_address(pdu, pos + 1)
+            dcs = pdu[pos + 1]
+            vpf = (first_octet >> 3) & 0x03
+            pos += 2 + {0: 0, 2: 1}.get(vpf, 7)
+            sms = DecodedSMS(kind='submit', number=number, message_reference=reference)
+            return _decode_user_data(pdu, pos, dcs, udhi, sms)
+
+        if mti == 0x02:
+            # SMS-STATUS-REPORT
+            reference = pdu[pos]
+            number, pos = _decode_address(pdu, pos + 1)
+            return DecodedSMS(
+                kind='status_report',
+                number=number,
+                timestamp=_decode_timestamp(pdu[pos:pos + 7]),
+                discharge_time=_decode_timestamp(pdu[pos + 7:pos + 14]),
+                status=pdu[pos + 14],
+                message_reference=reference
+            )
+
+    except (ValueError, IndexError) as e:
+        raise PDUError(f"PDU inválido: {e}")
+
+    raise PDUError(f"Tipo de PDU no soportado (MTI={mti})")
+
+# ---------------------------------------------------------------------------
+# Reensamblado de mensajes concatenados
+# ---------------------------------------------------------------------------
+
+@dataclass
+class _PartialMessage:
+    total: int
+    parts: Dict[int, DecodedSMS] = field(default_factory=dict)
+    first_seen: float = field(default_factory=time.monotonic)
+
+class ConcatReassembler:
+    """Junta los segmentos de un mensaje largo (clave: remitente + referencia)"""
+
+    def __init__(self, max_age: float = 3600.0):
+        self.max_age = max_age
+        self._pending: Dict[Tuple[str, int, int], _PartialMessage] = {}
+
+    def add(self, sms: DecodedSMS) -> Optional[DecodedSMS]:
+        """Devuelve el mensaje completo cuando llega el último segmento"""
+
+        if sms.concat is None or sms.concat.total <= 1:
+            return sms
+
+        key = (sms.number, sms.concat.reference, sms.concat.total)
+        partial = self._pending.setdefault(key, _PartialMessage(total=sms.concat.total))
+        partial.parts[sms.concat.sequence] = sms
+
+        if len(partial.parts) < partial.total:
+            return None
+
+        del self._pending[key]
+        return self._merge(partial)
+
+    @staticmethod
+    def _merge(partial: _PartialMessage) -> DecodedSMS:
+        ordered = [partial.parts[i] for i in sorted(partial.parts)]
+        first = ordered[0]
+        return DecodedSMS(
+            kind=first.kind,
+            number=first.number,
+            text=''.join(part.text for part in ordered),
+            timestamp=first.timestamp,
+            encoding=first.encoding,
+            concat=ConcatInfo(reference=first.concat.reference, total=partial.total, sequence=0)
+        )
+
+    def expire(self) -> List[DecodedSMS]:
+        """Descarta y devuelve los segmentos de mensajes que nunca se completaron"""
+
+        now = time.monotonic()
+        expired = []
+        for key, partial in list(self._pending.items()):
+            if now - partial.first_seen > self.max_age:
+                expired.extend(partial.parts[i] for i in sorted(partial.parts))
+                del self._pending[key]
+        return expired
+
+    def flush(self) -> List[DecodedSMS]:
+        """Entrega lo que haya de cada mensaje incompleto y vacía el estado"""
+
+        merged = [self._merge(partial) for partial in self._pending.values()]
+        self._pending.clear()
+        return merged
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,35 @@
+"""
+Perfil de SQLite para Concurrencia
+PRAGMAs que se aplican a cada conexión nueva, tanto de SQLAlchemy
+(database.py) como de sqlite3 directo (message_store.py)
+"""
+import sqlite3
+from typing import Any, Dict
+
+SQLITE_PROFILE: Dict[str, Any] = {
+    'journal_mode': 'WAL',      # Los lectores no bloquean al escritor ni al revés
+    'synchronous': 'NORMAL',    # Con WAL: fsync en cada checkpoint, no en cada commit
+    'busy_timeout': 5000,       # ms esperando el lock antes de "database is locked"
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+def apply_profile(connection: sqlite3.Connection, **overrides) -> Dict[str, Any]:
+    """Aplica el perfil (con `overrides`) a una conexión DB-API de SQLite
+
+        apply_profile(conn)                       # perfil por defecto
+        apply_profile(conn, synchronous='FULL')   # sin perder el último commit ante un corte
+
+    Devuelve los valores que SQLite informa después de aplicarlos (una base
+    en memoria, por ejemplo, queda en journal_mode 'memory').
+    """
+    pragmas = {**SQLITE_PROFILE, **overrides}
+    applied = {}
+    cursor = connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+            row = cursor.execute(f"PRAGMA {name}").fetchone()
+            applied[name] = row[0] if row else None
+    finally:
+        cursor.close()
+    return applied
@@ -0,0 +1,257 @@
+"""
+Ingesta Incremental de la Memoria del Módem
+Lista sólo lo no leído, lo guarda en forma durable y recién entonces lo
+borra con AT+CMGD: cada lectura trae sólo lo nuevo (aunque no se borre) y
+la recepción no se detiene cuando el almacenamiento se llena. Los
+borradores y enviados guardados en la SIM nunca se tocan
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from at_multiplexer import ATCommandError, ATCommandMultiplexer, PRIORITY_LOW
+from inbound_index import InboundIndex, message_key
+from message_store import MessageStore
+from metrics import INBOUND_MESSAGES
+from sms_pdu import ConcatReassembler, DecodedSMS, PDUError, STATUS_NAMES, decode_pdu
+
+logger = logging.getLogger(__name__)
+
+# Sólo mensajes recibidos; STO UNSENT / STO SENT (2, 3) son del usuario
+INBOUND_STATUSES = ('REC UNREAD', 'REC READ')
+_INBOUND_PDU_STATUSES = ('0', '1')
+
+@dataclass
+class StorageStatus:
+    storage: str
+    used: int
+    total: int
+
+    @property
+    def fill(self) -> float:
+        return self.used / self.total if self.total else 0.0
+
+async def read_storage_status(modem: ATCommandMultiplexer) -> Optional[StorageStatus]:
+    """AT+CPMS? -> ocupación de la memoria de lectura (<mem1>)"""
+
+    # +CPMS: "ME",3,23,"ME",3,23,"ME",3,23
+    response = await modem.execute("AT+CPMS?", priority=PRIORITY_LOW)
+    for record in response.records_named('+CPMS'):
+        params = record.params
+        if len(params) >= 3 and params[1].isdigit() and params[2].isdigit():
+            return StorageStatus(storage=params[0], used=int(params[1]), total=int(params[2]))
+    return None
+
+async def list_stored(modem: ATCommandMultiplexer, pdu_mode: bool = False,
+                      unread_only: bool = False) -> List[Dict]:
+    """Lista los mensajes recibidos (AT+CMGL) como dicts con índice, remitente y texto
+
+    Con `unread_only` pide sólo "REC UNREAD" (`=0` en PDU), que el módem
+    marca como leídos al listarlos. En modo PDU une los segmentos de
+    mensajes largos; los incompletos se devuelven con `complete=False` y
+    los índices que sí llegaron.
+    """
+    if pdu_mode:
+        return await _list_stored_pdu(modem, unread_only)
+
+    # +CMGL: <index>,<stat>,<oa>,<alpha>,<scts> seguido del texto
+    selector = '"REC UNREAD"' if unread_only else '"ALL"'
+    response = await modem.execute(f'AT+CMGL={selector}', timeout=10, priority=PRIORITY_LOW)
+    messages = []
+
+    for record in response.records_named('+CMGL'):
+        params = record.params
+        if len(params) >= 3 and params[1] in INBOUND_STATUSES:
+            messages.append({
+                'index': params[0],
+                'indices': [params[0]],
+                'status': params[1],
+                'sender': params[2],
+                'timestamp': params[4] if len(params) >= 5 else None,
+                'content': record.body or '',
+                'complete': True,
+                'raw': record.line
+            })
+
+    return messages
+
+async def _list_stored_pdu(modem: ATCommandMultiplexer, unread_only: bool = False) -> List[Dict]:
+    # +CMGL: <index>,<stat>,<alpha>,<length> seguido del PDU
+    response = await modem.execute(f'AT+CMGL={0 if unread_only else 4}', timeout=10, priority=PRIORITY_LOW)
+
+    reassembler = ConcatReassembler()
+    groups: Dict[Tuple, List] = {}
+    messages = []
+
+    def entry(sms: DecodedSMS, records, complete: bool = True) -> Dict:
+        params = records[0].params
+        return {
+            'index': params[0],
+            'indices': [record.params[0] for record in records],
+            'status': STATUS_NAMES.get(int(params[1]), params[1]) if params[1].isdigit() else params[1],
+            'sender': sms.number,
+            'timestamp': sms.timestamp,
+            'content': sms.text,
+            'complete': complete,
+            'concat_reference': sms.concat.reference if sms.concat else None,
+            'raw': records[0].line
+        }
+
+    for record in response.records_named('+CMGL'):
+        if len(record.params) < 2 or not record.body or record.params[1] not in _INBOUND_PDU_STATUSES:
+            continue
+        try:
+            sms = decode_pdu(record.body)
+        except PDUError as e:
+            logger.warning(f"⚠️ PDU ilegible en índice {record.params[0]}: {e}")
+            continue
+        if sms.kind != 'deliver':
+            continue
+
+        key = (sms.number, sms.concat.reference, sms.concat.total) if sms.concat else None
+        records = groups.setdefault(key, []) if key else []
+        records.append(record)
+
+        complete = reassembler.add(sms)
+        if complete is not None:
+            messages.append(entry(complete, groups.pop(key) if key else records))
+
+    # Mensajes largos a los que aún les faltan segmentos
+    for partial in reassembler.flush():
+        key = (partial.number, partial.concat.reference, partial.concat.total)
+        messages.append(entry(partial, groups.pop(key), complete=False))
+
+    return messages
+
+class StoreIngester:
+    """Lee, guarda y borra la memoria del módem de un motor
+
+        ingester = StoreIngester(engine, MessageStore())
+        nuevos = await ingester.sweep()    # al conectar y en cada +CMTI
+
+    `engine` sólo necesita `.modem` (multiplexor) y opcionalmente
+    `.pdu_mode`. Cada pasada lista sólo lo no leído; la memoria completa se
+    relee al conectar, mientras haya un mensaje largo incompleto y después
+    de un guardado fallido (lo listado ya quedó marcado como leído). Un
+    mensaje se borra únicamente después de que `store` lo guardó; si el
+    guardado falla queda en el módem para la próxima pasada. Los segmentos
+    de un mensaje largo incompleto se dejan en la memoria hasta que llega
+    el resto o pasan `partial_timeout` segundos.
+    """
+
+    def __init__(self, engine: Any, store: Optional[MessageStore] = None,
+                 delete_after_read: bool = True, capacity_warning: float = 0.8,
+                 partial_timeout: float = 3600.0):
+        self.engine = engine
+        self.store = store or MessageStore()
+        self.delete_after_read = delete_after_read
+        self.capacity_warning = capacity_warning
+        self.partial_timeout = partial_timeout
+        self.inbound = InboundIndex()
+        self.storage: Optional[StorageStatus] = None
+        self.stats = {'sweeps': 0, 'full_listings': 0, 'ingested': 0, 'deleted': 0, 'delete_errors': 0}
+        self._partial_since: Dict[Tuple, float] = {}
+        self._full_listing = True     # La primera pasada relee todo lo recibido
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def sweep(self) -> List[Dict]:
+        """Una pasada completa; devuelve los mensajes que no se habían guardado antes"""
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            modem = self.engine.modem
+            full, self._full_listing = self._full_listing, True   # Hasta guardar: lo listado ya figura como leído
+            entries = await list_stored(modem, getattr(self.engine, 'pdu_mode', False), unread_only=not full)
+            if full:
+                self.stats['full_listings'] += 1
+            ready = self._ready(entries)
+
+            # Filtro en memoria antes de la base: sin borrado, lo ya visto no vuelve a escribirse
+            keys = [message_key(entry['sender'], entry.get('timestamp'), entry.get('index'),
+                                entry['content']) for entry in ready]
+            fresh = [entry for key, entry in zip(keys, ready) if key not in self.inbound]
+
+            # Si el guardado falla no se marca ni se borra nada
+            loop = asyncio.get_running_loop()
+            new = await loop.run_in_executor(None, self.store.save_received, fresh)
+            for key in keys:
+                self.inbound.add(key)
+
+            if self.delete_after_read:
+                deleted = await self._delete(modem, [index for entry in ready for index in entry['indices']])
+                # El módem reutiliza los índices borrados: otro SMS del mismo remitente en el
+                # mismo segundo tendría la misma clave y se descartaría sin guardarse
+                for key, entry in zip(keys, ready):
+                    if all(index in deleted for index in entry['indices']):
+                        self.inbound.discard(key)
+
+            # Los segmentos ya leídos de un mensaje incompleto sólo vuelven en una lectura completa
+            self._full_listing = bool(self._partial_since)
+
+            await self._check_capacity(modem)
+            self.stats['sweeps'] += 1
+            self.stats['ingested'] += len(new)
+            if new:
+                INBOUND_MESSAGES.inc(modem.name, amount=len(new))
+            return new
+
+    def _ready(self, entries: List[Dict]) -> List[Dict]:
+        now = time.monotonic()
+        ready = []
+        waiting = set()
+
+        for entry in entries:
+            if entry.get('complete', True):
+                ready.append(entry)
+                continue
+
+            key = (entry['sender'], entry.get('concat_reference'))
+            since = self._partial_since.setdefault(key, now)
+            if now - since >= self.partial_timeout:
+                logger.warning(f"⚠️ Mensaje de {entry['sender']} incompleto tras "
+                               f"{self.partial_timeout:.0f} s, se guarda lo recibido")
+                ready.append(entry)
+            else:
+                waiting.add(key)
+
+        # Olvidar los parciales que ya no están en la memoria
+        for key in list(self._partial_since):
+            if key not in waiting:
+                del self._partial_since[key]
+        return ready
+
+    async def _delete(self, modem: ATCommandMultiplexer, indices: List[str]) -> Set[str]:
+        """Borra los índices; devuelve los que se borraron"""
+        deleted = set()
+        for index in indices:
+            try:
+                await modem.execute(f"AT+CMGD={index}", priority=PRIORITY_LOW)
+                self.stats['deleted'] += 1
+                deleted.add(index)
+            except ATCommandError as e:
+                # Queda en la memoria; la próxima pasada lo relee y la base lo ignora
+                self.stats['delete_errors'] += 1
+                logger.warning(f"⚠️ No se pudo borrar el índice {index}: {e}")
+        return deleted
+
+    async def _check_capacity(self, modem: ATCommandMultiplexer):
+        try:
+            self.storage = await read_storage_status(modem)
+        except ATCommandError as e:
+            logger.debug(f"AT+CPMS? no disponible: {e}")
+            return
+
+        if self.storage and self.storage.fill >= self.capacity_warning:
+            logger.warning(f"⚠️ Memoria {self.storage.storage} al {self.storage.fill:.0%} "
+                           f"({self.storage.used}/{self.storage.total})")
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        if self.storage:
+            stats.update(storage=self.storage.storage, used=self.storage.used,
+                         total=self.storage.total)
+        return stats
@@ -1,28 +1,15 @@
 """
 Configuración Multiplataforma del SMS Gateway
-Detecta automáticamente puertos serie y permite configuració        # Configuración por defecto
-        self.config = {
-            'serial_port': '',
-            'baud_rate': 9600,
-            'timeout': 10,
-            'smsc_number': '',  # Se detectará automáticamente de la SIM
-            'gateway_number': '',  # Número de la SIM actual (se detectará)
-            'operator': '',  # Operador de la SIM (se detectará)
-            'web_server': {
-                'host': 'localhost',
-                'port': 8080
-            },
-            'sim_info': {
-                'iccid': '',  # ID único de la SIM
-                'imsi': '',   # Identificador del suscriptor
-                'last_updated': ''
-            }
-        } os
+Detecta automáticamente puertos serie y permite configuración manual
+"""
+import os
 import platform
 import serial.tools.list_ports
 from typing import List, Dict, Optional
 import json
 
+from port_registry import PortRegistry, rank_modem_ports
+
 class SystemConfig:
     """Configuración del sistema para diferentes OS"""
     
@@ -53,7 +40,7 @@ class SystemConfig:
     
     @staticmethod
     def scan_available_ports() -> List[Dict]:
-        """Escanea puertos serie disponibles"""
+        """Escanea puertos serie disponibles (enumeración completa; ver `port_registry`)"""
         
         ports = []
         
@@ -90,28 +77,17 @@ class SystemConfig:
         
         return ports
     
+    @staticmethod
+    def find_modem_ports() -> List[str]:
+        """Todos los puertos candidatos a módem, en orden de prioridad (sin reescanear)"""
+        return port_registry.modem_ports()
+    
     @staticmethod
     def find_huawei_modem() -> Optional[str]:
         """Busca específicamente el módem Huawei"""
         
-        ports = SystemConfig.scan_available_ports()
-        
-        # Prioridad 1: Huawei con VID:PID específico (12d1:1506)
-        for port in ports:
-            if port['vid'] == 0x12d1 and port['pid'] == 0x1506:
-                return port['device']
-        
-        # Prioridad 2: Cualquier dispositivo Huawei
-        for port in ports:
-            if port['is_huawei']:
-                return port['device']
-        
-        # Prioridad 3: Cualquier módem
-        for port in ports:
-            if port['is_modem']:
-                return port['device']
-        
-        return None
+        ports = SystemConfig.find_modem_ports()
+        return ports[0] if ports else None
 
 class ConfigManager:
     """Gestor de configuración del gateway"""
@@ -127,6 +103,9 @@ class ConfigManager:
             'serial_port': None,
             'baud_rate': 9600,
             'auto_detect': True,
+            'sms_mode': 'text',  # 'pdu': mensajes largos y UCS-2 (acentos, emoji)
+            'use_cmms': True,  # Mantener enlace con el SMSC en envíos en lote
+            'delivery_reports': True,  # Pedir reporte de entrega (+CDS) por cada SMS
             'smsc_number': '+51997990000',  # Claro Perú por defecto
             'gateway_number': '997507384',
             'test_numbers': {
@@ -135,11 +114,26 @@ class ConfigManager:
             },
             'monitoring': {
                 'enabled': True,
-                'check_interval': 10
+                'check_interval': 10,
+                'network_interval': 30  # Segundos entre muestras de operador/señal/registro
+            },
+            'inbox': {
+                'database': 'sms_gateway.db',
+                'delete_after_read': True,   # AT+CMGD tras guardar: la memoria del módem no se llena
+                'capacity_warning': 0.8      # Aviso de AT+CPMS? por encima de esta ocupación
+            },
+            'history': {
+                'capacity': 500   # Envíos/recibidos en memoria; los envíos más antiguos pasan a sms_messages
+            },
+            'pool': {
+                'enabled': False,          # Conectar todos los módems detectados y repartir los envíos
+                'ports': [],               # Vacío: todos los de find_modem_ports()
+                'policy': 'least_loaded'   # o 'round_robin'
             },
             'web_server': {
                 'host': '0.0.0.0',
-                'port': 8000
+                'port': 8000,
+                'mode': 'threaded'  # 'async': servidor asyncio con keep-alive
             }
         }
         
@@ -167,11 +161,12 @@ class ConfigManager:
         """Obtiene el puerto serie a usar"""
         
         if self.config['auto_detect']:
-            # Detectar automáticamente
+            # Detectar automáticamente (registro en memoria; se guarda sólo si cambió)
             detected = SystemConfig.find_huawei_modem()
             if detected:
-                self.config['serial_port'] = detected
-                self.save_config()
+                if self.config.get('serial_port') != detected:
+                    self.config['serial_port'] = detected
+                    self.save_config()
                 return detected
         
         # Usar puerto configurado manualmente
@@ -191,15 +186,20 @@ class ConfigManager:
 # Instancia global del gestor de configuración
 config_manager = ConfigManager()
 
+# Puertos enumerados una vez; se actualizan al conectar/desconectar un USB
+port_registry = PortRegistry(SystemConfig.scan_available_ports)
+
 def get_system_info() -> Dict:
-    """Obtiene información completa del sistema"""
+    """Obtiene información completa del sistema (puertos desde el registro en memoria)"""
     
+    ports = port_registry.ports()
+    modem_ports = rank_modem_ports(ports)
     return {
         'os': SystemConfig.detect_os(),
         'platform': platform.platform(),
         'python_version': platform.python_version(),
-        'available_ports': SystemConfig.scan_available_ports(),
-        'detected_modem': SystemConfig.find_huawei_modem(),
+        'available_ports': ports,
+        'detected_modem': modem_ports[0] if modem_ports else None,
         'default_ports': SystemConfig.get_default_ports(),
         'current_config': config_manager.config
     }
@@ -3,10 +3,14 @@
 Script de prueba para comandos AT con el gateway SMS Huawei E8278
 """
 
+import os
 import serial
 import time
 import sys
 
+# Mismo nombre que en config.py; con el simulador: SERIAL_PORT=/tmp/ttySIM0
+SERIAL_PORT = os.environ.get('SERIAL_PORT', '/dev/ttyUSB0')
+
 def send_at_command(ser, command, wait_time=2):
     """Envía un comando AT y espera la respuesta"""
     print(f"Enviando: {command}")
@@ -25,8 +29,8 @@ def test_sms_at(phone_number, message):
     """Prueba de envío de SMS usando comandos AT"""
     try:
         # Abrir conexión serial
-        ser = serial.Serial('/dev/ttyUSB0', 9600, timeout=10)
-        print("Conexión establecida con /dev/ttyUSB0")
+        ser = serial.Serial(SERIAL_PORT, 9600, timeout=10)
+        print(f"Conexión establecida con {SERIAL_PORT}")
         
         # Esperar un momento para la inicialización
         time.sleep(2)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Pruebas contra el Simulador de Módem
+Conectan MultiplatformSMSEngine a un ModemSimulator (pty de Linux), así que
+corren con `python -m pytest test_*.py` sin hardware ni plugins asyncio:
+cada prueba ejecuta su corrutina con asyncio.run()
+"""
+import asyncio
+import sys
+from typing import List, Optional
+
+import pytest
+
+if sys.platform == 'win32':
+    pytest.skip("El simulador necesita un pty de Linux/macOS", allow_module_level=True)
+
+from delivery_reports import REPORT_CNMI, SUBMIT_WITH_REPORT, DeliveryTracker, parse_status_report
+from message_store import MessageStore
+from modem_simulator import ModemSimulator
+from multiplatform_sms_engine import MultiplatformSMSEngine
+from store_ingestion import StoreIngester
+
+NUMBER = '+51946467799'
+LONG_MESSAGE = 'Mensaje largo del gateway. ' * 8    # 216 caracteres: dos segmentos GSM-7
+
+def run_with_engine(scenario, sms_mode: str = 'text', modem: Optional[ModemSimulator] = None,
+                    **config):
+    """Ejecuta `scenario(engine, modem)` con el motor conectado a un simulador nuevo"""
+
+    modem = modem or ModemSimulator(report_delay=0.05)
+    port = modem.start()
+
+    async def main():
+        engine = MultiplatformSMSEngine()
+        # Sin depender del gateway_config.json del directorio de trabajo
+        settings = {'sms_mode': sms_mode, 'delivery_reports': True, 'use_cmms': True}
+        settings.update(config)
+        engine.config = dict(engine.config, **settings)
+        assert await engine.connect(port)
+        try:
+            return await scenario(engine, modem)
+        finally:
+            await engine.disconnect()
+
+    try:
+        return asyncio.run(main())
+    finally:
+        modem.stop()
+
+def record_writes(engine) -> List[bytes]:
+    """Lo que el motor escribe en el puerto desde ahora"""
+
+    written = []
+    write = engine.transport.write
+
+    def record(data):
+        written.append(data)
+        write(data)
+
+    engine.transport.write = record
+    return written
+
+def test_connect_configures_text_mode():
+    modem = ModemSimulator()
+    modem.charset = 'IRA'
+
+    async def scenario(engine, modem):
+        assert engine.is_connected
+        assert not engine.pdu_mode
+
+    run_with_engine(scenario, modem=modem)
+    assert modem.text_mode
+    assert modem.charset == 'GSM'
+    assert modem.first_octet == SUBMIT_WITH_REPORT
+    assert 'AT+CNMI=' + ','.join(map(str, modem.cnmi)) == REPORT_CNMI
+
+def test_connect_pdu_mode_skips_cscs():
+    modem = ModemSimulator()
+    modem.charset = 'IRA'
+
+    async def scenario(engine, modem):
+        assert engine.pdu_mode
+
+    run_with_engine(scenario, sms_mode='pdu', modem=modem)
+    assert not modem.text_mode
+    assert modem.charset == 'IRA'
+
+def test_text_mode_writes_gsm_charset():
+    """Con CSCS="GSM" el cuerpo va en septetos GSM, no en UTF-8"""
+
+    async def scenario(engine, modem):
+        written = record_writes(engine)
+        result = await engine.send_sms(NUMBER, '£ñ')
+        assert result.success
+        assert modem.sent[-1].text == '£n'
+        return written
+
+    written = run_with_engine(scenario)
+    # '£' es 0x01 en el alfabeto GSM; 'ñ' se normaliza a 'n'
+    assert written[-1] == b'\x01n\x1a'
+
+def test_pdu_multipart_send_keeps_link():
+    async def scenario(engine, modem):
+        written = record_writes(engine)
+        result = await engine.send_sms(NUMBER, LONG_MESSAGE)
+        assert result.success
+        assert len(result.part_references) == 2
+        return written
+
+    modem = ModemSimulator()
+    written = run_with_engine(scenario, sms_mode='pdu', modem=modem)
+
+    parts = sorted(modem.sent, key=lambda sms: sms.part)
+    assert [(sms.part, sms.total) for sms in parts] == [(1, 2), (2, 2)]
+    assert ''.join(sms.text for sms in parts) == LONG_MESSAGE
+    assert all(sms.status_report for sms in parts)
+    # AT+CMMS=1 antes del primer segmento
+    commands = [data for data in written if data.startswith(b'AT')]
+    assert commands[0] == b'AT+CMMS=1\r\n'
+    assert commands[1].startswith(b'AT+CMGS=')
+
+def test_batch_uses_cmms():
+    async def scenario(engine, modem):
+        messages = [(NUMBER, f'Lote {i}') for i in range(3)]
+        results = [item.result async for item in engine.send_batch(messages)]
+        assert all(result.success for result in results)
+        return engine.get_throughput_stats()
+
+    modem = ModemSimulator()
+    stats = run_with_engine(scenario, modem=modem)
+    assert stats['cmms_supported'] is True
+    assert stats['with_cmms']['messages'] == 3
+    assert [sms.text for sms in modem.sent] == ['Lote 0', 'Lote 1', 'Lote 2']
+
+def test_batch_without_cmms():
+    async def scenario(engine, modem):
+        results = [item.result async for item in engine.send_batch([(NUMBER, 'Sin enlace')])]
+        assert results[0].success
+        return engine.get_throughput_stats()
+
+    stats = run_with_engine(scenario, use_cmms=False)
+    assert stats['cmms_supported'] is None
+    assert stats['without_cmms']['messages'] == 1
+
+def test_store_ingestion(tmp_path):
+    store = MessageStore(str(tmp_path / 'inbox.db'))
+
+    async def scenario(engine, modem):
+        modem.deliver(NUMBER, 'Hola gateway')
+        modem.deliver('+51913044047', LONG_MESSAGE)
+        ingester = StoreIngester(engine, store)
+
+        first = await ingester.sweep()
+        assert sorted((msg['sender'], msg['content']) for msg in first) == [
+            ('+51913044047', LONG_MESSAGE), (NUMBER, 'Hola gateway')]
+        assert modem.stored == 0
+
+        # Lo guardado no vuelve a aparecer
+        assert await ingester.sweep() == []
+
+    run_with_engine(scenario, sms_mode='pdu')
+
+async def _delivery_scenario(engine, modem):
+    tracker = DeliveryTracker()
+    reports = []
+    delivered = asyncio.Event()
+
+    def on_urc(urc):
+        report = parse_status_report(urc)
+        if report is not None and report.final:
+            reports.append(report)
+            delivered.set()
+
+    engine.subscribe_urc(on_urc)
+    result = await engine.send_sms(NUMBER, 'Con reporte')
+    assert result.success
+    tracker.register(engine.modem.name, result.reference_id, 'mensaje-1')
+
+    await asyncio.wait_for(delivered.wait(), 5)
+    return [(tracker.resolve(engine.modem.name, report), report.state) for report in reports]
+
+def test_delivery_report_text_mode():
+    assert run_with_engine(_delivery_scenario) == [('mensaje-1', 'delivered')]
+
+def test_delivery_report_pdu_mode():
+    assert run_with_engine(_delivery_scenario, sms_mode='pdu') == [('mensaje-1', 'delivered')]
@@ -2,63 +2,42 @@
 Servidor Web SMS Gateway Multiplataforma
 Interfaz web completa que funciona en Windows, Linux y macOS
 """
+import argparse
 import asyncio
 import json
+import logging
 import threading
 import time
 from datetime import datetime
+from typing import Dict, List, Optional
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
 from urllib.parse import parse_qs, urlparse
 from multiplatform_sms_engine import MultiplatformSMSEngine
+from modem_pool import ModemPool, PoolMember
+from engine_loop import EngineLoopThread
+from async_http_server import CORS_HEADERS, AsyncHTTPServer, HTTPRequest, HTTPResponse
+from network_sampler import CachedJSON, NetworkSampler, NetworkSnapshot, etag_matches
+from message_store import MessageStore, delivery_update
+from history_buffer import HistoryBuffer
+from write_behind import WriteBehind
+from store_ingestion import StoreIngester
+from reply_index import ReplyIndex
+from delivery_reports import DeliveryTracker, parse_status_report
+from event_stream import (HEARTBEAT, HEARTBEAT_INTERVAL, SSE_HEADERS, AsyncSubscription,
+                          EventBroadcaster, ThreadSubscription)
 from system_config import config_manager, get_system_info
+import metrics
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+logger = logging.getLogger(__name__)
 
-class SMSGatewayHandler(BaseHTTPRequestHandler):
-    
-    def do_GET(self):
-        """Maneja peticiones GET"""
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        if path == '/':
-            self._serve_main_interface()
-        elif path == '/api/system-info':
-            self._api_system_info()
-        elif path == '/api/config':
-            self._api_get_config()
-        elif path == '/api/status':
-            self._api_get_status()
-        elif path == '/api/messages':
-            self._api_get_messages()
-        elif path == '/setup':
-            self._serve_setup_page()
-        else:
-            self._send_error(404, "Página no encontrada")
-    
-    def do_POST(self):
-        """Maneja peticiones POST"""
-        parsed_url = urlparse(self.path)
-        path = parsed_url.path
-        
-        if path == '/api/send':
-            self._api_send_sms()
-        elif path == '/api/connect':
-            self._api_connect()
-        elif path == '/api/disconnect':
-            self._api_disconnect()
-        elif path == '/api/config':
-            self._api_save_config()
-        elif path == '/api/test-port':
-            self._api_test_port()
-        else:
-            self._send_error(404, "Endpoint no encontrado")
-    
-    def _serve_main_interface(self):
-        """Sirve la interfaz principal"""
-        html = """
+# Esperas máximas por operación sobre el loop del motor (segundos)
+CONNECT_TIMEOUT = 60      # Incluye la detección de puertos
+SEND_TIMEOUT = 120        # Mensajes largos: varios segmentos
+QUERY_TIMEOUT = 20
+
+# Interfaz principal (compartida por ambos modos de servidor)
+MAIN_INTERFACE_HTML = """
 <!DOCTYPE html>
 <html lang="es">
 <head>
@@ -261,14 +240,18 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
     <script>
         // Estado global
         let connected = false;
-        let autoRefreshInterval;
+        let eventSource = null;
+        let sentMessages = [];
+        let receivedMessages = [];
+        let totals = { sent: 0, received: 0 };
+        let historyLimit = 500;
 
         // Inicialización
         document.addEventListener('DOMContentLoaded', function() {
             loadSystemInfo();
             loadConfig();
             setupEventListeners();
-            startAutoRefresh();
+            subscribeEvents();
         });
 
         function setupEventListeners() {
@@ -469,7 +452,6 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
                     showAlert('success', `Mensaje enviado exitosamente (Ref: ${result.reference_id})`, resultDiv);
                     document.getElementById('send-form').reset();
                     updateCharCount();
-                    refreshMessages();
                 } else {
                     showAlert('error', `Error enviando mensaje: ${result.error}`, resultDiv);
                 }
@@ -499,28 +481,25 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
             }
         }
 
-        async function refreshMessages() {
-            // Implementar carga de mensajes
-            try {
-                const response = await fetch('/api/messages');
-                const data = await response.json();
-                
-                // Actualizar estadísticas
-                document.getElementById('stat-sent').textContent = data.sent.length;
-                document.getElementById('stat-received').textContent = data.received.length;
-                document.getElementById('stat-responses').textContent = data.received.filter(m => m.is_response).length;
-                
-                const successRate = data.sent.length > 0 ? 
-                    Math.round((data.sent.filter(m => m.success).length / data.sent.length) * 100) : 0;
-                document.getElementById('stat-success-rate').textContent = successRate + '%';
-                
-                // Actualizar listas de mensajes
-                updateMessageList('sent-messages', data.sent, 'sent');
-                updateMessageList('received-messages', data.received, 'received');
-                
-            } catch (error) {
-                console.error('Error actualizando mensajes:', error);
-            }
+        function renderMessages() {
+            // Actualizar estadísticas
+            document.getElementById('stat-sent').textContent = totals.sent;
+            document.getElementById('stat-received').textContent = totals.received;
+            document.getElementById('stat-responses').textContent = receivedMessages.filter(m => m.is_response).length;
+            
+            const successRate = sentMessages.length > 0 ? 
+                Math.round((sentMessages.filter(m => m.success).length / sentMessages.length) * 100) : 0;
+            document.getElementById('stat-success-rate').textContent = successRate + '%';
+            
+            // Actualizar listas de mensajes
+            updateMessageList('sent-messages', sentMessages, 'sent');
+            updateMessageList('received-messages', receivedMessages, 'received');
+        }
+
+        function setConnected(isConnected) {
+            connected = isConnected;
+            updateConnectionStatus(isConnected);
+            document.getElementById('disconnect-btn').disabled = !isConnected;
         }
 
         function updateMessageList(containerId, messages, type) {
@@ -543,7 +522,9 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
                             </div>
                             <div style="margin-bottom: 5px;">${msg.message}</div>
                             <div style="font-size: 0.8em; color: #666;">
-                                Estado: ${msg.success ? '✅ Enviado' : '❌ Error'} 
+                                Estado: ${!msg.success ? '❌ Error' :
+                                    msg.delivery === 'delivered' ? '📬 Entregado' :
+                                    msg.delivery === 'failed' ? '⚠️ No entregado' : '✅ Enviado'} 
                                 ${msg.reference_id ? `| Ref: ${msg.reference_id}` : ''}
                             </div>
                         </div>
@@ -577,261 +558,576 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
             }
         }
 
-        function startAutoRefresh() {
-            // Refrescar cada 10 segundos
-            autoRefreshInterval = setInterval(refreshMessages, 10000);
-            // Carga inicial
-            setTimeout(refreshMessages, 1000);
+        function subscribeEvents() {
+            // El servidor empuja los cambios; EventSource reconecta solo y
+            // cada reconexión empieza con un snapshot completo
+            eventSource = new EventSource('/api/events');
+            
+            eventSource.addEventListener('snapshot', e => {
+                const data = JSON.parse(e.data);
+                sentMessages = data.sent;
+                receivedMessages = data.received;
+                totals = data.totals;
+                historyLimit = data.history_limit;
+                setConnected(data.connected);
+                renderMessages();
+            });
+            // El historial en pantalla tiene el mismo límite que el del servidor
+            eventSource.addEventListener('message', e => {
+                receivedMessages.push(JSON.parse(e.data));
+                receivedMessages = receivedMessages.slice(-historyLimit);
+                totals.received++;
+                renderMessages();
+            });
+            eventSource.addEventListener('sent', e => {
+                sentMessages.push(JSON.parse(e.data));
+                sentMessages = sentMessages.slice(-historyLimit);
+                totals.sent++;
+                renderMessages();
+            });
+            eventSource.addEventListener('delivery', e => {
+                const update = JSON.parse(e.data);
+                const index = sentMessages.findIndex(m =>
+                    m.timestamp === update.timestamp && m.reference_id === update.reference_id);
+                if (index >= 0) {
+                    sentMessages[index] = update;
+                    renderMessages();
+                }
+            });
+            eventSource.addEventListener('connection', e => {
+                setConnected(JSON.parse(e.data).connected);
+            });
+            eventSource.onerror = () => console.warn('Canal de eventos interrumpido, reconectando...');
         }
 
         // Cleanup al cerrar
         window.addEventListener('beforeunload', function() {
-            if (autoRefreshInterval) {
-                clearInterval(autoRefreshInterval);
+            if (eventSource) {
+                eventSource.close();
             }
         });
     </script>
 </body>
 </html>
-        """
-        self._send_html(html)
+"""
+
+class GatewayAPI:
+    """Lógica de las rutas /api/*
     
-    def _api_system_info(self):
-        """API para información del sistema"""
+    La comparten el servidor con hilos (a través de EngineLoopThread) y el
+    servidor asíncrono: las corrutinas corren en el loop dueño del motor.
+    /api/status y /network-info salen de la instantánea del NetworkSampler,
+    que sólo corre mientras el gateway está conectado. Los mensajes nuevos
+    se leen al llegar un +CMTI y, junto con envíos y cambios de conexión,
+    se publican en `events` para /api/events; la bandeja se guarda y se
+    vacía a través de `ingester`. Los envíos salen por `pool`: sólo el
+    motor principal, o todos los módems detectados con `pool.enabled`.
+    """
+    
+    def __init__(self, engine: Optional[MultiplatformSMSEngine] = None):
+        self.engine = engine or MultiplatformSMSEngine()
+        inbox = config_manager.config.get('inbox', {})
+        self.store = MessageStore(inbox.get('database', 'sms_gateway.db'))
+        
+        # Historial reciente acotado; los envíos más antiguos pasan a sms_messages y
+        # los recibidos ya están en received_messages desde que se leyeron del módem
+        capacity = config_manager.config.get('history', {}).get('capacity', 500)
+        self.sent_messages = HistoryBuffer(capacity, spill=self._spill_sent)
+        self.received_messages = HistoryBuffer(capacity)
+        self.replies = ReplyIndex()  # Envíos que esperan respuesta, por número
+        self.deliveries = DeliveryTracker()  # Segmentos que esperan reporte, por <mr>
+        # Reportes de envíos que ya salieron del historial: se corrige su fila en sms_messages
+        self.delivery_writer = WriteBehind(self.store.update_delivery, name='delivery-writer')
+        self.delivery_writer.start()
+        
+        # Bandeja del módem: se guarda en SQLite y se borra con AT+CMGD
+        self.ingester = self._new_ingester(self.engine)
+        self._ingesters: Dict[str, StoreIngester] = {}  # Por módem del pool
+        
+        pool = config_manager.config.get('pool', {})
+        self.pool = ModemPool(self.engine, policy=pool.get('policy', 'least_loaded'))
+        
+        interval = config_manager.config.get('monitoring', {}).get('network_interval', 30)
+        self.network = NetworkSampler(self.engine.get_network_info, interval,
+                                      is_connected=lambda: self.engine.is_connected)
+        self._config_version = 0
+        self._status = CachedJSON(self._build_status)
+        self._network_info = CachedJSON(self._build_network_info)
+        
+        self.events = EventBroadcaster()
+        self.network.subscribe(self._on_network_change)
+        self._unsubscribe_urc = None
+        self._inbox_task: Optional[asyncio.Task] = None
+        self._inbox_pending: Dict[str, PoolMember] = {}
+    
+    def system_info(self) -> Dict:
+        """Información del sistema (bloqueante: escanea puertos)"""
         try:
-            system_info = get_system_info()
-            self._send_json(system_info)
+            return get_system_info()
         except Exception as e:
-            self._send_json({'error': str(e)})
+            return {'error': str(e)}
     
-    def _api_get_config(self):
-        """API para obtener configuración"""
-        self._send_json(config_manager.config)
+    def get_config(self) -> Dict:
+        return config_manager.config
     
-    def _api_save_config(self):
-        """API para guardar configuración"""
+    def save_config(self, new_config: Dict) -> Dict:
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            new_config = json.loads(post_data.decode('utf-8'))
-            
             # Actualizar configuración
             config_manager.config.update(new_config)
             config_manager.save_config()
+            self._config_version += 1
             
-            self._send_json({'success': True})
+            return {'success': True}
         except Exception as e:
-            self._send_json({'success': False, 'error': str(e)})
+            return {'success': False, 'error': str(e)}
     
-    def _api_connect(self):
-        """API para conectar al gateway"""
+    async def connect(self) -> Dict:
         try:
-            # Usar el motor global
-            if not hasattr(server_instance, 'engine'):
-                server_instance.engine = MultiplatformSMSEngine()
-            
-            # Conectar en hilo separado
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            connected = await self.engine.connect()
             
-            try:
-                connected = loop.run_until_complete(server_instance.engine.connect())
+            if connected:
+                # Sin pool: sólo el motor principal; con pool, el resto de los puertos en paralelo
+                pool = config_manager.config.get('pool', {})
+                ports = (pool.get('ports') or None) if pool.get('enabled') else []
+                await self.pool.connect(ports)
                 
-                if connected:
-                    port = config_manager.get_serial_port()
-                    self._send_json({
-                        'success': True,
-                        'port': port,
-                        'message': 'Gateway conectado exitosamente'
-                    })
-                else:
-                    self._send_json({
-                        'success': False,
-                        'error': 'No se pudo conectar al gateway'
-                    })
-                    
-            finally:
-                loop.close()
+                await self.network.start()
+                try:
+                    await self.network.refresh()
+                except Exception as e:
+                    logger.warning(f"⚠️ Sin información de red: {e}")
+                
+                # Mensajes nuevos: cada módem avisa con +CMTI (AT+CNMI=1,1)
+                self._unsubscribe_urc = self.pool.subscribe_urc(self._on_urc)
+                self._publish_connection()
+                for member in self.pool.members:
+                    self._schedule_inbox_refresh(member)  # Lo que llegó mientras estaba desconectado
+                return {
+                    'success': True,
+                    'port': self._current_port(),
+                    'modems': [member.name for member in self.pool.members],
+                    'message': 'Gateway conectado exitosamente'
+                }
+            return {
+                'success': False,
+                'error': 'No se pudo conectar al gateway'
+            }
                 
         except Exception as e:
-            self._send_json({'success': False, 'error': str(e)})
+            return {'success': False, 'error': str(e)}
     
-    def _api_disconnect(self):
-        """API para desconectar el gateway"""
+    async def disconnect(self) -> Dict:
         try:
-            if hasattr(server_instance, 'engine'):
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                try:
-                    loop.run_until_complete(server_instance.engine.disconnect())
-                finally:
-                    loop.close()
-            
-            self._send_json({'success': True})
+            await self.network.stop()
+            if self._unsubscribe_urc is not None:
+                self._unsubscribe_urc()
+                self._unsubscribe_urc = None
+            if self._inbox_task is not None:
+                self._inbox_task.cancel()
+            self._inbox_pending.clear()
+            await self.pool.disconnect()
+            await self.engine.disconnect()
+            self.network.clear()
+            self._publish_connection()
+            return {'success': True}
         except Exception as e:
-            self._send_json({'success': False, 'error': str(e)})
+            return {'success': False, 'error': str(e)}
     
-    def _api_send_sms(self):
-        """API para enviar SMS"""
+    async def send_sms(self, data: Dict) -> Dict:
         try:
-            if not hasattr(server_instance, 'engine') or not server_instance.engine.is_connected:
-                self._send_json({'success': False, 'error': 'Gateway no conectado'})
-                return
-            
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            if not self.pool.is_connected:
+                return {'success': False, 'error': 'Gateway no conectado'}
             
             phone_number = data.get('phone_number')
             message = data.get('message')
             
             if not phone_number or not message:
-                self._send_json({'success': False, 'error': 'Datos incompletos'})
-                return
+                return {'success': False, 'error': 'Datos incompletos'}
             
-            # Enviar SMS
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            # Enviar SMS por el módem que elija el pool
+            member, result = await self.pool.dispatch(phone_number, message)
             
-            try:
-                result = loop.run_until_complete(
-                    server_instance.engine.send_sms(phone_number, message)
-                )
-                
-                # Guardar en historial
-                if not hasattr(server_instance, 'sent_messages'):
-                    server_instance.sent_messages = []
-                
-                server_instance.sent_messages.append({
-                    'phone_number': phone_number,
-                    'message': message,
-                    'success': result.success,
-                    'reference_id': result.reference_id,
-                    'timestamp': datetime.now().isoformat(),
-                    'error': result.error_message
-                })
-                
-                self._send_json({
-                    'success': result.success,
-                    'reference_id': result.reference_id,
-                    'error': result.error_message
-                })
-                
-            finally:
-                loop.close()
+            # Guardar en historial
+            entry = {
+                'phone_number': phone_number,
+                'message': message,
+                'success': result.success,
+                'reference_id': result.reference_id,
+                'modem': member.name if member else None,
+                'timestamp': datetime.now().isoformat(),
+                'error': result.error_message
+            }
+            self.sent_messages.append(entry)
+            if result.success:
+                self.replies.add(phone_number, entry)
+                self._track_delivery(member, entry, result.part_references or [result.reference_id])
+            self.events.publish('sent', dict(entry))
+            
+            return {
+                'success': result.success,
+                'reference_id': result.reference_id,
+                'modem': entry['modem'],
+                'error': result.error_message
+            }
                 
         except Exception as e:
-            self._send_json({'success': False, 'error': str(e)})
+            return {'success': False, 'error': str(e)}
     
-    def _api_test_port(self):
-        """API para probar puerto"""
+    async def test_port(self, data: Dict) -> Dict:
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
             port = data.get('port')
             
             # Crear engine temporal para prueba
             test_engine = MultiplatformSMSEngine()
             
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                connected = loop.run_until_complete(test_engine.connect(port))
-                
-                if connected:
-                    loop.run_until_complete(test_engine.disconnect())
-                    self._send_json({'success': True, 'port': port})
-                else:
-                    self._send_json({'success': False, 'error': 'No se pudo conectar'})
-                    
-            finally:
-                loop.close()
+            if await test_engine.connect(port):
+                await test_engine.disconnect()
+                return {'success': True, 'port': port}
+            return {'success': False, 'error': 'No se pudo conectar'}
                 
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    async def get_messages(self) -> Dict:
+        """Historial en memoria; la bandeja del módem se lee al llegar +CMTI"""
+        return {
+            'sent': self.sent_messages.snapshot(),
+            'received': self.received_messages.snapshot()
+        }
+    
+    def get_modems(self) -> Dict:
+        """Salud y rendimiento de cada módem del pool"""
+        return self.pool.get_stats()
+    
+    def snapshot(self) -> Dict:
+        """Primer evento de cada suscriptor: estado completo, luego sólo cambios"""
+        return {
+            'connected': self.engine.is_connected,
+            'port': self._current_port(),
+            'network': self.network.snapshot.info,
+            'sent': self.sent_messages.snapshot(),
+            'received': self.received_messages.snapshot(),
+            'totals': {'sent': self.sent_messages.total, 'received': self.received_messages.total},
+            'history_limit': self.sent_messages.capacity
+        }
+    
+    async def close(self):
+        """Guarda en SQLite los envíos que siguen en memoria (al detener el servidor)"""
+        pending = self.sent_messages.drain()
+        loop = asyncio.get_running_loop()
+        if pending:
+            await loop.run_in_executor(None, self.store.save_sent, pending)
+            logger.info(f"💾 {len(pending)} envíos del historial guardados")
+        await loop.run_in_executor(None, self.delivery_writer.stop)
+    
+    def _spill_sent(self, entries: List[Dict]):
+        for entry in entries:
+            entry['archived'] = True   # En sms_messages: un reporte posterior actualiza la fila
+        # SQLite bloquea: el lote se escribe en el executor, fuera del loop del motor
+        future = asyncio.get_running_loop().run_in_executor(None, self.store.save_sent, entries)
+        
+        def done(future):
+            if future.exception() is not None:
+                logger.error(f"❌ No se pudieron guardar {len(entries)} envíos del historial: "
+                             f"{future.exception()}")
+        future.add_done_callback(done)
+    
+    def _new_ingester(self, engine) -> StoreIngester:
+        inbox = config_manager.config.get('inbox', {})
+        return StoreIngester(engine, self.store,
+                             delete_after_read=inbox.get('delete_after_read', True),
+                             capacity_warning=inbox.get('capacity_warning', 0.8))
+    
+    def _ingester_for(self, member: PoolMember) -> StoreIngester:
+        if member.engine is self.engine:
+            return self.ingester
+        ingester = self._ingesters.get(member.name)
+        if ingester is None or ingester.engine is not member.engine:
+            ingester = self._ingesters[member.name] = self._new_ingester(member.engine)
+        return ingester
+    
+    def _on_urc(self, member: PoolMember, urc):
+        if urc.prefix == '+CMTI':
+            self._schedule_inbox_refresh(member)
+        elif urc.prefix == '+CDS':
+            self._on_delivery_report(member, urc)
+    
+    def _track_delivery(self, member: PoolMember, entry: Dict, references: List[str]):
+        # Un mensaje largo está entregado cuando llegó el reporte de cada segmento
+        references = [reference for reference in references if reference and reference.isdigit()]
+        if not self.engine.delivery_reports or not references:
+            return
+        entry['delivery'] = 'pending'
+        tracked = {'entry': entry, 'parts': len(references)}
+        for reference in references:
+            self.deliveries.register(member.name, reference, tracked)
+    
+    def _on_delivery_report(self, member: PoolMember, urc):
+        report = parse_status_report(urc)
+        if report is None or not report.final:
+            return
+        tracked = self.deliveries.resolve(member.name, report)
+        if tracked is None or tracked['entry']['delivery'] != 'pending':
+            return
+        
+        entry = tracked['entry']
+        if report.state == 'failed':
+            entry['delivery'] = 'failed'
+        else:
+            tracked['parts'] -= 1
+            if tracked['parts']:
+                return
+            entry['delivery'] = 'delivered'
+            entry['delivered_at'] = datetime.now().isoformat()
+        if entry.get('archived'):
+            self.delivery_writer.submit(delivery_update(entry))
+        self.events.publish('delivery', dict(entry))
+    
+    def _on_network_change(self, snapshot: NetworkSnapshot):
+        self.events.publish('network', snapshot.info)
+    
+    def _publish_connection(self):
+        self.events.publish('connection', {
+            'connected': self.engine.is_connected,
+            'port': self._current_port()
+        })
+    
+    def _schedule_inbox_refresh(self, member: PoolMember):
+        # Una ráfaga de +CMTI (mensaje largo en varios segmentos) -> una sola lectura extra por módem
+        self._inbox_pending[member.name] = member
+        if self._inbox_task is not None and not self._inbox_task.done():
+            return
+        self._inbox_task = asyncio.get_running_loop().create_task(self._refresh_inbox())
+    
+    async def _refresh_inbox(self):
+        while self._inbox_pending:
+            name = next(iter(self._inbox_pending))
+            member = self._inbox_pending.pop(name)
+            try:
+                # Sólo devuelve lo que no se había guardado antes
+                stored = await self._ingester_for(member).sweep()
+            except Exception as e:
+                logger.error(f"❌ [{name}] Error leyendo mensajes: {e}")
+                continue
+            
+            # Convertir a formato de recibidos
+            for msg in stored:
+                sent = self.replies.match(msg['sender'])
+                entry = {
+                    'phone_number': msg['sender'],
+                    'message': msg['content'],
+                    'timestamp': datetime.now().isoformat(),
+                    'is_response': sent is not None
+                }
+                if sent is not None:
+                    entry['reply_to'] = sent['reference_id']
+                self.received_messages.append(entry)
+                self.events.publish('message', dict(entry))
+    
+    def _current_port(self) -> Optional[str]:
+        # Puerto abierto por el motor; get_serial_port() escanearía los puertos
+        connection = getattr(self.engine, 'serial_connection', None)
+        if connection is not None:
+            return connection.port
+        return config_manager.config.get('serial_port')
+    
+    def _build_status(self) -> Dict:
+        is_connected = self.engine.is_connected
+        status = {
+            'connected': is_connected,
+            'port': self._current_port(),
+            'config': config_manager.config
+        }
+        if is_connected:
+            snapshot = self.network.snapshot
+            status['network'] = snapshot.info
+            status['network_updated'] = snapshot.changed_at_iso
+        return status
+    
+    def _build_network_info(self) -> Dict:
+        snapshot = self.network.snapshot
+        return dict(snapshot.info, connected=self.engine.is_connected,
+                    updated=snapshot.changed_at_iso)
+    
+    def status_body(self):
+        """(JSON, ETag) de /api/status; sólo se serializa de nuevo si algo cambió"""
+        key = (self.engine.is_connected, self.network.snapshot.version,
+               self._config_version, self._current_port())
+        return self._status.get(key)
+    
+    def network_info_body(self):
+        """(JSON, ETag) de /network-info"""
+        return self._network_info.get((self.engine.is_connected, self.network.snapshot.version))
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Varios navegadores refrescando a la vez
+
+class SMSGatewayHandler(BaseHTTPRequestHandler):
+    
+    def do_GET(self):
+        """Maneja peticiones GET"""
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path
+        
+        if path == '/':
+            self._serve_main_interface()
+        elif path == '/api/system-info':
+            self._api_system_info()
+        elif path == '/api/config':
+            self._api_get_config()
+        elif path == '/api/status':
+            self._api_get_status()
+        elif path == '/api/messages':
+            self._api_get_messages()
+        elif path == '/api/modems':
+            self._send_json(server_instance.api.get_modems())
+        elif path == '/api/events':
+            self._api_events()
+        elif path in ('/network-info', '/api/network-info'):
+            self._send_cached(*server_instance.api.network_info_body())
+        elif path == '/metrics':
+            self._send_metrics()
+        elif path == '/setup':
+            self._serve_setup_page()
+        else:
+            self._send_error(404, "Página no encontrada")
+    
+    def do_POST(self):
+        """Maneja peticiones POST"""
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path
+        
+        if path == '/api/send':
+            self._api_send_sms()
+        elif path == '/api/connect':
+            self._api_connect()
+        elif path == '/api/disconnect':
+            self._api_disconnect()
+        elif path == '/api/config':
+            self._api_save_config()
+        elif path == '/api/test-port':
+            self._api_test_port()
+        else:
+            self._send_error(404, "Endpoint no encontrado")
+    
+    def _serve_main_interface(self):
+        """Sirve la interfaz principal"""
+        self._send_html(MAIN_INTERFACE_HTML)
+    
+    def _read_json(self) -> Dict:
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        return json.loads(post_data.decode('utf-8'))
+    
+    def _run(self, coro, timeout: float):
+        """Ejecuta una corrutina de la API en el loop del motor"""
+        return server_instance.engine_loop.run(coro, timeout)
+    
+    def _api_system_info(self):
+        """API para información del sistema"""
+        self._send_json(server_instance.api.system_info())
+    
+    def _api_get_config(self):
+        """API para obtener configuración"""
+        self._send_json(server_instance.api.get_config())
+    
+    def _api_save_config(self):
+        """API para guardar configuración"""
+        try:
+            self._send_json(server_instance.api.save_config(self._read_json()))
+        except Exception as e:
+            self._send_json({'success': False, 'error': str(e)})
+    
+    def _api_connect(self):
+        """API para conectar al gateway"""
+        try:
+            self._send_json(self._run(server_instance.api.connect(), CONNECT_TIMEOUT))
+        except Exception as e:
+            self._send_json({'success': False, 'error': str(e)})
+    
+    def _api_disconnect(self):
+        """API para desconectar el gateway"""
+        try:
+            self._send_json(self._run(server_instance.api.disconnect(), QUERY_TIMEOUT))
+        except Exception as e:
+            self._send_json({'success': False, 'error': str(e)})
+    
+    def _api_send_sms(self):
+        """API para enviar SMS"""
+        try:
+            data = self._read_json()
+            self._send_json(self._run(server_instance.api.send_sms(data), SEND_TIMEOUT))
+        except Exception as e:
+            self._send_json({'success': False, 'error': str(e)})
+    
+    def _api_test_port(self):
+        """API para probar puerto"""
+        try:
+            data = self._read_json()
+            self._send_json(self._run(server_instance.api.test_port(data), CONNECT_TIMEOUT))
         except Exception as e:
             self._send_json({'success': False, 'error': str(e)})
     
     def _api_get_messages(self):
         """API para obtener mensajes"""
         try:
-            # Mensajes enviados
-            sent_messages = getattr(server_instance, 'sent_messages', [])
-            
-            # Mensajes recibidos (simular por ahora)
-            received_messages = getattr(server_instance, 'received_messages', [])
-            
-            # Verificar mensajes almacenados si hay conexión
-            if (hasattr(server_instance, 'engine') and 
-                server_instance.engine.is_connected):
-                
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                try:
-                    stored = loop.run_until_complete(
-                        server_instance.engine.check_stored_messages()
-                    )
-                    
-                    # Convertir a formato de recibidos
-                    for msg in stored:
-                        # Evitar duplicados
-                        if not any(r['message'] == msg['content'] and 
-                                 r['phone_number'] == msg['sender'] 
-                                 for r in received_messages):
-                            
-                            received_messages.append({
-                                'phone_number': msg['sender'],
-                                'message': msg['content'],
-                                'timestamp': datetime.now().isoformat(),
-                                'is_response': False
-                            })
-                    
-                    # Guardar para próximas consultas
-                    server_instance.received_messages = received_messages
-                    
-                finally:
-                    loop.close()
-            
-            self._send_json({
-                'sent': sent_messages,
-                'received': received_messages
-            })
-            
+            self._send_json(self._run(server_instance.api.get_messages(), QUERY_TIMEOUT))
         except Exception as e:
             self._send_json({'sent': [], 'received': [], 'error': str(e)})
     
     def _api_get_status(self):
-        """API para obtener estado del gateway"""
+        """API para obtener estado del gateway (instantánea en memoria, sin comandos AT)"""
+        self._send_cached(*server_instance.api.status_body())
+    
+    def _api_events(self):
+        """Server-Sent Events: estado inicial y luego mensajes, envíos y conexión"""
+        api = server_instance.api
+        subscription = ThreadSubscription()
         try:
-            is_connected = (hasattr(server_instance, 'engine') and 
-                          server_instance.engine.is_connected)
-            
-            status = {
-                'connected': is_connected,
-                'port': config_manager.get_serial_port(),
-                'config': config_manager.config
-            }
+            first = self._run(_subscribe(api, subscription), QUERY_TIMEOUT)
+            self.send_response(200)
+            for name, value in SSE_HEADERS.items():
+                self.send_header(name, value)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(first)
+            self.wfile.flush()
             
-            if is_connected:
-                # Obtener info de red
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                try:
-                    network_info = loop.run_until_complete(
-                        server_instance.engine.get_network_info()
-                    )
-                    status['network'] = network_info
-                finally:
-                    loop.close()
-            
-            self._send_json(status)
-            
-        except Exception as e:
-            self._send_json({'connected': False, 'error': str(e)})
+            while not subscription.closed:
+                event = subscription.get(HEARTBEAT_INTERVAL)
+                self.wfile.write(event.encode() if event else HEARTBEAT)
+                self.wfile.flush()
+        except OSError:
+            pass  # El navegador cerró la pestaña o el socket falló
+        finally:
+            api.events.unsubscribe(subscription)
+    
+    def _send_cached(self, body: bytes, etag: str):
+        """Envía un JSON precalculado, o 304 si el cliente ya tiene ese ETag"""
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_metrics(self):
+        """Métricas en formato Prometheus"""
+        body = metrics.render()
+        self.send_response(200)
+        self.send_header('Content-type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def _send_json(self, data):
         """Envía respuesta JSON"""
@@ -861,27 +1157,126 @@ class SMSGatewayHandler(BaseHTTPRequestHandler):
         """Log personalizado"""
         print(f"🌐 {self.address_string()} - {format % args}")
 
+async def _subscribe(api: GatewayAPI, subscription) -> bytes:
+    """Suscribe y devuelve el evento inicial en el loop del motor, sin un await de por medio
+    (así ningún evento queda a la vez en el snapshot y en la cola)"""
+    api.events.subscribe(subscription)
+    snapshot = json.dumps(api.snapshot(), ensure_ascii=False).encode('utf-8')
+    return b'event: snapshot\ndata: ' + snapshot + b'\n\n'
+
 # Instancia global del servidor
 server_instance = None
 
-def run_server():
-    """Ejecuta el servidor web"""
+def create_threaded_server(host: str, port: int, api: Optional[GatewayAPI] = None) -> ThreadedHTTPServer:
+    """Servidor con un hilo por petición; el motor vive en un EngineLoopThread"""
     global server_instance
     
-    # Configuración del servidor
-    host = config_manager.config['web_server']['host']
-    port = config_manager.config['web_server']['port']
-    
-    server_address = (host, port)
-    httpd = ThreadedHTTPServer(server_address, SMSGatewayHandler)
+    httpd = ThreadedHTTPServer((host, port), SMSGatewayHandler)
     server_instance = httpd
     
-    # Inicializar atributos
-    server_instance.sent_messages = []
-    server_instance.received_messages = []
+    # Un solo loop para el motor: todas las peticiones usan el mismo multiplexor
+    server_instance.engine_loop = EngineLoopThread()
+    server_instance.engine_loop.start()
+    server_instance.api = api or GatewayAPI()
+    
+    return httpd
+
+def create_async_server(host: str, port: int, api: Optional[GatewayAPI] = None) -> AsyncHTTPServer:
+    """Servidor asyncio con keep-alive; el motor vive en el mismo loop"""
+    
+    api = api or GatewayAPI()
+    
+    def post(action):
+        # Cuerpo JSON inválido -> misma respuesta que el servidor con hilos
+        async def handler(request: HTTPRequest) -> HTTPResponse:
+            try:
+                data = request.json()
+            except Exception as e:
+                return HTTPResponse.json({'success': False, 'error': str(e)})
+            return HTTPResponse.json(await action(data))
+        return handler
+    
+    async def index(request):
+        return HTTPResponse.html(MAIN_INTERFACE_HTML)
+    
+    async def system_info(request):
+        loop = asyncio.get_running_loop()
+        return HTTPResponse.json(await loop.run_in_executor(None, api.system_info))
+    
+    async def get_config(request):
+        return HTTPResponse.json(api.get_config())
+    
+    def cached(request: HTTPRequest, body: bytes, etag: str) -> HTTPResponse:
+        headers = dict(CORS_HEADERS, ETag=etag)
+        headers['Cache-Control'] = 'no-cache'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return HTTPResponse(status=304, headers=headers)
+        return HTTPResponse(body=body, headers=headers)
     
+    async def get_status(request):
+        return cached(request, *api.status_body())
+    
+    async def network_info(request):
+        return cached(request, *api.network_info_body())
+    
+    async def events(request):
+        subscription = AsyncSubscription()
+        
+        async def stream():
+            try:
+                yield await _subscribe(api, subscription)
+                while not subscription.closed:
+                    event = await subscription.get(HEARTBEAT_INTERVAL)
+                    yield event.encode() if event else HEARTBEAT
+            finally:
+                api.events.unsubscribe(subscription)
+        
+        headers = dict(SSE_HEADERS, **{'Access-Control-Allow-Origin': '*'})
+        return HTTPResponse(content_type=headers.pop('Content-Type'), headers=headers, stream=stream())
+    
+    async def get_messages(request):
+        return HTTPResponse.json(await api.get_messages())
+    
+    async def get_modems(request):
+        return HTTPResponse.json(api.get_modems())
+    
+    async def get_metrics(request):
+        return HTTPResponse(body=metrics.render(), content_type=metrics.CONTENT_TYPE)
+    
+    async def save_config(data):
+        return api.save_config(data)
+    
+    async def connect(data):
+        return await api.connect()
+    
+    async def disconnect(data):
+        return await api.disconnect()
+    
+    routes = {
+        ('GET', '/'): index,
+        ('GET', '/api/system-info'): system_info,
+        ('GET', '/api/config'): get_config,
+        ('GET', '/api/status'): get_status,
+        ('GET', '/api/messages'): get_messages,
+        ('GET', '/api/modems'): get_modems,
+        ('GET', '/api/events'): events,
+        ('GET', '/network-info'): network_info,
+        ('GET', '/api/network-info'): network_info,
+        ('GET', '/metrics'): get_metrics,
+        ('POST', '/api/send'): post(api.send_sms),
+        ('POST', '/api/connect'): post(connect),
+        ('POST', '/api/disconnect'): post(disconnect),
+        ('POST', '/api/config'): post(save_config),
+        ('POST', '/api/test-port'): post(api.test_port),
+    }
+    
+    server = AsyncHTTPServer(routes, host, port)
+    server.api = api
+    return server
+
+def _print_banner(port: int, mode: str):
     print("🚀 === SMS GATEWAY MULTIPLATAFORMA ===")
-    print(f"🌐 Servidor web: http://localhost:{port}")
+    print(f"🌐 Servidor web: http://localhost:{port} ({mode})")
     print(f"💻 Sistema: {get_system_info()['os'].upper()}")
     print(f"📱 Puerto detectado: {get_system_info()['detected_modem'] or 'Auto-detectar'}")
     print("\n🔧 Funciones disponibles:")
@@ -891,6 +1286,16 @@ def run_server():
     print("   ✅ Envío y recepción SMS")
     print("   ✅ Estadísticas en tiempo real")
     print(f"\nPresiona Ctrl+C para detener")
+
+def run_server():
+    """Ejecuta el servidor web"""
+    
+    # Configuración del servidor
+    host = config_manager.config['web_server']['host']
+    port = config_manager.config['web_server']['port']
+    
+    httpd = create_threaded_server(host, port)
+    _print_banner(port, "hilos")
     
     try:
         httpd.serve_forever()
@@ -898,16 +1303,55 @@ def run_server():
         print(f"\n🛑 Deteniendo servidor...")
         
         # Desconectar gateway si está conectado
-        if hasattr(server_instance, 'engine') and server_instance.engine.is_connected:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+        api = server_instance.api
+        if api.engine.is_connected or api.pool.is_connected:
             try:
-                loop.run_until_complete(server_instance.engine.disconnect())
-            finally:
-                loop.close()
+                server_instance.engine_loop.run(api.disconnect(), QUERY_TIMEOUT)
+            except Exception as e:
+                print(f"⚠️ Error desconectando: {e}")
+        try:
+            server_instance.engine_loop.run(server_instance.api.close(), QUERY_TIMEOUT)
+        except Exception as e:
+            print(f"⚠️ Error guardando el historial: {e}")
+        server_instance.engine_loop.stop()
         
         httpd.shutdown()
         print("✅ Servidor detenido correctamente")
 
+def run_async_server():
+    """Ejecuta el servidor web asíncrono (miles de clientes keep-alive sin un hilo por cada uno)"""
+    
+    host = config_manager.config['web_server']['host']
+    port = config_manager.config['web_server']['port']
+    
+    async def serve():
+        server = create_async_server(host, port)
+        await server.start()
+        _print_banner(server.port, "asyncio")
+        try:
+            await server.serve_forever()
+        finally:
+            if server.api.engine.is_connected or server.api.pool.is_connected:
+                await server.api.disconnect()
+            await server.api.close()
+            await server.stop()
+    
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("✅ Servidor detenido correctamente")
+
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="Servidor web del SMS Gateway")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Servidor asyncio con keep-alive en lugar de un hilo por petición")
+    parser.add_argument('--debug', action='store_true', help="Log detallado (incluye tráfico AT)")
+    args = parser.parse_args()
+    
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    
+    if args.use_async or config_manager.config['web_server'].get('mode') == 'async':
+        run_async_server()
+    else:
+        run_server()
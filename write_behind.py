@@ -0,0 +1,142 @@
+"""
+Escritura Diferida de Actualizaciones (write-behind)
+Los cambios de estado de los mensajes se encolan por fila y un hilo los
+escribe agrupados en una sola transacción: muchos envíos concurrentes
+cuestan un commit (y un fsync) por lote en lugar de uno por transición
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.25   # Segundos que se esperan más actualizaciones antes de escribir
+DEFAULT_MAX_BATCH = 500
+
+class WriteBehind:
+    """Cola de actualizaciones por `id` con un hilo escritor propio
+
+        writer = WriteBehind(write_rows)     # write_rows(List[Dict]): una transacción
+        writer.start()
+        writer.submit({'id': 7, 'status': MessageStatus.SENT, 'sent_at': ...})
+        writer.flush()                       # espera a que lo encolado quede escrito
+        writer.stop()
+
+    `submit` no bloquea y se puede llamar desde cualquier hilo o desde el
+    event loop. Dos actualizaciones de la misma fila antes de escribirse se
+    combinan (la última gana campo a campo), así que una transición
+    SENDING -> SENT -> DELIVERED rápida se escribe una sola vez. Si la
+    escritura falla, las filas vuelven a la cola y se reintentan.
+    """
+
+    def __init__(self, write: Callable[[List[Dict]], Any], interval: float = DEFAULT_INTERVAL,
+                 max_batch: int = DEFAULT_MAX_BATCH, name: str = 'write-behind'):
+        self.write = write
+        self.interval = interval
+        self.max_batch = max_batch
+        self.name = name
+        self.stats = {'submitted': 0, 'rows': 0, 'batches': 0, 'errors': 0}
+        self._rows: Dict[Any, Dict] = {}
+        self._cond = threading.Condition()
+        self._writing = False
+        self._flush_requested = False
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Escribe lo pendiente y detiene el hilo"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, row: Dict):
+        with self._cond:
+            pending = self._rows.get(row['id'])
+            if pending is None:
+                self._rows[row['id']] = dict(row)
+            else:
+                pending.update(row)
+            self.stats['submitted'] += 1
+            # Despertar al escritor si estaba ocioso o si el lote ya está lleno
+            if len(self._rows) == 1 or len(self._rows) >= self.max_batch:
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Espera a que lo encolado hasta ahora quede escrito; False si no alcanzó `timeout`"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._rows or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+    def _next_batch(self) -> Optional[List[Dict]]:
+        with self._cond:
+            while not self._rows and not self._stopping:
+                self._flush_requested = False
+                self._cond.notify_all()
+                self._cond.wait()
+            if not self._rows:
+                return None
+
+            # Un momento más para juntar lo que llegue (group commit)
+            deadline = time.monotonic() + self.interval
+            while (len(self._rows) < self.max_batch and not self._stopping
+                   and not self._flush_requested):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            rows, self._rows = self._rows, {}
+            self._writing = True
+            return list(rows.values())
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            failed = False
+            try:
+                self.write(batch)
+                self.stats['batches'] += 1
+                self.stats['rows'] += len(batch)
+            except Exception as e:
+                failed = True
+                self.stats['errors'] += 1
+                logger.error(f"❌ [{self.name}] No se pudieron escribir {len(batch)} filas: {e}")
+                with self._cond:
+                    # Lo encolado mientras tanto es más nuevo y tiene prioridad
+                    for row in batch:
+                        self._rows[row['id']] = {**row, **self._rows.get(row['id'], {})}
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+            if failed:
+                if self._stopping:
+                    return
+                time.sleep(self.interval)